@@ -0,0 +1,313 @@
+#!/usr/bin/env python
+
+"""Benchmark the KCNA collector/reporter pipeline (queue, jsonify, import, report) on a synthetic corpus, saving results as JSON."""
+
+# Runs every stage in this process against a scratch copy of the project's
+#  data directories, either against the local mongod configured in
+#  etc/nkir.ini (using a separate NKODP_benchmark database), or against an
+#  in-process mongomock stand-in (`pip install mongomock`).
+
+import argparse
+import datetime
+import json
+import logging
+import multiprocessing
+import os
+import re
+import resource
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+import synthetic_kcna
+
+SCRIPT_ROOT = os.path.dirname(os.path.realpath(__file__))
+PROJECT_ROOT_REGEX = re.search("^(.*)/src/.*$", SCRIPT_ROOT)
+PROJECT_ROOT = PROJECT_ROOT_REGEX.group(1)
+TIME_START = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+RESULTS_ROOT = os.path.join(PROJECT_ROOT, 'var/benchmarks')
+BENCHMARK_DB_NAME = 'NKODP_benchmark'
+
+# make our pipeline's modules importable
+sys.path.append(os.path.join(PROJECT_ROOT, 'src'))
+sys.path.append(os.path.join(PROJECT_ROOT, 'src/collectors/collector_kcna'))
+sys.path.append(os.path.join(PROJECT_ROOT, 'src/reporters/reporter_kcna'))
+
+import dbimporter_kcna
+import jsonifier_kcna
+import map_countries_kcna
+import queuer_kcna
+from nkir import config as nkir_config
+from nkir import db as nkir_db
+from nkir import journal
+from nkir import logs
+
+# RSSSampler tracks peak resident set size while a stage runs, by polling
+#  /proc/self/statm (falling back on the process lifetime peak from getrusage
+#  where /proc isn't available)
+class RSSSampler(object):
+    INTERVAL = 0.01
+
+    def __init__(self):
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _get_rss(self):
+        try:
+            with open('/proc/self/statm') as f:
+                return int(f.read().split()[1]) * resource.getpagesize()
+        except IOError:
+            # ru_maxrss is in KB on linux, bytes on Mac OS
+            maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            return maxrss if sys.platform == 'darwin' else maxrss * 1024
+
+    def _sample(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, self._get_rss())
+            time.sleep(self.INTERVAL)
+
+    def __enter__(self):
+        self.peak = self._get_rss()
+        self._thread = threading.Thread(target=self._sample)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, self._get_rss())
+
+# _timed wraps module.name so that every call appends its duration, divided
+#  between the items the call processed, to latencies
+def _timed(module, name, latencies, get_items=lambda args: 1):
+    original = getattr(module, name)
+
+    def wrapper(*args, **kwargs):
+        time_start = time.time()
+        try:
+            return original(*args, **kwargs)
+        finally:
+            items = get_items(args)
+            if items:
+                latencies.extend([(time.time() - time_start) / items] * items)
+
+    setattr(module, name, wrapper)
+    return original
+
+def _percentile(sorted_values, percent):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(percent / 100.0 * len(sorted_values) + 0.5)) - 1)
+    return sorted_values[max(index, 0)]
+
+# _run_stage runs stage(), returning its summary of articles/sec, per-article
+#  latency percentiles, and peak RSS
+def _run_stage(name, stage, latencies):
+    with RSSSampler() as rss:
+        time_start = time.time()
+        stage()
+        seconds = time.time() - time_start
+
+    latencies = sorted(latencies)
+    summary = {
+        'articles':         len(latencies),
+        'seconds':          seconds,
+        'articles_per_sec': len(latencies) / seconds if seconds else None,
+        'p50_ms':           _percentile(latencies, 50) * 1000 if latencies else None,
+        'p99_ms':           _percentile(latencies, 99) * 1000 if latencies else None,
+        'peak_rss_mb':      rss.peak / (1024.0 * 1024.0),
+    }
+    print("{:<8} {articles:>8} articles {seconds:>9.2f}s {articles_per_sec:>10.1f}/s  "
+          "p50 {p50_ms:>8.3f}ms  p99 {p99_ms:>8.3f}ms  peak RSS {peak_rss_mb:>8.1f}MB".format(name, **summary))
+    return summary
+
+# _use_scratch_root points every pipeline module's data, output and log paths
+#  in to scratch_root, so a benchmark never touches real project data
+def _use_scratch_root(scratch_root, mirror_root):
+    collector_root = os.path.join(scratch_root, 'data/collector_kcna')
+    logs_root = os.path.join(scratch_root, 'var/logs')
+    os.makedirs(logs_root)
+
+    queuer_kcna.LOG_FILE_NAME = os.path.join(logs_root, 'queuer_kcna.log')
+    queuer_kcna.QUEUER_INBOX_ROOT = os.path.join(collector_root, 'inbox_queuer')
+    queuer_kcna.QUEUEUR_INBOX_ARCHIVE = os.path.join(collector_root, 'inbox_queuer/archive')
+    queuer_kcna.JSON_INBOX_ROOT = os.path.join(collector_root, 'inbox_json')
+    queuer_kcna.MIRROR_ROOT = mirror_root
+    queuer_kcna.LAST_COMMIT_PATH = os.path.join(collector_root, 'queuer_kcna.last_commit')
+    queuer_kcna.JOURNAL_PATH = os.path.join(collector_root, 'journal_kcna.sqlite')
+
+    jsonifier_kcna.LOG_FILE_PATH = os.path.join(logs_root, 'jsonifier_kcna.log')
+    jsonifier_kcna.INBOX_JSON_ROOT = os.path.join(collector_root, 'inbox_json')
+    jsonifier_kcna.INBOX_JSON_ARCHIVE = os.path.join(collector_root, 'inbox_json/archive')
+    jsonifier_kcna.INBOX_DB_ROOT = os.path.join(collector_root, 'inbox_db')
+    jsonifier_kcna.LANGDETECT_MODEL_PATH = os.path.join(collector_root, 'langdetect_model.json')
+    jsonifier_kcna.LANGDETECT_CACHE_PATH = os.path.join(collector_root, 'langdetect_cache.sqlite')
+    jsonifier_kcna.JOURNAL_PATH = os.path.join(collector_root, 'journal_kcna.sqlite')
+
+    dbimporter_kcna.LOG_FILE_PATH = os.path.join(logs_root, 'dbimporter_kcna.log')
+    dbimporter_kcna.INBOX_DB_ROOT = os.path.join(collector_root, 'inbox_db')
+    dbimporter_kcna.INBOX_DB_ARCHIVE = os.path.join(collector_root, 'inbox_db/archive')
+    dbimporter_kcna.JOURNAL_PATH = os.path.join(collector_root, 'journal_kcna.sqlite')
+
+    map_countries_kcna.LOG_FILE_PATH = os.path.join(logs_root, 'map_countries_kcna.log')
+    map_countries_kcna.OUTPUT_ROOT = os.path.join(scratch_root, 'data/reporter_kcna/output_map_countries_kcna')
+    map_countries_kcna.PUBLISH_ROOT = os.path.join(scratch_root, 'srv/public_html')
+    map_countries_kcna.PUBLISH_COUNTRIES_ROOT = os.path.join(scratch_root, 'srv/public_html/map_countries_kcna')
+
+# _use_benchmark_logger sends every stage's logging to one scratch logfile,
+#  and to the console only if show_logs, instead of each stage's own logger
+def _use_benchmark_logger(scratch_root, show_logs):
+    logs.get_logger(os.path.join(scratch_root, 'var/logs/bench_pipeline_kcna.log'), console=show_logs)
+
+    for module in [queuer_kcna, jsonifier_kcna, dbimporter_kcna, map_countries_kcna]:
+        module._get_logger = lambda: logging.getLogger('')
+
+# _use_benchmark_db points nkir.db at a scratch database, on our configured
+#  mongod or in an in-process mongomock stand-in
+def _use_benchmark_db(backend):
+    nkir_config.get_config().set('mongodb', 'db_name', BENCHMARK_DB_NAME)
+
+    if backend == 'mongomock':
+        import mongomock
+        client = mongomock.MongoClient()
+        nkir_db.get_client = lambda: client
+
+    nkir_db.get_client().drop_database(BENCHMARK_DB_NAME)
+
+def _stage_queue():
+    sys.argv = ['queuer_kcna.py']
+    queuer_kcna.main()
+
+# _stage_jsonify does what jsonifier_kcna.main() does, but keeps the per-article
+#  timings its (possibly forked) workers report back
+def _stage_jsonify(workers, latencies):
+    jsonifier_kcna.DETECTOR = jsonifier_kcna._get_detector()
+    for directory in [jsonifier_kcna.INBOX_JSON_ARCHIVE, os.path.join(jsonifier_kcna.INBOX_JSON_ARCHIVE, 'spanish'),
+                      jsonifier_kcna.INBOX_DB_ROOT]:
+        if( not os.path.exists(directory) ):
+            os.makedirs(directory)
+
+    jsonifier_kcna.JOURNAL = journal.Journal(jsonifier_kcna.JOURNAL_PATH)
+    html_filenames = jsonifier_kcna.JOURNAL.iter_claims('jsonify')
+    pool = multiprocessing.Pool(workers)
+    try:
+        for html_filename, ok, worker_pid, seconds, worker_metrics in pool.imap_unordered(jsonifier_kcna._process_html_file, html_filenames):
+            latencies.append(seconds)
+    finally:
+        pool.close()
+        pool.join()
+
+def _stage_import(batch_size):
+    sys.argv = ['dbimporter_kcna.py', '--batch-size', str(batch_size)]
+    dbimporter_kcna.main()
+
+def _stage_report():
+    sys.argv = ['map_countries_kcna.py', '--full']
+    map_countries_kcna.main()
+
+# _compare prints how this run's throughput compares to an earlier results file
+def _compare(results, other_results_path):
+    with open(other_results_path) as f:
+        other_results = json.load(f)
+
+    print("\nCompared to {}:".format(other_results_path))
+    for name, summary in results['stages'].items():
+        other_summary = other_results['stages'].get(name)
+        if not other_summary or not other_summary['articles_per_sec'] or not summary['articles_per_sec']:
+            continue
+        print("{:<8} {:>8.2f}x articles/sec, {:>8.2f}x peak RSS".format(
+              name, summary['articles_per_sec'] / other_summary['articles_per_sec'],
+              summary['peak_rss_mb'] / other_summary['peak_rss_mb']))
+
+# _get_args parses command line arguments
+def _get_args():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--articles', type=int, default=1000,
+                        help="number of synthetic articles, from 1000 to 1000000 (default: 1000)")
+    parser.add_argument('--split-old', type=float, default=0.5,
+                        help="fraction of articles in old style daily pages (default: 0.5)")
+    parser.add_argument('--db', choices=['mongod', 'mongomock'], default='mongod',
+                        help="import/report against our configured mongod, or in-process mongomock (default: mongod)")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="jsonifier_kcna worker processes (default: 1)")
+    parser.add_argument('--batch-size', type=int, default=1000,
+                        help="dbimporter_kcna bulk write batch size (default: 1000)")
+    parser.add_argument('--compare', metavar='RESULTS_JSON',
+                        help="compare against an earlier run's results file")
+    parser.add_argument('--keep', action='store_true',
+                        help="keep the scratch directory (corpus, inboxes, outputs) after running")
+    parser.add_argument('--show-logs', action='store_true',
+                        help="show pipeline console logging while stages run")
+    return parser.parse_args()
+
+def main():
+    args = _get_args()
+    scratch_root = tempfile.mkdtemp(prefix='bench_pipeline_kcna_')
+    mirror_root = os.path.join(scratch_root, 'data/collector_kcna/mirror/www.kcna.co.jp')
+
+    try:
+        print("Generating {} synthetic articles in {}...".format(args.articles, mirror_root))
+        time_start = time.time()
+        pages = synthetic_kcna.generate(mirror_root, args.articles, args.split_old)
+        print("Generated {} pages in {:.2f}s.\n".format(pages, time.time() - time_start))
+
+        _use_scratch_root(scratch_root, mirror_root)
+        _use_benchmark_logger(scratch_root, args.show_logs)
+        _use_benchmark_db(args.db)
+
+        queue_latencies = []
+        jsonify_latencies = []
+        import_latencies = []
+        report_latencies = []
+
+        _timed(queuer_kcna, '_enqueue_article', queue_latencies)
+        _timed(dbimporter_kcna, '_upsert_batch', import_latencies, lambda args: len(args[1]))
+        _timed(map_countries_kcna.MentionScanner, 'scan', report_latencies)
+
+        results = {
+            'started': TIME_START,
+            'config': {
+                'articles':   args.articles,
+                'pages':      pages,
+                'split_old':  args.split_old,
+                'db':         args.db,
+                'workers':    args.workers,
+                'batch_size': args.batch_size,
+                'cpus':       multiprocessing.cpu_count(),
+            },
+            'stages': {},
+        }
+        results['stages']['queue'] = _run_stage('queue', _stage_queue, queue_latencies)
+        results['stages']['jsonify'] = _run_stage('jsonify', lambda: _stage_jsonify(args.workers, jsonify_latencies), jsonify_latencies)
+        results['stages']['import'] = _run_stage('import', lambda: _stage_import(args.batch_size), import_latencies)
+        results['stages']['report'] = _run_stage('report', _stage_report, report_latencies)
+
+        if not os.path.exists(RESULTS_ROOT):
+            os.makedirs(RESULTS_ROOT)
+        results_path = os.path.join(RESULTS_ROOT, 'bench_pipeline_kcna_' + TIME_START + '.json')
+        with open(results_path, 'w') as f:
+            json.dump(results, f, indent=4, sort_keys=True)
+        print("\nSaved results to {}.".format(results_path))
+
+        if args.compare:
+            _compare(results, args.compare)
+    finally:
+        if args.db == 'mongod':
+            nkir_db.get_client().drop_database(BENCHMARK_DB_NAME)
+        # write out every queued log record before the scratch logs go
+        logs.stop()
+        if args.keep:
+            print("Kept scratch directory {}.".format(scratch_root))
+        else:
+            shutil.rmtree(scratch_root)
+        logging.shutdown()
+
+    return(0)
+
+if(__name__ == '__main__'):
+    main()
+    sys.exit(0)
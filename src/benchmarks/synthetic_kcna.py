@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+
+"""Generate a synthetic KCNA-style mirror (old and new article naming schemes) as a git repo, for benchmarking the NKIR pipeline."""
+
+import argparse
+import datetime
+import os
+import random
+import re
+import subprocess
+import sys
+
+SCRIPT_ROOT = os.path.dirname(os.path.realpath(__file__))
+PROJECT_ROOT_REGEX = re.search("^(.*)/src/.*$", SCRIPT_ROOT)
+PROJECT_ROOT = PROJECT_ROOT_REGEX.group(1)
+COUNTRIES_FILE_PATH = os.path.join(PROJECT_ROOT, 'var/datasets/admin3-country-aliases.txt')
+
+# KCNA switched from one multi-article .htm file per day to one .html file per
+#  article on this date
+NEW_SCHEME_START = datetime.date(2008, 10, 1)
+FIRST_DATE = datetime.date(1997, 1, 1)
+
+WORDS = ("the people party leader army workers great revolution national "
+         "anniversary delegation meeting friendship visit socialist construction "
+         "statement spokesman imperialists provocation peace reunification "
+         "sovereignty congratulatory message president country developing").split()
+
+SPANISH_WORDS = ("el pueblo partido dirigente ejercito trabajadores gran revolucion "
+                 "nacional aniversario delegacion reunion amistad visita socialista "
+                 "construccion declaracion portavoz imperialistas paz reunificacion").split()
+
+PAGE_TEMPLATE = """<html>
+<head><title>KCNA</title></head>
+<body>
+<p><a href="../../../../index-e.htm">Home</a> &gt;&gt; {date} Juche {juche_year}</p>
+{articles}
+<p>Copyright (C) KOREA NEWS SERVICE(KNS) All Rights Reserved.</p>
+</body>
+</html>
+"""
+
+ARTICLE_TEMPLATE = """<p>{title}</p>
+{paragraphs}
+"""
+
+# _get_aliases returns a flat list of every country alias we search for, so
+#  generated articles mention countries as often as real ones do
+def _get_aliases():
+    aliases = []
+    with open(COUNTRIES_FILE_PATH) as f:
+        for line in f:
+            aliases.extend(line.rstrip("\n").split("|")[1].split(";"))
+    return aliases
+
+def _get_sentence(rng, words, aliases, length):
+    sentence = [rng.choice(words) for i in range(length)]
+    if aliases and rng.random() < 0.5:
+        sentence.insert(rng.randrange(len(sentence)), rng.choice(aliases))
+    return " ".join(sentence)
+
+def _get_article(rng, date, aliases, spanish):
+    words = SPANISH_WORDS if spanish else WORDS
+    title = _get_sentence(rng, words, aliases, rng.randint(4, 9)).title()
+    paragraphs = ["{}, {} {} (KCNA) -- {}.".format(rng.choice(["Pyongyang", "Havana", "Beijing", "Moscow"]),
+                                                   date.strftime("%B"), date.day,
+                                                   _get_sentence(rng, words, aliases, rng.randint(20, 40)))]
+    for i in range(rng.randint(2, 8)):
+        paragraphs.append(_get_sentence(rng, words, aliases, rng.randint(20, 60)) + ".")
+    return ARTICLE_TEMPLATE.format(title=title,
+                                   paragraphs="\n".join("<p>{}</p>".format(p) for p in paragraphs))
+
+def _get_page(date, articles):
+    return PAGE_TEMPLATE.format(date="{} {} {}".format(date.strftime("%B"), date.day, date.year),
+                                juche_year=date.year - 1911,
+                                articles="".join(articles))
+
+# _get_dir returns a day's directory, matching KCNA's layouts of:
+#   item/1997/9701/news1/         (old scheme, pre 2000)
+#   item/2000/200001/news01/      (old scheme, from 2000)
+#   item/2008/200810/news01/      (new scheme)
+def _get_dir(date):
+    if date.year < 2000:
+        return "item/{}/{}{:02d}/news{}".format(date.year, str(date.year)[2:], date.month, date.day)
+    return "item/{}/{}{:02d}/news{:02d}".format(date.year, date.year, date.month, date.day)
+
+# generate writes a mirror of about articles articles to mirror_root, a
+#  fraction split_old of them in old style daily pages and the rest in new
+#  style per-article pages, with spanish_ratio of new style articles in
+#  spanish, and commits it all to a git repo. Returns the number of pages.
+def generate(mirror_root, articles, split_old=0.5, articles_per_day=10, spanish_ratio=0.1, seed=0):
+    rng = random.Random(seed)
+    aliases = _get_aliases()
+
+    # old style pages only go back to FIRST_DATE, so at large scales pack more
+    #  articles in to each old style daily page
+    old_articles = int(articles * split_old)
+    max_old_days = (NEW_SCHEME_START - FIRST_DATE).days
+    old_articles_per_day = max(articles_per_day, -(-old_articles // max_old_days))
+    old_days = old_articles // old_articles_per_day
+    new_days = (articles - old_days * old_articles_per_day) // articles_per_day
+
+    pages = 0
+    days = [NEW_SCHEME_START - datetime.timedelta(days=old_days - i) for i in range(old_days)]
+    days += [NEW_SCHEME_START + datetime.timedelta(days=i) for i in range(new_days)]
+    for date in days:
+        day_dir = os.path.join(mirror_root, _get_dir(date))
+        if not os.path.exists(day_dir):
+            os.makedirs(day_dir)
+
+        if date < NEW_SCHEME_START:
+            day_articles = [_get_article(rng, date, aliases, False) for i in range(old_articles_per_day)]
+            with open(os.path.join(day_dir, "{:02d}.htm".format(date.day)), 'w') as f:
+                f.write(_get_page(date, day_articles))
+            pages += 1
+        else:
+            for i in range(1, articles_per_day + 1):
+                # spanish articles turn up under english (-NNee) page names
+                #  too, which is why jsonifier_kcna checks each title's language
+                spanish = rng.random() < spanish_ratio
+                page_name = "{}-{:02d}ee.html".format(date.strftime("%Y%m%d"), i)
+                with open(os.path.join(day_dir, page_name), 'w') as f:
+                    f.write(_get_page(date, [_get_article(rng, date, aliases, spanish)]))
+                pages += 1
+
+    git = ['git', '--git-dir=' + os.path.join(mirror_root, '.git'), '--work-tree=' + mirror_root]
+    if not os.path.exists(os.path.join(mirror_root, '.git')):
+        subprocess.check_call(git + ['init', '--quiet'])
+    subprocess.check_call(git + ['add', '.'])
+    subprocess.check_call(git + ['-c', 'user.name=nkir', '-c', 'user.email=nkir@localhost',
+                                 'commit', '--quiet', '-m', 'synthetic corpus'])
+
+    return pages
+
+# _get_args parses command line arguments
+def _get_args():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('mirror_root', help="directory to write the synthetic www.kcna.co.jp mirror to")
+    parser.add_argument('--articles', type=int, default=1000, help="number of articles to generate (default: 1000)")
+    parser.add_argument('--split-old', type=float, default=0.5, help="fraction of articles in old style daily pages (default: 0.5)")
+    parser.add_argument('--seed', type=int, default=0, help="random seed (default: 0)")
+    return parser.parse_args()
+
+def main():
+    args = _get_args()
+    pages = generate(args.mirror_root, args.articles, args.split_old, seed=args.seed)
+    print("Generated {} pages holding {} articles in {}.".format(pages, args.articles, args.mirror_root))
+    return(0)
+
+if(__name__ == '__main__'):
+    main()
+    sys.exit(0)
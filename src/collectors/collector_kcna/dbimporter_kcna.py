@@ -1,54 +1,360 @@
 #!/usr/bin/env python
 
-"""Insert JSON documents queued in INBOX_JSON_ROOT into MongoDB."""
+"""Upsert JSON documents queued in INBOX_DB_ROOT into MongoDB."""
 
+import argparse
 import datetime
+import hashlib
 import logging
 import json
 import os
 import re
 import shutil
 import sys
+import time
 
-from pymongo import MongoClient
+from pymongo.errors import AutoReconnect, BulkWriteError
 
-DB_HOST = 'localhost'
-DB_PORT = 28017
-DB_NAME = 'NKODP'
 COLLECTION_NAME = 'KCNA'
+BATCH_ATTEMPTS = 3
 
 SCRIPT_ROOT = os.path.dirname(os.path.realpath(__file__))
 PROJECT_ROOT_REGEX = re.search("^(.*)/src/.*$", SCRIPT_ROOT)
 PROJECT_ROOT = PROJECT_ROOT_REGEX.group(1)
+
+# make our shared nkir library importable
+sys.path.append(os.path.join(PROJECT_ROOT, 'src'))
+from nkir import columnar
+from nkir import dates
+from nkir import db as nkir_db
+from nkir import journal
+from nkir import logs
+from nkir import metrics
+from nkir import tokens as nkir_tokens
+
 TIME_START = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
 LOG_FILE_PATH = os.path.join(PROJECT_ROOT, 'var/logs/dbimporter_kcna_'+TIME_START+'.log')
 INBOX_DB_ROOT = os.path.join(PROJECT_ROOT, 'data/collector_kcna/inbox_db')
 INBOX_DB_ARCHIVE = os.path.join(INBOX_DB_ROOT, 'archive')
+COLUMNAR_ROOT = os.path.join(PROJECT_ROOT, 'data/collector_kcna/columnar_kcna')
+JOURNAL_PATH = os.path.join(PROJECT_ROOT, 'data/collector_kcna/journal_kcna.sqlite')
+
+# pipeline journal, which records each JSON file's progress if set
+JOURNAL = None
 
+# instantiate a logging object singleton for use throughout script, see
+#  nkir.logs
 def _get_logger():
-    logs_root_dir = re.search("^(.*/logs)/.*$", LOG_FILE_PATH).group(1)
+    return logs.get_logger(LOG_FILE_PATH)
+
+# _get_content_hash returns a hash of an article's content, ignoring fields
+#  that change whenever a mirror run re-touches an unchanged HTML file, but
+#  not the version of its token stream, so that an unchanged article is still
+#  rewritten once tokenized differently
+def _get_content_hash(json_data):
+    data = dict(json_data['data'])
+    data['metadata'] = dict(data.get('metadata', {}))
+    data['metadata'].pop('html_modified', None)
+    return hashlib.sha1(json.dumps([data, json_data.get('tokens_version')], sort_keys=True)).hexdigest()
+
+# _has_unique_url_index returns True if coll has the unique article url index
+#  that upserts rely on
+def _has_unique_url_index(coll):
+    for index in coll.index_information().values():
+        if index.get('unique') and [field for field, direction in index['key']] == ['data.metadata.article_url']:
+            return True
+    return False
+
+# _ensure_unique_urls creates the unique article url index that upserts rely
+#  on, if it's missing, first removing any duplicate articles imported before
+#  we upserted on article url (keeping the most recently inserted copy). Once
+#  the index exists, neither is needed again, so runs after the first only
+#  check that it does.
+def _ensure_unique_urls(coll):
+    logger = logging.getLogger('')
+
+    if _has_unique_url_index(coll):
+        return
+
+    _PIPELINE = [
+        { "$group": { "_id":   "$data.metadata.article_url",
+                      "ids":   { "$push": "$_id" },
+                      "count": { "$sum": 1 } } },
+        { "$match": { "count": { "$gt": 1 } } },
+    ]
+
+    removed = 0
+    for duplicate in coll.aggregate(_PIPELINE, cursor={}, allowDiskUse=True):
+        stale_ids = sorted(duplicate['ids'])[:-1]
+        coll.remove({'_id': {'$in': stale_ids}})
+        removed += len(stale_ids)
+
+    if removed:
+        logger.info("Removed {} duplicate articles from {}.".format(removed, COLLECTION_NAME))
+
+    coll.create_index('data.metadata.article_url', unique=True)
+    logger.info("Created unique article url index on {}.".format(COLLECTION_NAME))
+
+# _upsert_batch upserts a batch of (json_filename, json_data) tuples keyed on
+#  article url with one unordered bulk write, returning a tuple of:
+#   (list of acknowledged json_filenames, dict of failed json_filename: error,
+#    number of unchanged documents that were skipped)
+#
+# Documents whose content hash matches what's already in MongoDB (eg. after a
+#  full mirror re-touches old files) are acknowledged without any write, and
+#  because upserts are idempotent a batch can simply be retried (eg. after
+#  losing our connection mid-write) without duplicating anything.
+def _upsert_batch(coll, batch):
+    logger = logging.getLogger('')
+
+    # if the same article is queued more than once, only the last one queued
+    #  is written, and the others are acknowledged along with it
+    latest = {}
+    for json_filename, json_data in batch:
+        json_data['content_hash'] = _get_content_hash(json_data)
+        latest[json_data['data']['metadata']['article_url']] = (json_filename, json_data)
+
+    existing = {}
+    with metrics.timer('dbimporter.mongo_find_existing'):
+        for doc in coll.find({'data.metadata.article_url': {'$in': list(latest)}},
+                             {'_id': 0, 'data.metadata.article_url': 1, 'content_hash': 1}):
+            existing[doc['data']['metadata']['article_url']] = doc.get('content_hash')
+
+    writes = []
+    for article_url, (json_filename, json_data) in latest.items():
+        if existing.get(article_url) != json_data['content_hash']:
+            writes.append((article_url, json_filename, json_data))
+    skipped = len(latest) - len(writes)
+
+    failed = {}
+    if writes:
+        for attempt in range(1, BATCH_ATTEMPTS + 1):
+            bulk = coll.initialize_unordered_bulk_op()
+            for article_url, json_filename, json_data in writes:
+                bulk.find({'data.metadata.article_url': article_url}).upsert().replace_one(json_data)
+
+            try:
+                with metrics.timer('dbimporter.mongo_bulk_upsert'):
+                    bulk.execute()
+            except BulkWriteError as e:
+                for write_error in e.details['writeErrors']:
+                    failed[writes[write_error['index']][1]] = write_error['errmsg']
+                break
+            except AutoReconnect as e:
+                logger.warning("AutoReconnect: {} when upserting batch of {} documents (attempt {} of {}).".format(e, len(writes), attempt, BATCH_ATTEMPTS))
+                metrics.count('dbimporter.mongo_retries')
+                time.sleep(attempt)
+            else:
+                break
+        else:
+            for article_url, json_filename, json_data in writes:
+                failed[json_filename] = 'batch upsert failed after {} attempts'.format(BATCH_ATTEMPTS)
+
+    # a queued duplicate is only acknowledged if the copy written for it was
+    failed_urls = set(json_data['data']['metadata']['article_url'] for json_filename, json_data in batch if json_filename in failed)
+    for json_filename, json_data in batch:
+        if json_data['data']['metadata']['article_url'] in failed_urls and json_filename not in failed:
+            failed[json_filename] = 'a later copy of this article failed to upsert'
+
+    # articles split out of an old style daily page replace the single whole
+    #  page document imported before jsonifier_kcna split them
+    parent_urls = set(json_data['data']['metadata']['parent_url'] for article_url, json_filename, json_data in writes
+                      if json_filename not in failed and 'parent_url' in json_data['data']['metadata'])
+    if parent_urls:
+        with metrics.timer('dbimporter.mongo_remove_unsplit'):
+            coll.remove({'data.metadata.article_url': {'$in': list(parent_urls)}})
+
+    acknowledged = [json_filename for json_filename, json_data in batch if json_filename not in failed]
+    metrics.count('dbimporter.articles_written', len(writes))
+    metrics.count('dbimporter.articles_unchanged', skipped)
+    metrics.count('dbimporter.articles_failed', len(failed))
+    return acknowledged, failed, skipped
+
+# _import_batch upserts a batch of documents in to MongoDB (if coll isn't
+#  None) and appends them to our columnar store (if store isn't None), records
+#  them in JOURNAL (if set), and archives the JSON files of those which were
+#  stored ok, returning a tuple of:
+#   (number of files archived, number of unchanged documents skipped)
+def _import_batch(coll, store, batch):
+    logger = logging.getLogger('')
+
+    if coll is not None:
+        acknowledged, failed, skipped = _upsert_batch(coll, batch)
+    else:
+        acknowledged, failed, skipped = [json_filename for json_filename, json_data in batch], {}, 0
+
+    # the store is append only, and keeps only the latest copy of an article
+    #  when read, so unchanged documents are simply appended again
+    if store is not None and acknowledged:
+        acknowledged_filenames = set(acknowledged)
+        with metrics.timer('dbimporter.columnar_append'):
+            store.append([columnar.get_row(json_data) for json_filename, json_data in batch
+                          if json_filename in acknowledged_filenames])
+
+    for json_filename in sorted(failed):
+        logger.warning("MongoDB upsert error: {} was not successfully imported: {}".format(os.path.join(INBOX_DB_ROOT,json_filename), failed[json_filename]))
+
+    # upserts are idempotent, so a crash before this just imports the batch
+    #  again on the next run
+    if JOURNAL is not None:
+        with metrics.timer('dbimporter.journal_update'):
+            JOURNAL.finish('import', acknowledged)
+            for json_filename in sorted(failed):
+                JOURNAL.fail('import', json_filename, failed[json_filename])
+
+    if( not os.path.exists(INBOX_DB_ARCHIVE) ):
+        os.makedirs(INBOX_DB_ARCHIVE)
+
+    for json_filename in acknowledged:
+        logger.info("Successfully imported %s in to %s.", json_filename, COLLECTION_NAME)
+
+        json_file_path = os.path.join(INBOX_DB_ROOT,json_filename)
+        json_file_archive_path = os.path.join(INBOX_DB_ARCHIVE,json_filename)
+        try:
+            with metrics.timer('dbimporter.file_move'):
+                shutil.move(json_file_path, json_file_archive_path)
+        except IOError as e:
+            logger.warning("I/O error: {} when attempting move [{}] to [{}]".format(e.strerror, json_file_path, json_file_archive_path))
+        else:
+            logger.debug("Moved %s to DBIMPORTER_INBOX's archive.", json_file_path)
+
+    return len(acknowledged), skipped
 
-    if( not os.path.exists(logs_root_dir) ):
-        os.makedirs(logs_root_dir)
+# ensure_indexes ensures the indexes that searches and reporters rely on
+def ensure_indexes(coll):
+    logger = logging.getLogger('')
 
-    # init the root logger (which logs to persistent local logfile)
-    logging.basicConfig(filename=LOG_FILE_PATH,
-                        format='%(asctime)s: %(levelname)-8s: %(message)s',
-                        datefmt='%m/%d/%Y %I:%M:%S %p',
-                        level=logging.DEBUG)
+    # Ensure that text search index exists now, so that it can process text index in the background
+    with metrics.timer('dbimporter.ensure_text_index'):
+        coll.ensure_index([
+            ('data.text', 'text'),
+            ('data.metadata.title', 'text'),
+            ('data.metadata.location', 'text'),
+            ('data.metadata.news_service', 'text')],
+            weights={'data.text': 5, 'data.metadata.title': 10, 'data.metadata.location': 10, 'data.metadata.news_service': 1})
+    logger.info("completed ensuring MongoDB text index updated.")
+
+    # Ensure that import time index exists, for reporters' incremental runs
+    coll.ensure_index('imported')
+    logger.info("completed ensuring MongoDB import time index updated.")
+
+# import_json_files imports json_filenames (queued in INBOX_DB_ROOT) in
+#  batches of batch_size in to coll and/or store (either may be None),
+#  returning a tuple of:
+#   (number of files, number imported, number of unchanged documents skipped)
+def import_json_files(coll, store, json_filenames, batch_size):
+    logger = logging.getLogger('')
+
+    # parse and upsert json documents in batches
+    total_articles = 0
+    processed_articles = 0
+    skipped_articles = 0
+    batch = []
+    for json_filename in json_filenames:
+        total_articles += 1
+        json_file_path = os.path.join(INBOX_DB_ROOT,json_filename)
+        logger.debug("JSON_FILE_PATH %s", json_file_path)
+
+        # open JSON document, queue it for upsert in to MongoDB
+        try:
+            with open(json_file_path) as json_file:
+                with metrics.timer('dbimporter.json_load'):
+                    json_data = json.load(json_file)
+        except IOError as e:
+            logger.warning("I/O error: {} when attempting to open [{}].".format(e.strerror, json_file_path))
+            if JOURNAL is not None:
+                JOURNAL.fail('import', json_filename, e.strerror)
+            continue
+        except ValueError as e:
+            logger.warning("ValueError: {} when attempting to json.load [{}].".format(e, json_file_path))
+            if JOURNAL is not None:
+                JOURNAL.fail('import', json_filename, str(e))
+            continue
+
+        # stamp import time, so reporters can process only new articles
+        json_data['imported'] = datetime.datetime.utcnow()
+        _add_derived_fields(json_data)
+        batch.append((json_filename, json_data))
+
+        if len(batch) >= batch_size:
+            imported, skipped = _import_batch(coll, store, batch)
+            processed_articles += imported
+            skipped_articles += skipped
+            batch = []
+
+    if batch:
+        imported, skipped = _import_batch(coll, store, batch)
+        processed_articles += imported
+        skipped_articles += skipped
+
+    return total_articles, processed_articles, skipped_articles
+
+# _add_derived_fields adds the fields reporters read instead of an article's
+#  own data: its token stream to match against, and its publish date as a
+#  native datetime (if it has one), so reporters never parse date strings
+def _add_derived_fields(json_data):
+    with metrics.timer('dbimporter.tokenize'):
+        json_data['tokens'] = nkir_tokens.get_article_stream(json_data)
+    json_data['tokens_version'] = nkir_tokens.VERSION
+
+    published = dates.get_datetime(json_data['data'].get('metadata', {}).get('date_published'))
+    if published is not None:
+        json_data['published'] = published
+
+# update_existing adds derived fields (see _add_derived_fields) to every
+#  article in coll imported before we derived them (or with an old tokenizer
+#  version), in batches of batch_size, returning how many it updated
+def update_existing(coll, batch_size):
+    logger = logging.getLogger('')
 
-    # configure console logger
-    _console_logger = logging.StreamHandler()
-    _console_logger.setLevel(logging.INFO) #DEV: Can modify tthis level
-    _formatter = logging.Formatter('%(levelname)-8s %(message)s')
-    _console_logger.setFormatter(_formatter)
+    updated = 0
+    bulk = None
+    cursor = coll.find({'$or': [{'tokens_version': {'$ne': nkir_tokens.VERSION}},
+                                {'published': {'$exists': False}}]}, {'data': 1})
+    for doc in metrics.timed_iter('dbimporter.mongo_find_underived', cursor):
+        if bulk is None:
+            bulk = coll.initialize_unordered_bulk_op()
+        _add_derived_fields(doc)
+        derived = {'tokens':         doc['tokens'],
+                   'tokens_version': doc['tokens_version'],
+                   'content_hash':   _get_content_hash(doc)}
+        if 'published' in doc:
+            derived['published'] = doc['published']
+        bulk.find({'_id': doc['_id']}).update_one({'$set': derived})
+        updated += 1
 
-    # add the console logger to root (file) logging handler
-    _root_logger = logging.getLogger('')
-    _root_logger.addHandler(_console_logger)
-    return _root_logger
+        if updated % batch_size == 0:
+            with metrics.timer('dbimporter.mongo_bulk_update_existing'):
+                bulk.execute()
+            bulk = None
+            logger.info("Updated {} existing articles.".format(updated))
+
+    if bulk is not None:
+        with metrics.timer('dbimporter.mongo_bulk_update_existing'):
+            bulk.execute()
+
+    logger.info("Added derived fields to {} existing articles in total.".format(updated))
+    return updated
+
+# _get_args parses command line arguments
+def _get_args():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--batch-size', type=int, default=1000,
+                        help="number of documents inserted per bulk write (default: 1000)")
+    parser.add_argument('--store', choices=['mongo', 'columnar', 'both'], default='mongo',
+                        help="import in to MongoDB, a columnar (Parquet) store in COLUMNAR_ROOT needing pyarrow, or both (default: mongo)")
+    parser.add_argument('--rescan', action='store_true',
+                        help="journal every JSON file in INBOX_DB_ROOT not already journaled as ready to import (eg. files queued by hand)")
+    parser.add_argument('--retry-failed', action='store_true',
+                        help="retry JSON files which previously failed to import")
+    parser.add_argument('--update-existing', action='store_true',
+                        help="also add token streams and native publish dates to articles already in MongoDB from before they were added on import")
+    parser.add_argument('--compact-store', action='store_true',
+                        help="after importing, rewrite each year of the columnar store as a single file")
+    return parser.parse_args()
 
 def main():
+    args = _get_args()
     logger = _get_logger()
     logger.info("{} started at {}.".format(os.path.basename(__file__),TIME_START))
     logger.debug("SCRIPT_ROOT {}".format(SCRIPT_ROOT))
@@ -56,61 +362,52 @@ def main():
     logger.debug("LOG_FILE_PATH {}".format(LOG_FILE_PATH))
     logger.debug("INBOX_DB_ROOT {}".format(INBOX_DB_ROOT))
     logger.debug("INBOX_DB_ARCHIVE {}".format(INBOX_DB_ARCHIVE))
+    logger.debug("JOURNAL_PATH {}".format(JOURNAL_PATH))
 
-    # connect to db
-    client = MongoClient(DB_HOST, DB_PORT)
-    db = client[DB_NAME]
-    coll = db[COLLECTION_NAME]
+    # connect to db, and/or open columnar store
+    coll = None
+    if args.store in ('mongo', 'both'):
+        coll = nkir_db.get_collection(COLLECTION_NAME)
 
-    # build a todolist of JSON documents to insert in to DB
-    inbox_db_root_contents = os.listdir(INBOX_DB_ROOT)
-    json_filenames = filter(lambda x:re.search(r'.json', x), inbox_db_root_contents)
+    store = None
+    if args.store in ('columnar', 'both'):
+        if not columnar.is_available():
+            logger.error("Columnar store requested, but pyarrow isn't installed; exiting.")
+            sys.exit(1)
+        store = columnar.ArticleStore(COLUMNAR_ROOT)
+        logger.debug("COLUMNAR_ROOT {}".format(COLUMNAR_ROOT))
 
-    # insert json documents one by one
-    total_articles = 0
-    processed_articles = 0
-    for json_filename in json_filenames:
-        total_articles += 1
-        json_file_path = os.path.join(INBOX_DB_ROOT,json_filename)
-        logger.debug("JSON_FILE_PATH {}".format(json_file_path))
+    # claim queued JSON documents from our journal, which INBOX_DB_ROOT's
+    #  contents are only read in to the first time it's used (or on --rescan)
+    global JOURNAL
+    JOURNAL = journal.Journal(JOURNAL_PATH)
+    if args.rescan or not JOURNAL.is_seeded('import'):
+        inbox_db_root_contents = os.listdir(INBOX_DB_ROOT)
+        JOURNAL.seed('import', filter(lambda x:re.search(r'.json', x), inbox_db_root_contents))
+    JOURNAL.recover('import')
+    if args.retry_failed:
+        logger.info("Retrying {} JSON files which previously failed.".format(JOURNAL.retry_failed('import')))
+    json_filenames = JOURNAL.iter_claims('import', args.batch_size)
 
-        # open JSON document, insert to MongoDB
-        json_file_id = ''
-        with open(json_file_path) as json_file:
-            try:
-                json_data = json.load(json_file)
-            except ValueError as e:
-                logger.warning("ValueError: {} when attempting to json.load [{}].".format(e, json_file_path))
-            else:
-                json_file_id = coll.insert(json_data)
-                json_file.close()
+    if coll is not None:
+        with metrics.timer('dbimporter.ensure_unique_urls'):
+            _ensure_unique_urls(coll)
 
-        if json_file_id:
-            processed_articles +=1
-            logger.info("Successfully inserted {} in to {}, with fileid {}.".format(json_filename,DB_NAME,json_file_id))
-            if( not os.path.exists(INBOX_DB_ARCHIVE) ):
-                os.makedirs(INBOX_DB_ARCHIVE)
+    total_articles, processed_articles, skipped_articles = import_json_files(coll, store, json_filenames, args.batch_size)
 
-            json_file_archive_path = os.path.join(INBOX_DB_ARCHIVE,json_filename)
-            try:
-                shutil.move(json_file_path, json_file_archive_path)
-            except IOError as e:
-                logger.warning("I/O error: {} when attempting move [{}] to [{}]".format(e.strerror, json_file_path, json_file_archive_path))
-            else:
-                logger.debug("Moved {} to DBIMPORTER_INBOX's archive.".format(json_file_path))
-        else:
-            logger.warning("MongoDB insertion error: {} was not successfully inserted.".format(json_file_path))
+    logger.info("Imported {} json articles out of {} into {} store ({} were unchanged and skipped).".format(processed_articles, total_articles, args.store, skipped_articles))
 
-    logger.info("Inserted {} json articles out of {} into MongoDB.".format(processed_articles, total_articles))
+    if coll is not None:
+        ensure_indexes(coll)
+        if args.update_existing:
+            update_existing(coll, args.batch_size)
 
-    # Ensure that text search index exists now, so that it can process text index in the background
-    coll.ensure_index([
-        ('data.text', 'text'),
-        ('data.metadata.title', 'text'),
-        ('data.metadata.location', 'text'),
-        ('data.metadata.news_service', 'text')],
-        weights={'data.text': 5, 'data.metadata.title': 10, 'data.metadata.location': 10, 'data.metadata.news_service': 1})
-    logger.info("completed ensuring MongoDB text index updated.")
+    if store is not None and args.compact_store:
+        with metrics.timer('dbimporter.columnar_compact'):
+            store.compact()
+
+    metrics.count('dbimporter.articles_queued', total_articles)
+    metrics.write_summary(LOG_FILE_PATH)
 
     TIME_END = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
     logger.info("{} finished at {}.".format(os.path.basename(__file__),TIME_END))
@@ -12,79 +12,90 @@
 #   with inheritance from an abstract base class
 # refactor to be more pythonic
 
+import argparse
 import datetime
+import itertools
 import logging
 import json
+import multiprocessing
 import os
 import re
 import shutil
 import sys
+import time
 
 from bs4 import BeautifulSoup
-import requests
+
+import extract_kcna
+import langdetect_kcna
 
 SCRIPT_ROOT = os.path.dirname(os.path.realpath(__file__))
 PROJECT_ROOT_REGEX = re.search("^(.*)/src/.*$", SCRIPT_ROOT)
 PROJECT_ROOT = PROJECT_ROOT_REGEX.group(1)
+
+# make our shared nkir library importable
+sys.path.append(os.path.join(PROJECT_ROOT, 'src'))
+from nkir import dates
+from nkir import journal
+from nkir import logs
+from nkir import metrics
+
 TIME_START = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
 LOG_FILE_PATH = os.path.join(PROJECT_ROOT, 'var/logs/jsonifier_kcna_'+TIME_START+'.log')
 INBOX_JSON_ROOT = os.path.join(PROJECT_ROOT, 'data/collector_kcna/inbox_json')
 INBOX_JSON_ARCHIVE = os.path.join(INBOX_JSON_ROOT, 'archive')
 INBOX_DB_ROOT = os.path.join(PROJECT_ROOT,'data/collector_kcna/inbox_db')
 GOOGLE_API_KEY = os.path.join(PROJECT_ROOT,'.google_api.key')
-
+LANGDETECT_MODEL_PATH = os.path.join(PROJECT_ROOT,'data/collector_kcna/langdetect_model.json')
+LANGDETECT_CACHE_PATH = os.path.join(PROJECT_ROOT,'data/collector_kcna/langdetect_cache.sqlite')
+JOURNAL_PATH = os.path.join(PROJECT_ROOT,'data/collector_kcna/journal_kcna.sqlite')
+LANGDETECT_TRAINING_FILES = 2000  # most recent archived files per language
+LANGDETECT_TRAINING_LINES = 5     # first lines (title onwards) per file
+
+# language detector singleton, see _get_detector
+DETECTOR = None
+
+# pipeline journal, which records each HTML file's progress if set
+JOURNAL = None
+
+# HTML text extraction: 'auto' tries extract_kcna's lxml fast path first,
+#  falling back on BeautifulSoup for pages it rejects; 'soup' always uses
+#  BeautifulSoup
+HTML_PARSER = 'auto'
+
+# matches the ">> date Juche N" line heading every article page, and the text
+#  following it
+REGEX_ARTICLE = re.compile(ur"^.*>>\s?(.* \d\d\d\d) Juche? ([0-9]+)(.*)$",
+                           re.DOTALL | re.UNICODE)
+
+# queuer_kcna names old style (pre 2008/10/01) pages, which hold a whole
+#  day's articles, <yyyymmdd>-00ee.html
+REGEX_FILENAME_MULTI = re.compile(r"^\d\d\d\d\d\d\d\d-00ee\.html$").match
+
+# the dateline opening each article's first paragraph, eg.
+#  "Pyongyang, September 26 (KCNA) -- ", which follows each article's title
+REGEX_DATELINE = re.compile(ur"^[^,]{1,60},[^(]{0,30}\([^)]{1,30}\) -- ", re.UNICODE).match
+
+# instantiate a logging object singleton for use throughout script, see
+#  nkir.logs
 def _get_logger():
-    logs_root_dir = re.search("^(.*/logs)/.*$", LOG_FILE_PATH).group(1)
-
-    if( not os.path.exists(logs_root_dir) ):
-        os.makedirs(logs_root_dir)
+    return logs.get_logger(LOG_FILE_PATH)
 
-    # init the root logger (which logs to persistent local logfile)
-    logging.basicConfig(filename=LOG_FILE_PATH,
-                        format='%(asctime)s: %(levelname)-8s: %(message)s',
-                        datefmt='%m/%d/%Y %I:%M:%S %p',
-                        level=logging.DEBUG)
-
-    # configure console logger
-    _console_logger = logging.StreamHandler()
-    _console_logger.setLevel(logging.INFO) #DEV: Can modify tthis level
-    _formatter = logging.Formatter('%(levelname)-8s %(message)s')
-    _console_logger.setFormatter(_formatter)
-
-    # add the console logger to root (file) logging handler
-    _root_logger = logging.getLogger('')
-    _root_logger.addHandler(_console_logger)
-    return _root_logger
-
-def _pp_date(date):
+# _pp_date returns a KCNA date string (eg. "February 3 2014") as the
+#  "2014-02-03 00:00:00" string we store, or '' if it isn't a date
+def _pp_date(date, juche_year=None):
     logger = logging.getLogger('')
 
-    date = date.replace('Juche','').replace('.','').strip()
-
-    dt = ''
-    parseSuccess = False
-
-    try:
-        dt = datetime.datetime.strptime(date,"%B %d %Y")
-        parseSuccess = True
-    except ValueError:
-        logger.warning("_pp_date::datetime.datetime.strptime default parse attempt [{}] failed.".format(date))
-
-    if not parseSuccess:
-        regex = re.search("^(\D*)\s?(\d*)\s?(\d\d\d\d).*$", date)
-        try:
-            (month, day, year) = regex.groups()
-            if month == "Februar":
-                newDateString = "February {} {}".format(day, year)
-                dt = datetime.datetime.strptime(newDateString,"%B %d %Y")
-            else:
-                logger.warning("_pp_date:: some other month-string edge-case: {}".format(date))
-        except AttributeError as e:
-            logger.warning("_pp_date:: AttributeError: {} when attempting regex search for month\day\year on [{}].".format(e, date))
+    dt = dates.get_datetime(date, juche_year)
+    if dt is None:
+        logger.warning("_pp_date:: couldn't parse a date from [{}].".format(date))
+        return ''
 
     return dt.__str__()
 
-def _pp_article(data):
+# _pp_article parses location and news service out of an article's dateline,
+#  and chops off the copyright line ending its page, if it has one
+def _pp_article(data, copyright=True):
     logger = logging.getLogger('')
     article = data['text']
 
@@ -100,7 +111,8 @@ def _pp_article(data):
         logger.warning("AttributeError: {} when attempting regex search for article metadata on [{}].".format(e, fp))
 
     # chop off copyright line of article
-    article.pop()
+    if copyright:
+        article.pop()
     data['text'] = article
     return data
 
@@ -124,44 +136,184 @@ def _get_link_url(html_filename):
     link_url = "/".join(URL_FORMAT)
     return link_url
 
-def checkEnglish(sentance):
-    DETECT_URL = 'https://www.googleapis.com/language/translate/v2/detect?'
+# _get_training_samples returns titles and text of already processed articles
+#  for training the offline language detector, looking like:
+#  {'en': [text, ...], 'es': [text, ...]}
+def _get_training_samples():
+    logger = logging.getLogger('')
+    samples = {'en': [], 'es': []}
+
+    archives = [('en', INBOX_JSON_ARCHIVE), ('es', os.path.join(INBOX_JSON_ARCHIVE,'spanish'))]
+    for language, archive_root in archives:
+        if not os.path.isdir(archive_root):
+            continue
+        html_filenames = sorted(filter(lambda x:re.search(r'.htm', x), os.listdir(archive_root)))
+        for html_filename in html_filenames[-LANGDETECT_TRAINING_FILES:]:
+            parsed = _parse_html(os.path.join(archive_root,html_filename))
+            if parsed:
+                # leave out lines that don't read as their archive's language,
+                #  eg. english articles once misdetected as spanish
+                samples[language].extend(line for line in parsed[2][:LANGDETECT_TRAINING_LINES]
+                                         if langdetect_kcna.is_clean_sample(language, line))
+
+    logger.info("Found {} english and {} spanish lines to train language detector on.".format(len(samples['en']), len(samples['es'])))
+
+    # fall back on (or top up with) built in samples for a fresh install
+    for language in samples:
+        samples[language].extend(langdetect_kcna.SEED_SAMPLES[language])
+
+    return samples
+
+# _get_detector returns our language detector for the requested backend,
+#  wrapped in a persistent cache of previous verdicts
+def _get_detector(backend='ngram', retrain=False):
     logger = logging.getLogger('')
-    api_key = ''
-    verdict = ''
 
-    try:
-        fd = open(GOOGLE_API_KEY, "r")
-    except IOError as e:
-        logger.warning("I/O error: {} when attempting open [{}].".format(e.strerror, GOOGLE_API_KEY))
+    if backend == 'google':
+        return langdetect_kcna.CachedDetector(langdetect_kcna.GoogleDetector(GOOGLE_API_KEY), LANGDETECT_CACHE_PATH)
+
+    # a model saved by an older version, or before there were enough
+    #  archived articles to train on, is retrained
+    detector = None
+    if os.path.exists(LANGDETECT_MODEL_PATH) and not retrain:
+        detector = langdetect_kcna.NgramDetector.load(LANGDETECT_MODEL_PATH)
+        if detector is not None and detector.is_trained():
+            logger.debug("Loaded language detector model from {}.".format(LANGDETECT_MODEL_PATH))
+        else:
+            detector = None
+    if detector is None:
+        detector = langdetect_kcna.NgramDetector.train(_get_training_samples())
+        if( not os.path.exists(os.path.dirname(LANGDETECT_MODEL_PATH)) ):
+            os.makedirs(os.path.dirname(LANGDETECT_MODEL_PATH))
+        detector.save(LANGDETECT_MODEL_PATH)
+        logger.info("Trained language detector model, saved to {}.".format(LANGDETECT_MODEL_PATH))
+
+    if not detector.is_trained():
+        logger.warning("Language detector has too few samples to train on ({}), so leaves every article's language undetermined "
+                       "(and processes it) until there are at least {} of each language, or use --detector google.".format(
+                       detector.samples, detector.MIN_TRAINING_SAMPLES))
 
-    firstline = fd.readline().strip()
+    return langdetect_kcna.CachedDetector(detector, LANGDETECT_CACHE_PATH)
+
+def checkEnglish(sentance):
+    global DETECTOR
+
+    if DETECTOR is None:
+        DETECTOR = _get_detector()
+
+    with metrics.timer('jsonifier.check_english'):
+        return DETECTOR.detect(sentance)
+
+# _get_html_text returns the text of a page of html, exactly as
+#  BeautifulSoup(html, 'html.parser').get_text() does, or None if parser is
+#  'fast' and our fast path can't promise to match BeautifulSoup on this
+#  page. We name html.parser, as BeautifulSoup's default tree builder is
+#  lxml's whenever it's installed, which parses some pages differently.
+def _get_html_text(html, parser):
+    if parser in ('auto', 'fast'):
+        with metrics.timer('jsonifier.lxml_parse'):
+            html_text = extract_kcna.get_text(html)
+        if html_text is not None or parser == 'fast':
+            return html_text
+        metrics.count('jsonifier.lxml_parse_rejected')
+
+    with metrics.timer('jsonifier.beautifulsoup_parse'):
+        soup = BeautifulSoup(html, 'html.parser')
+        return soup.get_text()
+
+# _parse_html returns (date, juche_year, article_text lines) parsed from a
+#  KCNA article HTML file, or None if it isn't in a format we recognize
+def _parse_html(html_file_path, parser=None):
+    logger = logging.getLogger('')
+
+    # parse HTML
+    with open(html_file_path,'r') as f:
+        html_text = _get_html_text(f.read(), parser or HTML_PARSER)
+    if html_text is None:
+        return None
+
+    # REGEX_ARTICLE's greedy ^.* always tries the last ">>" first, so try
+    #  only the text from there before the whole page, rather than have the
+    #  regex engine scan to the end of the page and back
+    with metrics.timer('jsonifier.regex_parse_article'):
+        parsed = REGEX_ARTICLE.search(html_text[html_text.rfind(u'>>'):])
+        if not parsed:
+            parsed = REGEX_ARTICLE.search(html_text)
     try:
-        api_key = (re.match(r"""^(?!#)(.*)$""",(firstline))).group()
+        (date, juche_year, article) = parsed.groups()
     except AttributeError as e:
-        logger.warning("api_key appears to be commented out!.".format(e, firstline))
-    else:
-        logger.debug("API KEY: [{}]".format(api_key))
+        logger.warning("AttributeError: {} when attempting regex search for date/juche_year/article on [{}].".format(e, html_file_path))
+        return None
 
-    # Google Translate API get request
-    dict_input = {'key': api_key, 'q': sentance}
-    google_data = (requests.get(DETECT_URL, params=dict_input)).json()
+    article_text = []
+    for line in article.splitlines():
+        line = line.strip()
+        if line:
+            article_text.append(line)
 
-    logger.debug(json.dumps(google_data, indent=4, sort_keys=True))
+    return (date, juche_year, article_text)
 
-    if 'data' in google_data:
-        if google_data['data']['detections'][0][0]['language'] == 'en':
-            verdict = 'en'
-        elif google_data['data']['detections'][0][0]['language'] == 'es':
-            verdict = 'es'
-        else:
-            verdict = google_data['data']['detections'][0][0]['language']
+# _check_parity parses every HTML file below html_root with both our lxml
+#  fast path and BeautifulSoup, logging any whose results differ, and returns
+#  the number that differ
+def _check_parity(html_root):
+    logger = logging.getLogger('')
+
+    if not extract_kcna.is_available():
+        logger.error("lxml isn't installed, so there's no fast path to check.")
+        return 1
+
+    total_files = 0
+    rejected_files = 0
+    mismatched_files = 0
+    for dirpath, dirnames, filenames in os.walk(html_root):
+        for html_filename in sorted(filter(lambda x:re.search(r'.htm', x), filenames)):
+            html_file_path = os.path.join(dirpath, html_filename)
+            total_files += 1
+
+            with open(html_file_path,'r') as f:
+                html = f.read()
+            fast_text = _get_html_text(html, 'fast')
+            if fast_text is None:
+                rejected_files += 1
+                continue
+
+            if fast_text != _get_html_text(html, 'soup') or _parse_html(html_file_path, 'fast') != _parse_html(html_file_path, 'soup'):
+                mismatched_files += 1
+                logger.warning("Parity error: lxml and BeautifulSoup parse [{}] differently.".format(html_file_path))
+
+    logger.info("Checked {} HTML files: {} parsed identically, {} rejected by the fast path (BeautifulSoup is used), {} differed.".format(
+                total_files, total_files - rejected_files - mismatched_files, rejected_files, mismatched_files))
+    return mismatched_files
+
+# _split_articles splits the lines of an old style daily page (less its
+#  copyright line) in to a list of each article's lines, title first, by
+#  finding each article's dateline. Returns None if there aren't at least two
+#  articles to split, in which case the page is best kept whole.
+def _split_articles(article_text, html_file_path):
+    logger = logging.getLogger('')
+
+    starts = []
+    for i, line in enumerate(article_text):
+        # a title line is needed before each dateline, which can't be the
+        #  previous article's dateline
+        if i > 0 and REGEX_DATELINE(line) and (not starts or i - 1 > starts[-1] + 1):
+            starts.append(i - 1)
+
+    if len(starts) < 2:
+        return None
 
-    return verdict
+    if starts[0] > 0:
+        logger.debug("Skipping %d lines before first article title in [%s].", starts[0], html_file_path)
 
+    ends = starts[1:] + [len(article_text)]
+    return [article_text[start:end] for start, end in zip(starts, ends)]
+
+# html_to_json writes JSON documents for the article(s) in html_file_path to
+#  INBOX_DB_ROOT, returning the list of their filenames, or False if it didn't
 def html_to_json(html_file_path):
     logger = logging.getLogger('')
-    logger.debug("Processing: {}".format(html_file_path))
+    logger.debug("Processing: %s", html_file_path)
 
     # initialize for every article
     payload = {
@@ -172,82 +324,159 @@ def html_to_json(html_file_path):
         'version': 1,
     }
 
-    # parse HTML
-    soup = BeautifulSoup(open(html_file_path,'r').read())
-
-    html_text = soup.get_text()
-    re_parse = re.compile(ur"^.*>>\s?(.* \d\d\d\d) Juche? ([0-9]+)(.*)$",
-                   re.DOTALL | re.UNICODE)
-    parsed = re_parse.search(html_text)
-    try:
-        (date, juche_year, article) = parsed.groups()
-    except AttributeError as e:
-        logger.warning("AttributeError: {} when attempting regex search for date/juche_year/article on [{}].".format(e, html_file_path))
+    parsed = _parse_html(html_file_path)
+    if not parsed:
         return False
+    (date, juche_year, article_text) = parsed
 
-    article_text = []
-    for line in article.splitlines():
-        line = line.strip()
-        if line:
-            article_text.append(line)
-
-    data = {}
-    data['metadata'] = {}
+    # old style daily pages hold many articles, each of which becomes its own
+    #  document, with the page's url and "#article-NN" as its stable url
+    html_filename = os.path.basename(html_file_path)
+    articles = None
+    if REGEX_FILENAME_MULTI(html_filename):
+        with metrics.timer('jsonifier.split_articles'):
+            articles = _split_articles(article_text[:-1], html_file_path)
 
     # check language is english
-    data['metadata']['title'] = article_text.pop(0)
-
-    verdict = checkEnglish(data['metadata']['title'])
+    verdict = checkEnglish(article_text[0])
     if verdict == 'en':
-        logger.info("article [{}] is in english.".format(html_file_path))
+        logger.info("article [%s] is in english.", html_file_path)
     elif verdict == 'es':
-        logger.info("article [{}] was in spanish -> not going to process.".format(html_file_path))
+        logger.info("article [%s] was in spanish -> not going to process.", html_file_path)
         inbox_json_archive_spanish = os.path.join(INBOX_JSON_ARCHIVE,'spanish')
         if( not os.path.exists(inbox_json_archive_spanish) ):
             os.makedirs(inbox_json_archive_spanish)
         html_file_archive_path = os.path.join(inbox_json_archive_spanish,os.path.basename(html_file_path))
+        metrics.count('jsonifier.spanish_articles')
         try:
-            shutil.move(html_file_path, html_file_archive_path)
+            with metrics.timer('jsonifier.file_move'):
+                shutil.move(html_file_path, html_file_archive_path)
         except IOError as e:
             logger.warning("I/O error: {} when attempting move [{}] to [{}]".format(e.strerror, html_file_path, html_file_archive_path))
         else:
-            logger.debug("Moved spanish article {} to JSONIFIER_INBOX's spanish (unprocessed) archive.".format(html_file_path))
+            logger.debug("Moved spanish article %s to JSONIFIER_INBOX's spanish (unprocessed) archive.", html_file_path)
         return False
     else:
         logger.warning("Language of article [{}] is uncertain, possibly [{}].".format(html_file_path, verdict))
 
-    # process metadata
-    data['metadata']['date_published'] = _pp_date(date)
+    # process metadata shared by every article on the page
+    metadata = {}
+    with metrics.timer('jsonifier.regex_parse_date'):
+        metadata['date_published'] = _pp_date(date, juche_year)
 
-    data['metadata']['juche_year'] = int(juche_year)
+    metadata['juche_year'] = int(juche_year)
 
-    html_filename = os.path.basename(html_file_path)
-    data['metadata']['article_url'] = _get_link_url(html_filename)
+    with metrics.timer('jsonifier.regex_parse_url'):
+        page_url = _get_link_url(html_filename)
 
     datetime_modified = datetime.datetime.fromtimestamp(os.path.getmtime(html_file_path))
-    data['metadata']['html_modified'] = datetime_modified.__str__()
-
-    # process article's text data
-    data['text'] = []
-    for para_text in article_text:
-        data['text'].append(para_text)
+    metadata['html_modified'] = datetime_modified.__str__()
 
-    _pp_article(data)
-    payload['data'] = data
-
-    # write output JSON
-    new_filename = os.path.splitext(os.path.basename(html_file_path))[0] + '.json'
-    new_filepath = os.path.join(INBOX_DB_ROOT, new_filename)
+    if articles is None:
+        documents = [(os.path.splitext(html_filename)[0], page_url, None, article_text, True)]
+    else:
+        logger.info("Split [%s] in to %d articles.", html_file_path, len(articles))
+        metrics.count('jsonifier.articles_split', len(articles))
+        documents = [("{}-{:02d}".format(os.path.splitext(html_filename)[0], i),
+                      "{}#article-{:02d}".format(page_url, i), page_url, lines, False)
+                     for i, lines in enumerate(articles, 1)]
 
     if( not os.path.exists(INBOX_DB_ROOT) ):
         os.makedirs(INBOX_DB_ROOT)
 
-    with open(new_filepath, 'w') as outfile:
-        json.dump(payload, outfile, sort_keys=True)
+    json_filenames = []
+    for document_name, article_url, parent_url, lines, copyright in documents:
+        data = {}
+        data['metadata'] = dict(metadata)
+        data['metadata']['title'] = lines[0]
+        data['metadata']['article_url'] = article_url
+        if parent_url is not None:
+            data['metadata']['parent_url'] = parent_url
+
+        # process article's text data
+        data['text'] = []
+        for para_text in lines[1:]:
+            data['text'].append(para_text)
+
+        with metrics.timer('jsonifier.regex_parse_dateline'):
+            _pp_article(data, copyright)
+
+        document_payload = dict(payload)
+        document_payload['data'] = data
+        _write_json(document_payload, os.path.join(INBOX_DB_ROOT, document_name + '.json'))
+        json_filenames.append(document_name + '.json')
+
+    return json_filenames
+
+# _write_json writes a JSON document for dbimporter_kcna to new_filepath
+def _write_json(payload, new_filepath):
+    # write to a temporary (non-.json) name first and then rename, so that
+    #  dbimporter_kcna never sees a partially written document
+    partial_filepath = os.path.splitext(new_filepath)[0] + '.partial'
+    with metrics.timer('jsonifier.json_dump'):
+        with open(partial_filepath, 'w') as outfile:
+            json.dump(payload, outfile, sort_keys=True)
+        os.rename(partial_filepath, new_filepath)
+
+# _process_html_file converts one queued HTML file to JSON and archives it,
+#  returning (html_filename, success, worker pid, seconds taken, metrics).
+# Metrics are handed back rather than kept, as workers may be other processes.
+# Each queued filename is handed to exactly one worker, and if JOURNAL is set
+#  it records the file done (and its JSON documents ready to import) before
+#  archiving it, so a crash at any point never loses or repeats a finished
+#  file.
+def _process_html_file(html_filename):
+    logger = logging.getLogger('')
+    time_start = time.time()
+
+    html_file_path = os.path.join(INBOX_JSON_ROOT,html_filename)
+    with metrics.timer('jsonifier.html_to_json'):
+        json_processer_return = html_to_json(html_file_path)
+
+    if JOURNAL is not None:
+        with metrics.timer('jsonifier.journal_update'):
+            if json_processer_return:
+                JOURNAL.finish('jsonify', [html_filename], 'import', json_processer_return)
+            elif not os.path.exists(html_file_path):
+                # spanish articles are archived unprocessed
+                JOURNAL.finish('jsonify', [html_filename])
+            else:
+                JOURNAL.fail('jsonify', html_filename, 'not successfully processed from HTML -> JSON')
 
-    return True
+    # archive html file if we processed ok
+    if json_processer_return:
+        html_file_archive_path = os.path.join(INBOX_JSON_ARCHIVE,html_filename)
+        try:
+            with metrics.timer('jsonifier.file_move'):
+                shutil.move(html_file_path, html_file_archive_path)
+        except IOError as e:
+            logger.warning("I/O error: {} when attempting move [{}] to [{}]".format(e.strerror, html_file_path, html_file_archive_path))
+        else:
+            logger.debug("Moved %s to JSONIFIER_INBOX's archive.", html_file_path)
+
+    return (html_filename, json_processer_return, os.getpid(), time.time() - time_start, metrics.snapshot())
+
+# _get_args parses command line arguments
+def _get_args():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--detector', choices=['ngram', 'google'], default='ngram',
+                        help="language detection backend: offline ngram model or Google Translate API (default: ngram)")
+    parser.add_argument('--retrain-detector', action='store_true',
+                        help="retrain the offline ngram model from archived articles before running")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="number of worker processes converting HTML to JSON (default: 1)")
+    parser.add_argument('--parser', choices=['auto', 'soup'], default='auto',
+                        help="HTML text extraction: lxml fast path with BeautifulSoup fallback, or BeautifulSoup only (default: auto)")
+    parser.add_argument('--rescan', action='store_true',
+                        help="journal every HTML file in INBOX_JSON_ROOT not already journaled as ready to process (eg. files queued by hand)")
+    parser.add_argument('--retry-failed', action='store_true',
+                        help="retry HTML files which previously failed to process")
+    parser.add_argument('--check-parity', metavar='HTML_ROOT',
+                        help="check the lxml fast path parses every HTML file below HTML_ROOT identically to BeautifulSoup, and exit")
+    return parser.parse_args()
 
 def main():
+    args = _get_args()
     logger = _get_logger()
     logger.info("{} started at {}.".format(os.path.basename(__file__),TIME_START))
     logger.debug("SCRIPT_ROOT {}".format(SCRIPT_ROOT))
@@ -255,36 +484,75 @@ def main():
     logger.debug("LOG_FILE_PATH {}".format(LOG_FILE_PATH))
     logger.debug("INBOX_JSON_ROOT {}".format(INBOX_JSON_ROOT))
     logger.debug("INBOX_DB_ROOT {}".format(INBOX_DB_ROOT))
-
-     # Look inside INBOX_JSON_ROOT for queueud HTML files
-    inbox_json_root_contents = os.listdir(INBOX_JSON_ROOT)
-    html_filenames = filter(lambda x:re.search(r'.htm', x), inbox_json_root_contents)
+    logger.debug("JOURNAL_PATH {}".format(JOURNAL_PATH))
+
+    if args.check_parity:
+        sys.exit(1 if _check_parity(args.check_parity) else 0)
+
+    global HTML_PARSER
+    HTML_PARSER = args.parser
+    if HTML_PARSER == 'auto' and not extract_kcna.is_available():
+        logger.info("lxml isn't installed; parsing HTML with BeautifulSoup only.")
+
+    # claim queued HTML files from our journal, which INBOX_JSON_ROOT's
+    #  contents are only read in to the first time it's used (or on --rescan)
+    global JOURNAL
+    JOURNAL = journal.Journal(JOURNAL_PATH)
+    if args.rescan or not JOURNAL.is_seeded('jsonify'):
+        inbox_json_root_contents = os.listdir(INBOX_JSON_ROOT)
+        JOURNAL.seed('jsonify', filter(lambda x:re.search(r'.htm', x), inbox_json_root_contents))
+    JOURNAL.recover('jsonify')
+    if args.retry_failed:
+        logger.info("Retrying {} HTML files which previously failed.".format(JOURNAL.retry_failed('jsonify')))
+    logger.info("{} HTML files queued in journal.".format(JOURNAL.get_counts('jsonify')['ready']))
+    html_filenames = JOURNAL.iter_claims('jsonify')
+
+    # build language detector once, before any workers are forked
+    global DETECTOR
+    DETECTOR = _get_detector(args.detector, args.retrain_detector)
+
+    # create output directories up front, so workers never race to make them
+    for directory in [INBOX_JSON_ARCHIVE, os.path.join(INBOX_JSON_ARCHIVE,'spanish'), INBOX_DB_ROOT]:
+        if( not os.path.exists(directory) ):
+            os.makedirs(directory)
+
+    pool = None
+    if args.workers > 1:
+        logger.info("Converting HTML to JSON with {} worker processes.".format(args.workers))
+        # workers start without our metrics, so hand back only their own
+        pool = multiprocessing.Pool(args.workers, initializer=metrics.reset)
+        results = pool.imap_unordered(_process_html_file, html_filenames)
+    else:
+        results = itertools.imap(_process_html_file, html_filenames)
 
     total_articles = 0
     processed_articles = 0
-    for html_filename in html_filenames:
+    worker_stats = {}
+    for html_filename, json_processer_return, worker_pid, seconds, worker_metrics in results:
         total_articles += 1
-        html_file_path = os.path.join(INBOX_JSON_ROOT,html_filename)
-        json_processer_return = html_to_json(html_file_path)
+        metrics.merge(worker_metrics)
+
+        worker_articles, worker_seconds = worker_stats.get(worker_pid, (0, 0.0))
+        worker_stats[worker_pid] = (worker_articles + 1, worker_seconds + seconds)
 
-        # archive html file if we processed ok
         if json_processer_return:
             processed_articles += 1
-            logger.info("Successfully processed {} in to JSON. ({} out of {} articles)".format(html_filename, processed_articles, total_articles))
-            if( not os.path.exists(INBOX_JSON_ARCHIVE) ):
-                os.makedirs(INBOX_JSON_ARCHIVE)
-
-            html_file_archive_path = os.path.join(INBOX_JSON_ARCHIVE,html_filename)
-            try:
-                shutil.move(html_file_path, html_file_archive_path)
-            except IOError as e:
-                logger.warning("I/O error: {} when attempting move [{}] to [{}]".format(e.strerror, html_file_path, html_file_archive_path))
-            else:
-                logger.debug("Moved {} to JSONIFIER_INBOX's archive.".format(html_file_path))
+            metrics.count('jsonifier.articles_processed')
+            logger.info("Successfully processed %s in to JSON. (%d out of %d articles)", html_filename, processed_articles, total_articles)
         else:
-            logger.warning("html_to_json error: {} was not successfully processed from HTML -> JSON.".format(html_file_path))
+            logger.warning("html_to_json error: {} was not successfully processed from HTML -> JSON.".format(os.path.join(INBOX_JSON_ROOT,html_filename)))
+
+    if pool is not None:
+        pool.close()
+        pool.join()
+
+    for worker_pid, (worker_articles, worker_seconds) in sorted(worker_stats.items()):
+        logger.info("Worker {} processed {} articles in {:.2f}s ({:.2f} articles/sec).".format(
+                    worker_pid, worker_articles, worker_seconds, worker_articles / worker_seconds if worker_seconds else 0.0))
 
     logger.info("Processed {} HTML articles out of {} from HTML to JSON.".format(processed_articles, total_articles))
+    metrics.count('jsonifier.articles_queued', total_articles)
+    metrics.write_summary(LOG_FILE_PATH)
     TIME_END = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
     logger.info("{} finished at {}.".format(os.path.basename(__file__),TIME_END))
 
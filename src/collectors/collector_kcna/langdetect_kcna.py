@@ -0,0 +1,254 @@
+#!/usr/bin/env python
+
+"""Pluggable language detectors for KCNA article titles, with a persistent result cache."""
+
+import hashlib
+import json
+import logging
+import math
+import os
+import re
+import sqlite3
+
+import requests
+
+# seed samples used to train the offline model when there is no archive of
+#  already processed english/spanish articles to train on yet
+SEED_SAMPLES = {
+    'en': [
+        "Kim Jong Un Inspects Construction Site",
+        "Greetings to President of Friendly Country",
+        "Delegation of Workers' Party of Korea Leaves for Visit",
+        "Anniversary of Founding of Korean People's Army Celebrated",
+        "The people of the country are firmly united around the leadership",
+        "Statement of spokesman for the Foreign Ministry on the situation",
+        "Meeting held to mark the day of the sun and the birth of the leader",
+        "This is an undisguised provocation against the sovereignty of the nation",
+    ],
+    'es': [
+        "Kim Jong Un inspecciona obras de construccion",
+        "Saludo al Presidente de un pais amigo",
+        "Parte delegacion del Partido del Trabajo de Corea para una visita",
+        "Celebran aniversario de la fundacion del Ejercito Popular de Corea",
+        "El pueblo del pais esta firmemente unido en torno a la direccion",
+        "Declaracion del portavoz del Ministerio de Relaciones Exteriores sobre la situacion",
+        "Efectuan acto en ocasion del dia del sol y el natalicio del dirigente",
+        "Esto es una provocacion contra la soberania de la nacion y los pueblos",
+    ],
+}
+
+# function words only one of our languages uses, for telling whether a line
+#  from an archive of articles is really in that archive's language before
+#  training on it (see is_clean_sample)
+STOPWORDS = {
+    'en': set("the of and to in for on with by is are was from at this that".split()),
+    'es': set("el la los las del de y en por con para una que se al es".split()),
+}
+
+# is_clean_sample returns whether text has more of language's function words
+#  than of any other language's, so that articles archived under the wrong
+#  language (eg. english titles once misdetected as spanish), or too short to
+#  tell, aren't learnt from
+def is_clean_sample(language, text):
+    words = re.findall(r"[a-z]+", text.lower())
+    counts = dict((_language, sum(1 for word in words if word in stopwords))
+                  for _language, stopwords in STOPWORDS.items())
+    return all(counts[language] > count for _language, count in counts.items() if _language != language)
+
+# Detector is the interface every language detection backend implements:
+#  detect(text) returns an ISO 639-1 language code, or '' if undetermined.
+class Detector(object):
+    name = None
+
+    def detect(self, text):
+        raise NotImplementedError
+
+# NgramDetector is an offline naive Bayes classifier over character 1-3 grams.
+#  It only gives a verdict it's confident of, and otherwise returns '': if it
+#  was trained on too few samples of any language (eg. only SEED_SAMPLES, on a
+#  fresh install), if text is too short to tell (eg. "Japan", which naive
+#  Bayes is overconfident about), if the best language doesn't beat the next
+#  by MIN_MARGIN, or if text has more of another language's function words.
+class NgramDetector(Detector):
+    name = 'ngram'
+    NGRAM_SIZES = (1, 2, 3)
+    # bump when training or detection changes, so saved models are retrained
+    VERSION = 2
+
+    MIN_TRAINING_SAMPLES = 100
+    # the fewest words (of two letters or more) we give a verdict on
+    MIN_WORDS = 3
+    # the least log probability the best language must beat the next by
+    MIN_MARGIN = 8.0
+
+    # profiles looks like {language: {ngram: log probability}}, with each
+    #  language's unseen ngram log probability stored under the key '', and
+    #  samples like {language: number of samples trained on}
+    def __init__(self, profiles, samples):
+        self.profiles = profiles
+        self.samples = samples
+        self.cache_key = self._get_cache_key()
+
+    # _get_cache_key returns what our verdicts are cached under, which
+    #  changes with our model and thresholds, so retraining (or changing
+    #  them) never leaves old verdicts in use
+    def _get_cache_key(self):
+        model = json.dumps([self.VERSION, self.MIN_TRAINING_SAMPLES, self.MIN_WORDS, self.MIN_MARGIN, self.samples, self.profiles], sort_keys=True)
+        return "{}:{}".format(self.name, hashlib.sha1(model).hexdigest()[:12])
+
+    @classmethod
+    def _get_ngrams(cls, text):
+        text = " {} ".format(re.sub(r"\s+", " ", text.lower().strip()))
+        for size in cls.NGRAM_SIZES:
+            for i in range(len(text) - size + 1):
+                yield text[i:i + size]
+
+    # train returns a detector trained on samples, which looks like
+    #  {language: [text, text, ...]}
+    @classmethod
+    def train(cls, samples):
+        profiles = {}
+        vocabulary = set()
+        counts = {}
+        for language, texts in samples.items():
+            counts[language] = {}
+            for text in texts:
+                for ngram in cls._get_ngrams(text):
+                    counts[language][ngram] = counts[language].get(ngram, 0) + 1
+                    vocabulary.add(ngram)
+
+        # add-one smoothing over the shared vocabulary
+        for language, ngram_counts in counts.items():
+            total = sum(ngram_counts.values()) + len(vocabulary) + 1
+            profiles[language] = dict((ngram, math.log(float(count + 1) / total))
+                                      for ngram, count in ngram_counts.items())
+            profiles[language][''] = math.log(1.0 / total)
+
+        return cls(profiles, dict((language, len(texts)) for language, texts in samples.items()))
+
+    # load returns the detector saved at model_path, or None if it was saved
+    #  by an older version, and needs retraining
+    @classmethod
+    def load(cls, model_path):
+        with open(model_path, 'r') as f:
+            model = json.load(f)
+        if model.get('version') != cls.VERSION:
+            return None
+        return cls(model['profiles'], model['samples'])
+
+    def save(self, model_path):
+        partial_path = model_path + '.partial'
+        with open(partial_path, 'w') as f:
+            json.dump({'version': self.VERSION, 'samples': self.samples, 'profiles': self.profiles}, f, sort_keys=True)
+        os.rename(partial_path, model_path)
+
+    # is_trained returns whether we've seen enough samples of every language
+    #  to give verdicts
+    def is_trained(self):
+        return len(self.samples) > 1 and min(self.samples.values()) >= self.MIN_TRAINING_SAMPLES
+
+    # get_scores returns the log probability of text in each language, best
+    #  first, looking like [(language, score), ...]
+    def get_scores(self, text):
+        ngrams = list(self._get_ngrams(text))
+        scores = []
+        for language, profile in self.profiles.items():
+            unseen = profile['']
+            scores.append((language, sum(profile.get(ngram, unseen) for ngram in ngrams)))
+        return sorted(scores, key=lambda score: score[1], reverse=True)
+
+    def detect(self, text):
+        if not self.is_trained() or len(re.findall(r"[a-z]{2,}", text.lower())) < self.MIN_WORDS:
+            return ''
+
+        scores = self.get_scores(text)
+        language = scores[0][0]
+        if scores[0][1] - scores[1][1] < self.MIN_MARGIN:
+            return ''
+        if any(is_clean_sample(_language, text) for _language in STOPWORDS if _language != language):
+            return ''
+        return language
+
+# GoogleDetector asks the Google Translate API to detect language.
+class GoogleDetector(Detector):
+    name = 'google'
+    cache_key = 'google'
+    DETECT_URL = 'https://www.googleapis.com/language/translate/v2/detect?'
+
+    def __init__(self, api_key_path):
+        logger = logging.getLogger('')
+        self.api_key = ''
+
+        try:
+            with open(api_key_path, "r") as fd:
+                firstline = fd.readline().strip()
+        except IOError as e:
+            logger.warning("I/O error: {} when attempting open [{}].".format(e.strerror, api_key_path))
+            return
+
+        try:
+            self.api_key = (re.match(r"""^(?!#)(.*)$""",(firstline))).group()
+        except AttributeError as e:
+            logger.warning("api_key appears to be commented out!.".format(e, firstline))
+        else:
+            logger.debug("API KEY: [{}]".format(self.api_key))
+
+    def detect(self, text):
+        logger = logging.getLogger('')
+        verdict = ''
+
+        # Google Translate API get request
+        dict_input = {'key': self.api_key, 'q': text}
+        google_data = (requests.get(self.DETECT_URL, params=dict_input)).json()
+
+        # the full response is only worth dumping if it's logged
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(json.dumps(google_data, indent=4, sort_keys=True))
+
+        if 'data' in google_data:
+            verdict = google_data['data']['detections'][0][0]['language']
+
+        return verdict
+
+# CachedDetector remembers every verdict of the detector it wraps in a SQLite
+#  database keyed by its cache_key (which changes whenever its model does) and
+#  a hash of the text, so no text is ever detected twice by the same model.
+# Connections are opened lazily per process, so one CachedDetector can be
+#  shared with jsonifier_kcna's forked worker processes.
+class CachedDetector(Detector):
+
+    def __init__(self, detector, cache_path):
+        self.detector = detector
+        self.name = detector.name
+        self.cache_key = detector.cache_key
+        self.cache_path = cache_path
+        self._conn = None
+        self._conn_pid = None
+
+    def _get_conn(self):
+        if self._conn is None or self._conn_pid != os.getpid():
+            self._conn = sqlite3.connect(self.cache_path, timeout=30, isolation_level=None)
+            self._conn.execute("CREATE TABLE IF NOT EXISTS verdicts "
+                               "(backend TEXT, text_hash TEXT, language TEXT, "
+                               "PRIMARY KEY (backend, text_hash))")
+            self._conn_pid = os.getpid()
+        return self._conn
+
+    def detect(self, text):
+        text_hash = hashlib.sha1(text.encode('utf-8')).hexdigest()
+        conn = self._get_conn()
+
+        row = conn.execute("SELECT language FROM verdicts WHERE backend = ? AND text_hash = ?",
+                           (self.cache_key, text_hash)).fetchone()
+        if row is not None:
+            return row[0]
+
+        language = self.detector.detect(text)
+        if not language:
+            # don't remember failures (eg. no network) or undetermined
+            #  verdicts, so we can retry later
+            return language
+
+        conn.execute("INSERT OR REPLACE INTO verdicts (backend, text_hash, language) VALUES (?, ?, ?)",
+                     (self.cache_key, text_hash, language))
+        return language
@@ -0,0 +1,337 @@
+#!/usr/bin/env python
+
+"""Mirrors http://www.kcna.co.jp/ locally with concurrent, conditional HTTP requests, committing changes to the mirror's git repo - part of the NKIR project."""
+
+import argparse
+import datetime
+import email.utils
+import json
+import logging
+import os
+import Queue
+import re
+import subprocess
+import sys
+import threading
+import time
+import urlparse
+
+import requests
+
+SCRIPT_ROOT = os.path.dirname(os.path.realpath(__file__))
+PROJECT_ROOT_REGEX = re.search("^(.*)/src/.*$", SCRIPT_ROOT)
+PROJECT_ROOT = PROJECT_ROOT_REGEX.group(1)
+
+# make our shared nkir library importable
+sys.path.append(os.path.join(PROJECT_ROOT, 'src'))
+from nkir import logs
+
+TIME_START = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+LOG_FILE_PATH = os.path.join(PROJECT_ROOT, 'var/logs/mirror_kcna_'+TIME_START+'.log')
+LOGS_ROOT = os.path.join(PROJECT_ROOT, 'var/logs')
+MIRROR_ROOT = os.path.join(PROJECT_ROOT, 'data/collector_kcna/mirror/www.kcna.co.jp')
+HTTP_CACHE_PATH = os.path.join(PROJECT_ROOT, 'data/collector_kcna/mirror_kcna_http_cache.json')
+TEST_PID_FILE_PATH = os.path.join(PROJECT_ROOT, 'etc/test-input-server.pid')
+
+URL_DEV = 'http://localhost:8870/'
+URL_PROD = 'http://www.kcna.co.jp/'
+START_PAGE = 'index-e.htm'
+REJECT_EXTENSIONS = ('.mp3', '.gif')
+HTML_EXTENSIONS = ('.htm', '.html')
+
+# matches link targets in HTML, quoted or not
+REGEX_HREF = re.compile(r"""(?:href|src)\s*=\s*["']?([^"'\s>]+)""", re.IGNORECASE).findall
+
+# article paths on KCNA look like:
+#   item/1997/9701/news1/01.htm
+#   item/2008/200810/news01/20081001-01ee.html
+REGEX_ITEM_PATH = re.compile(
+    r"""^item/
+    (?P<year>\d\d\d\d)/
+    (?:9\d|20\d\d)
+    (?P<month>\d\d)/news
+    (?P<day>\d\d?)/
+    """, re.VERBOSE).match
+
+# instantiate a logging object singleton for use throughout script, see
+#  nkir.logs
+def _get_logger():
+    return logs.get_logger(LOG_FILE_PATH)
+
+# _get_local_path maps a site relative url path on to our mirror's layout,
+#  the same way `wget --no-host-directories` does
+def _get_local_path(path):
+    if not path or path.endswith('/'):
+        path += 'index.html'
+    return os.path.join(MIRROR_ROOT, path)
+
+# _get_item_date returns the date of an article's news directory, or None if
+#  path isn't an article path
+def _get_item_date(path):
+    match = REGEX_ITEM_PATH(path)
+    if not match:
+        return None
+    try:
+        return datetime.date(int(match.group('year')), int(match.group('month')), int(match.group('day')))
+    except ValueError:
+        return None
+
+# Mirror crawls the site from START_PAGE with a bounded pool of threads, each
+#  with its own keep-alive HTTP session, and only downloads pages that changed
+#  since the ETag/Last-Modified we recorded for them last time.
+class Mirror(object):
+
+    def __init__(self, base_url, mode, workers, timeout, recheck_days):
+        self.base_url = base_url
+        self.mode = mode
+        self.workers = workers
+        self.timeout = timeout
+        self.oldest_item_date = datetime.date.today() - datetime.timedelta(days=recheck_days)
+
+        self.http_cache = {}
+        if os.path.exists(HTTP_CACHE_PATH):
+            with open(HTTP_CACHE_PATH) as f:
+                self.http_cache = json.load(f)
+
+        self.frontier = Queue.Queue()
+        self.seen = set()
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.stats = {'downloaded': 0, 'not_modified': 0, 'skipped': 0, 'failed': 0, 'bytes': 0}
+
+    def _count(self, stat, amount=1):
+        with self.lock:
+            self.stats[stat] += amount
+
+    # _in_frontier decides whether path should be fetched at all. A daily
+    #  mirror only re-checks articles from the last few days, plus any
+    #  articles we've never downloaded; a full mirror re-checks everything.
+    def _in_frontier(self, path):
+        if path.lower().endswith(REJECT_EXTENSIONS):
+            return False
+        if self.mode == 'full':
+            return True
+        item_date = _get_item_date(path)
+        if item_date is None or item_date >= self.oldest_item_date:
+            return True
+        return not os.path.exists(_get_local_path(path))
+
+    def _enqueue(self, path):
+        with self.lock:
+            if path in self.seen:
+                return
+            self.seen.add(path)
+        if self._in_frontier(path):
+            self.frontier.put(path)
+        else:
+            self._count('skipped')
+
+    # _enqueue_links adds every same-site link found in an HTML page to our frontier
+    def _enqueue_links(self, path, html):
+        page_url = urlparse.urljoin(self.base_url, path)
+        for href in REGEX_HREF(html):
+            url = urlparse.urldefrag(urlparse.urljoin(page_url, href))[0]
+            if not url.startswith(self.base_url):
+                continue
+            link_path = url[len(self.base_url):]
+            if '?' in link_path:
+                continue
+            self._enqueue(link_path)
+
+    def _get_session(self):
+        if not hasattr(self.local, 'session'):
+            self.local.session = requests.Session()
+        return self.local.session
+
+    def _save(self, path, response):
+        local_path = _get_local_path(path)
+        if not os.path.exists(os.path.dirname(local_path)):
+            try:
+                os.makedirs(os.path.dirname(local_path))
+            except OSError:
+                pass  # another thread beat us to it
+
+        with open(local_path + '.partial', 'wb') as f:
+            f.write(response.content)
+        os.rename(local_path + '.partial', local_path)
+
+        # keep the server's modification time on our copy, as wget does
+        last_modified = response.headers.get('last-modified')
+        if last_modified:
+            parsed = email.utils.parsedate_tz(last_modified)
+            if parsed:
+                mtime = email.utils.mktime_tz(parsed)
+                os.utime(local_path, (mtime, mtime))
+
+    def _fetch(self, path):
+        logger = logging.getLogger('')
+        local_path = _get_local_path(path)
+
+        headers = {}
+        cached = self.http_cache.get(path, {})
+        if os.path.exists(local_path):
+            if cached.get('etag'):
+                headers['If-None-Match'] = cached['etag']
+            if cached.get('last_modified'):
+                headers['If-Modified-Since'] = cached['last_modified']
+            else:
+                # eg. pages mirrored by wget, which kept server timestamps
+                headers['If-Modified-Since'] = email.utils.formatdate(os.path.getmtime(local_path), usegmt=True)
+
+        try:
+            response = self._get_session().get(self.base_url + path, headers=headers, timeout=self.timeout)
+        except requests.exceptions.RequestException as e:
+            logger.warning("RequestException: {} when attempting to fetch [{}].".format(e, path))
+            self._count('failed')
+            return
+
+        html = None
+        if response.status_code == 304:
+            self._count('not_modified')
+            logger.debug("Not modified: %s", path)
+            if path.lower().endswith(HTML_EXTENSIONS) or path.endswith('/'):
+                with open(local_path) as f:
+                    html = f.read()
+        elif response.status_code == 200:
+            self._save(path, response)
+            self._count('downloaded')
+            self._count('bytes', len(response.content))
+            logger.info("Downloaded %s (%d bytes).", path, len(response.content))
+            with self.lock:
+                self.http_cache[path] = {'etag':          response.headers.get('etag'),
+                                         'last_modified': response.headers.get('last-modified')}
+            if 'html' in response.headers.get('content-type', '') or path.lower().endswith(HTML_EXTENSIONS):
+                html = response.content
+        else:
+            logger.warning("HTTP {} when attempting to fetch [{}].".format(response.status_code, path))
+            self._count('failed')
+
+        if html is not None:
+            self._enqueue_links(path, html)
+
+    def _worker(self):
+        logger = logging.getLogger('')
+        while True:
+            path = self.frontier.get()
+            try:
+                if path is None:
+                    return
+                self._fetch(path)
+            except Exception as e:
+                logger.warning("{}: {} when attempting to mirror [{}].".format(type(e).__name__, e, path))
+                self._count('failed')
+            finally:
+                self.frontier.task_done()
+
+    def run(self):
+        self._enqueue(START_PAGE)
+
+        threads = []
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker)
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+
+        # the frontier is done once every page queued, including pages queued
+        #  by other pages, has been fetched
+        self.frontier.join()
+        for thread in threads:
+            self.frontier.put(None)
+        for thread in threads:
+            thread.join()
+
+        with open(HTTP_CACHE_PATH + '.partial', 'w') as f:
+            json.dump(self.http_cache, f)
+        os.rename(HTTP_CACHE_PATH + '.partial', HTTP_CACHE_PATH)
+
+        return self.stats
+
+# _git runs a git command against our mirror's repository, returning its output
+def _git(*args):
+    git_cmd = ['git', '--git-dir=' + os.path.join(MIRROR_ROOT, '.git'), '--work-tree=' + MIRROR_ROOT]
+    git_cmd.extend(args)
+    return subprocess.check_output(git_cmd)
+
+# _commit_mirror commits any changes to the mirror to its git repo, which is
+#  what queuer_kcna diffs to queue new and changed articles
+def _commit_mirror():
+    logger = logging.getLogger('')
+
+    # HEAD rather than .git, so that an empty .git (as service_kcna's inotify
+    #  watcher used to leave, if started before our first run) is initialized
+    if not os.path.exists(os.path.join(MIRROR_ROOT, '.git', 'HEAD')):
+        _git('init')
+
+    if not _git('status', '--short').strip():
+        logger.info("No changes to mirror detected!")
+        return
+
+    logger.info("Changes to mirror detected -> commiting to git repo...")
+    _git('add', '.')
+    git_log = _git('commit', '--status', '-m', "incremental update {}".format(TIME_START))
+    git_log += _git('log', '--name-status', '--pretty=format:', '-1')
+
+    with open(os.path.join(LOGS_ROOT, 'git_' + TIME_START + '.log'), 'w') as f:
+        f.write(git_log)
+
+# _get_args parses command line arguments
+def _get_args():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('mode', choices=['daily', 'full'],
+                        help="\"daily\" re-checks recent articles and site navigation; \"full\" re-checks the whole site")
+    parser.add_argument('--workers', type=int, default=8,
+                        help="number of concurrent HTTP connections (default: 8)")
+    parser.add_argument('--timeout', type=float, default=10,
+                        help="seconds to wait on each HTTP request (default: 10)")
+    parser.add_argument('--recheck-days', type=int, default=7,
+                        help="in daily mode, re-check articles from this many recent days (default: 7)")
+    args = parser.parse_args()
+    if args.workers < 1:
+        parser.error("--workers must be at least 1")
+    if args.timeout <= 0:
+        parser.error("--timeout must be more than 0")
+    return args
+
+def main():
+    args = _get_args()
+    logger = _get_logger()
+    logger.info("{} started at {}.".format(os.path.basename(__file__),TIME_START))
+    logger.debug("SCRIPT_ROOT {}".format(SCRIPT_ROOT))
+    logger.debug("PROJECT_ROOT {}".format(PROJECT_ROOT))
+    logger.debug("LOG_FILE_PATH {}".format(LOG_FILE_PATH))
+    logger.debug("MIRROR_ROOT {}".format(MIRROR_ROOT))
+
+    # if input test flag is set, we are in "dev" mode, and pull from localhost server
+    base_url = URL_PROD
+    if os.path.exists(TEST_PID_FILE_PATH):
+        logger.info("Found test-inputs-enabled flag: {}".format(TEST_PID_FILE_PATH))
+        base_url = URL_DEV
+
+    # if we are mirroring for the first time, we need a full mirror
+    mode = args.mode
+    if not os.path.exists(MIRROR_ROOT) and mode == 'daily':
+        logger.info("daily specified, but a full mirror doesn't exist yet, overriding to full mirror for this initial run.")
+        mode = 'full'
+
+    if( not os.path.exists(MIRROR_ROOT) ):
+        os.makedirs(MIRROR_ROOT)
+
+    logger.info("Mirroring {} ({} mode, {} workers).".format(base_url, mode, args.workers))
+    time_start = time.time()
+    stats = Mirror(base_url, mode, args.workers, args.timeout, args.recheck_days).run()
+    seconds = time.time() - time_start
+
+    logger.info("Downloaded {downloaded} pages ({bytes} bytes), {not_modified} not modified, {skipped} skipped, {failed} failed.".format(**stats))
+    logger.info("Mirrored in {:.2f}s ({:.2f} requests/sec).".format(seconds, (stats['downloaded'] + stats['not_modified'] + stats['failed']) / seconds if seconds else 0.0))
+
+    _commit_mirror()
+
+    TIME_END = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+    logger.info("{} finished at {}.".format(os.path.basename(__file__),TIME_END))
+
+    return(0)
+
+if(__name__ == '__main__'):
+    main()
+    sys.exit(0)
@@ -13,7 +13,9 @@
 #
 # OUTPUTS
 #	- Local mirrored copy of KCNA news website
-#	- log with downloads strings that can be input to `kcna_queuer.py`
+#	- git commit of mirror changes, which `queuer_kcna.py` diffs to queue articles
+#	  (wget rewrites mirrored files in place, so queue them with
+#	  `queuer_kcna.py --copy`; `mirror_kcna.py` is the supported mirror)
 #
 # REQUIREMENTS
 #	- wget
@@ -35,7 +37,6 @@ wget=/usr/local/bin/wget	# if on Mac OS, wget installed via Homebrew
 
 mirrorpath=$project_root/data/collector_kcna/mirror
 logpath=$project_root/var/logs
-queue_inbox_path=$project_root/data/collector_kcna/inbox_queuer
 test_pid_file_path=$project_root/etc/test-input-server.pid
 
 DIR_PREFIX="--directory-prefix=${mirrorpath}/www.kcna.co.jp"
@@ -249,19 +250,6 @@ else
 fi
 ############
 
-############
-# copy git logs if they exist to inbox_queuer
-######
-if [[ -f $logpath/git_${script_timestamp}.log ]]; then
-	if [[ ! -d "$queue_inbox_path" ]]; then
-		mkdir -p $queue_inbox_path
-	fi
-	echo "Copying git commit log to queuer inbox..."
-	cp $logpath/git_${script_timestamp}.log $queue_inbox_path/git_${script_timestamp}.log
-fi
-
-############
-
 echo "mirror_kcna.sh complete"
 
 #############################################################################
@@ -1,25 +1,44 @@
 #!/usr/bin/env python
 
-"""Queues HTML articles (to be processed in to JSON) based on Git commit logs after any mirroring of the KCNA website - part of the NKIR project."""
+"""Queues HTML articles (to be processed in to JSON) based on Git commits since the last run after any mirroring of the KCNA website - part of the NKIR project."""
 
+import argparse
 import datetime
+import errno
 import logging
 import os
 import re
 import shutil
+import subprocess
 import sys
 
 SCRIPT_ROOT = os.path.dirname(os.path.realpath(__file__))
 PROJECT_ROOT_REGEX = re.search("^(.*)/src/.*$", SCRIPT_ROOT)
 PROJECT_ROOT = PROJECT_ROOT_REGEX.group(1)
+
+# make our shared nkir library importable
+sys.path.append(os.path.join(PROJECT_ROOT, 'src'))
+from nkir import journal
+from nkir import logs
+from nkir import metrics
+
 TIME_START = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
 LOG_FILE_NAME = os.path.join(PROJECT_ROOT,'var/logs/queuer_kcna_' + TIME_START + '.log')
 QUEUER_INBOX_ROOT = os.path.join(PROJECT_ROOT,'data/collector_kcna/inbox_queuer')
 QUEUEUR_INBOX_ARCHIVE = os.path.join(QUEUER_INBOX_ROOT,"archive")
 JSON_INBOX_ROOT = os.path.join(PROJECT_ROOT,'data/collector_kcna/inbox_json')
 MIRROR_ROOT = os.path.join(PROJECT_ROOT,'data/collector_kcna/mirror/www.kcna.co.jp')
+LAST_COMMIT_PATH = os.path.join(PROJECT_ROOT,'data/collector_kcna/queuer_kcna.last_commit')
+JOURNAL_PATH = os.path.join(PROJECT_ROOT,'data/collector_kcna/journal_kcna.sqlite')
+
+# SHA of git's empty tree, to diff our first commit against
+GIT_EMPTY_TREE = '4b825dc642cb6eb9a060e54bf8d69288fbee4904'
+
+# whether _enqueue_article hard links articles (the default) or copies them,
+#  see _enqueue_article
+LINK_ARTICLES = True
 
-# article filepaths contained in the git log have the following naming conventions:
+# article filepaths contained in the git diff have the following naming conventions:
 #   item/1997/9701/news1/01.htm
 #   item/1998/9806/news06/10.htm
 #   item/2000/200001/news01/01.htm
@@ -57,7 +76,7 @@ def _get_filename_path_pre(regex_gitlog_match):
 def _get_filename_post(regex_gitlog_match):
     logger = logging.getLogger('')
     filename = regex_gitlog_match.group("file")
-    logger.debug("queuer_kcna::_get_filename_post filname [{}]".format(filename))
+    logger.debug("queuer_kcna::_get_filename_post filname [%s]", filename)
     if REGEX_FILENAME_NEW(filename):
         return filename
     elif REGEX_FILENAME_OLD(filename):
@@ -75,30 +94,176 @@ def _filter_log_lines(list, filter):
     return [ ( _get_filename_path_pre(m), _get_filename_post(m) ) for line in list for m in (filter(line),) if m ]
 
 # boilerplate logger singleton declaration
+# instantiate a logging object singleton for use throughout script, see
+#  nkir.logs
 def _get_logger():
-    logs_root_dir = re.search("^(.*/logs)/.*$", LOG_FILE_PATH).group(1)
+    return logs.get_logger(LOG_FILE_NAME)
+
+# _git runs a git command against our mirror's repository, returning its output
+def _git(*args):
+    git_cmd = ['git', '--git-dir=' + os.path.join(MIRROR_ROOT, '.git'), '--work-tree=' + MIRROR_ROOT]
+    git_cmd.extend(args)
+    return subprocess.check_output(git_cmd)
+
+# _get_last_commit returns the SHA of the last mirror commit we queued
+#  articles from, or None if we've never queued anything
+def _get_last_commit():
+    if not os.path.exists(LAST_COMMIT_PATH):
+        return None
+    with open(LAST_COMMIT_PATH) as f:
+        return f.read().strip() or None
+
+def _save_last_commit(commit):
+    with open(LAST_COMMIT_PATH + '.partial', 'w') as f:
+        f.write(commit + "\n")
+    os.rename(LAST_COMMIT_PATH + '.partial', LAST_COMMIT_PATH)
+
+# _enqueue_article hard links a mirrored article in to JSON_INBOX_ROOT, so
+#  that queueing costs no file copy and doesn't duplicate the mirror on disk,
+#  falling back on a copy if the inbox is on another filesystem.
+#
+# A link is only safe because mirror_kcna.py never rewrites a file in place,
+#  but writes a new one and renames it over the old, leaving the queued (and
+#  later archived) article as it was. Mirrors which do rewrite files in place,
+#  as wget does for mirror_kcna.sh, must be queued with --copy
+#  (LINK_ARTICLES False), or they'd change queued and archived articles too.
+def _enqueue_article(article_path, article_target_path):
+    if os.path.exists(article_target_path):
+        os.remove(article_target_path)
+    if not LINK_ARTICLES:
+        shutil.copy2(article_path, article_target_path)
+        return
+    try:
+        os.link(article_path, article_target_path)
+    except OSError as e:
+        if e.errno not in (errno.EXDEV, errno.EPERM):
+            raise
+        shutil.copy2(article_path, article_target_path)
+
+# _archive_git_logs moves git logs left in QUEUER_INBOX_ROOT by older versions
+#  of mirror_kcna.sh out of the way, as we now read the mirror's git history
+#  directly
+def _archive_git_logs():
+    logger = logging.getLogger('')
 
-    if( not os.path.exists(logs_root_dir) ):
-        os.makedirs(logs_root_dir)
+    if not os.path.exists(QUEUER_INBOX_ROOT):
+        return
 
-    # init the root logger (which logs to persistent local logfile)
-    logging.basicConfig(filename=LOG_FILE_NAME,
-                        format='%(asctime)s: %(levelname)-8s: %(message)s',
-                        datefmt='%m/%d/%Y %I:%M:%S %p',
-                        level=logging.DEBUG)
+    git_log_filenames = filter(lambda x:re.search(r'.log', x), os.listdir(QUEUER_INBOX_ROOT))
+    if git_log_filenames and not os.path.exists(QUEUEUR_INBOX_ARCHIVE):
+        os.makedirs(QUEUEUR_INBOX_ARCHIVE)
 
-    # configure console logger
-    _console_logger = logging.StreamHandler()
-    _console_logger.setLevel(logging.INFO)
-    _formatter = logging.Formatter('%(levelname)-8s %(message)s')
-    _console_logger.setFormatter(_formatter)
+    for git_log_filename in git_log_filenames:
+        git_log_path = os.path.join(QUEUER_INBOX_ROOT, git_log_filename)
+        git_log_archive_path = os.path.join(QUEUEUR_INBOX_ARCHIVE, git_log_filename)
+        try:
+            shutil.move(git_log_path, git_log_archive_path)
+        except IOError as e:
+            logger.warning("I/O error: {} when attempting move [{}] to [{}]".format(e.strerror, git_log_path, git_log_archive_path))
+        else:
+            logger.info("Moved {} to QUEUER_INBOX's archive.".format(git_log_filename))
+
+# _has_queued_before returns True if JSON_INBOX_ROOT's archive holds articles
+#  jsonified before, eg. by an install that queued articles from mirror_kcna.sh's
+#  git logs, before we recorded the last commit we queued from
+def _has_queued_before():
+    json_inbox_archive = os.path.join(JSON_INBOX_ROOT, 'archive')
+    if not os.path.exists(json_inbox_archive):
+        return False
+    return any(re.search(r'.htm', x) for x in os.listdir(json_inbox_archive))
+
+# queue_changed_articles links every article changed in the mirror since the
+#  last commit we queued from (or since commit since, if given) in to
+#  JSON_INBOX_ROOT, and journals them ready to jsonify, returning the list of
+#  queued filenames
+def queue_changed_articles(since=None):
+    logger = logging.getLogger('')
 
-    # add the console logger to root (file) logging handler
-    _root_logger = logging.getLogger('')
-    _root_logger.addHandler(_console_logger)
-    return _root_logger
+    # diff the mirror's latest commit against the last commit we queued from
+    #  (or against git's empty tree, queueing everything, on our first run)
+    head_commit = _git('rev-parse', 'HEAD').strip()
+    if since is not None:
+        last_commit = _git('rev-parse', '--verify', since + '^{commit}').strip()
+    else:
+        last_commit = _get_last_commit()
+
+    # an install upgraded from queueing mirror_kcna.sh's git logs has queued
+    #  the mirror already, without recording a last commit, and shouldn't
+    #  queue (and jsonify) every article ever mirrored again
+    if last_commit is None and _has_queued_before():
+        _save_last_commit(head_commit)
+        logger.warning("No last queued mirror commit recorded, but articles have been queued before; recorded {} as the last queued mirror commit "
+                       "rather than queueing the whole mirror again. Run queuer_kcna.py --since <commit> once to queue articles changed since an "
+                       "earlier commit.".format(head_commit))
+        return []
+
+    if last_commit == head_commit:
+        logger.info("No new mirror commits since {}.".format(last_commit))
+        return []
+
+    logger.info("Queueing articles changed between mirror commits {} and {}.".format(last_commit or 'EMPTY_TREE', head_commit))
+    with metrics.timer('queuer.git_diff'):
+        git_diff = _git('diff', '--name-status', '--no-renames', last_commit or GIT_EMPTY_TREE, head_commit)
+    with metrics.timer('queuer.regex_filter_diff'):
+        git_diff_articles = _filter_log_lines(git_diff.splitlines(), REGEX_GITLOG)
+
+    if( not os.path.exists(JSON_INBOX_ROOT) ):
+        os.makedirs(JSON_INBOX_ROOT)
+
+    # link relevant HTML files in to our JSON_INBOX_ROOT
+    total_articles = 0
+    queued_articles = 0
+    queued_filenames = []
+    for filename_path_pre, filename_post in git_diff_articles:
+        total_articles += 1
+
+        article_path = MIRROR_ROOT + "/" + filename_path_pre
+        article_target_path = os.path.join(JSON_INBOX_ROOT, filename_post)
+
+        try:
+            with metrics.timer('queuer.file_link'):
+                _enqueue_article(article_path, article_target_path)
+        except (IOError, OSError) as e:
+            logger.warning("I/O error: {} when attempting to queue [{}] as [{}]".format(e.strerror, article_path, article_target_path))
+        else:
+            queued_articles += 1
+            queued_filenames.append(filename_post)
+            logger.info("Queued %s in JSON_INBOX. (%d articles queued.)", filename_path_pre, queued_articles)
+
+    # journal queued articles as ready for jsonifier_kcna before recording
+    #  the commit, so a crash in between just queues them again
+    if queued_filenames:
+        journal.Journal(JOURNAL_PATH).add('jsonify', queued_filenames)
+
+    # only move on to the next commit if we queued everything ok, so that
+    #  anything that failed is retried on the next run
+    if( total_articles == queued_articles ):
+        _save_last_commit(head_commit)
+        logger.info("Recorded {} as last queued mirror commit.".format(head_commit))
+
+    logger.info("Queued {} HTML articles out of {} changed in mirror.".format(queued_articles, total_articles))
+    metrics.count('queuer.articles_changed', total_articles)
+    metrics.count('queuer.articles_queued', queued_articles)
+
+    return queued_filenames
+
+# _get_args parses command line arguments
+def _get_args():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--since', metavar='COMMIT',
+                        help="queue articles changed since this mirror commit, rather than since the last one queued from; "
+                             "eg. once after upgrading from queueing mirror_kcna.sh's git logs, to queue commits those didn't")
+    parser.add_argument('--copy', action='store_true',
+                        help="copy articles in to the JSON inbox rather than hard linking them; needed for mirrors which rewrite "
+                             "files in place, such as mirror_kcna.sh's wget mirror")
+    return parser.parse_args()
 
 def main():
+    global LINK_ARTICLES
+
+    args = _get_args()
+    LINK_ARTICLES = not args.copy
+
     logger = _get_logger()
     logger.info("{} started at {}.".format(os.path.basename(__file__),TIME_START))
     logger.debug("SCRIPT_ROOT {}".format(SCRIPT_ROOT))
@@ -106,60 +271,13 @@ def main():
     logger.debug("LOG_FILE_NAME {}".format(LOG_FILE_NAME))
     logger.debug("QUEUER_INBOX_ROOT {}".format(QUEUER_INBOX_ROOT))
     logger.debug("MIRROR_ROOT {}".format(MIRROR_ROOT))
+    logger.debug("LAST_COMMIT_PATH {}".format(LAST_COMMIT_PATH))
+    logger.debug("JOURNAL_PATH {}".format(JOURNAL_PATH))
 
-    # Look inside QUEUER_INBOX_ROOT for queueud Git logs
-    QUEUER_INBOX_ROOT_contents = os.listdir(QUEUER_INBOX_ROOT)
-    git_log_filenames = filter(lambda x:re.search(r'.log', x), QUEUER_INBOX_ROOT_contents)
-
-    processed_articles = 0
-
-    for git_log_filename in git_log_filenames:
-        git_log_path = os.path.join(QUEUER_INBOX_ROOT, git_log_filename)
-        logger.debug("git_log_path {}".format(git_log_path))
-
-        git_logs_articles = []
-
-        with open(git_log_path) as f:
-            git_logs_articles = _filter_log_lines(f, REGEX_GITLOG)
-
-        # copy relevant HTML files to our JSON_INBOX_ROOT
-        total_articles = 0
-        queued_articles = 0
-        for filename_path_pre, filename_post in git_logs_articles:
-            total_articles += 1
-
-            article_path = MIRROR_ROOT + "/" + filename_path_pre
-
-            if( not os.path.exists(JSON_INBOX_ROOT) ):
-                os.makedirs(JSON_INBOX_ROOT)
-
-            article_target_path = os.path.join(JSON_INBOX_ROOT, filename_post)
-
-            try:
-                shutil.copy2(article_path, article_target_path)
-            except IOError as e:
-                logger.warning("I/O error: {} when attempting copy from [{}] to [{}]".format(e.strerror, article_path, article_target_path))
-            else:
-                logger.info("Copied {} to JSON_INBOX. ({} articles copied.)".format(filename_path_pre, queued_articles))
-                queued_articles += 1
-
-        # archive git log file if we queued/copied everything ok
-        if( total_articles == queued_articles ):
-            processed_articles += total_articles
-
-            if( not os.path.exists(QUEUEUR_INBOX_ARCHIVE) ):
-                os.makedirs(QUEUEUR_INBOX_ARCHIVE)
-
-            git_log_archive_path = os.path.join(QUEUEUR_INBOX_ARCHIVE, git_log_filename)
-
-            try:
-                shutil.move(git_log_path, git_log_archive_path)
-            except IOError as e:
-                logger.warning("I/O error: {} when attempting move [{}] to [{}]".format(e.strerror, git_log_path, git_log_archive_path))
-            else:
-                logger.info("Moved {} to QUEUER_INBOX's archive.".format(git_log_filename))
+    _archive_git_logs()
+    queue_changed_articles(args.since)
+    metrics.write_summary(LOG_FILE_NAME)
 
-    logger.info("Processed {} HTML articles out of {} git log files.".format(processed_articles, len(git_log_filenames)))
     TIME_END = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
     logger.info("{} finished at {}.".format(os.path.basename(__file__),TIME_END))
 
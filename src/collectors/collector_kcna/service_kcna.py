@@ -0,0 +1,391 @@
+#!/usr/bin/env python
+
+"""Runs the KCNA collector pipeline (queue, jsonify, import) as one long-running service, watching for new mirror commits - part of the NKIR project."""
+
+# Rather than cron starting queuer_kcna, jsonifier_kcna and dbimporter_kcna in
+#  turn (each importing BeautifulSoup/pymongo and then exiting), this keeps
+#  one warm process running three stages:
+#
+#   watch:    waits for a new mirror commit (with inotify if pyinotify is
+#             installed, otherwise by polling with backoff), queues changed
+#             articles like queuer_kcna, and claims HTML files ready to
+#             jsonify from our pipeline journal
+#   jsonify:  converts each claimed HTML file to JSON, like jsonifier_kcna
+#   import:   claims and imports JSON files in batches, like dbimporter_kcna
+#
+# with bounded queues between stages, so a slow stage holds back the stages
+#  feeding it rather than memory growing without limit. Every stage records
+#  its progress in the same journal as the scripts do, so the service and the
+#  scripts can be swapped for each other (or restarted) at any time. Run
+#  mirror_kcna.py from cron as before; its commits reach MongoDB within
+#  seconds.
+
+import argparse
+import datetime
+import logging
+import os
+import Queue
+import re
+import signal
+import subprocess
+import sys
+import threading
+import time
+
+import dbimporter_kcna
+import jsonifier_kcna
+import queuer_kcna
+
+SCRIPT_ROOT = os.path.dirname(os.path.realpath(__file__))
+PROJECT_ROOT_REGEX = re.search("^(.*)/src/.*$", SCRIPT_ROOT)
+PROJECT_ROOT = PROJECT_ROOT_REGEX.group(1)
+
+# make our shared nkir library importable
+sys.path.append(os.path.join(PROJECT_ROOT, 'src'))
+from nkir import columnar
+from nkir import db as nkir_db
+from nkir import journal
+from nkir import logs
+from nkir import metrics
+
+TIME_START = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+LOG_FILE_PATH = os.path.join(PROJECT_ROOT, 'var/logs/service_kcna_'+TIME_START+'.log')
+METRICS_INTERVAL = 3600  # seconds between rewriting our metrics summary
+
+# pyinotify is optional; without it, we poll
+try:
+    import pyinotify
+except ImportError:
+    pyinotify = None
+
+# instantiate a logging object singleton for use throughout script, see
+#  nkir.logs
+def _get_logger():
+    return logs.get_logger(LOG_FILE_PATH)
+
+# PollWatcher waits between scans with exponential backoff: quickly while
+#  there's work turning up, and then less and less often while idle
+class PollWatcher(object):
+    name = 'polling'
+
+    def __init__(self, min_interval, max_interval):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.interval = min_interval
+
+    def wait(self, stop, found_work):
+        if found_work:
+            self.interval = self.min_interval
+        else:
+            self.interval = min(self.interval * 2, self.max_interval)
+        stop.wait(self.interval)
+
+    def close(self):
+        pass
+
+# _get_watch_root returns path, or its nearest ancestor if it doesn't exist yet
+def _get_watch_root(path):
+    while not os.path.isdir(path) and os.path.dirname(path) != path:
+        path = os.path.dirname(path)
+    return path
+
+# InotifyWatcher waits until a file is written or moved in to one of paths
+#  (or max_interval passes, as a safety net), and then waits min_interval
+#  more so that a burst of files is picked up in one scan. It checks for
+#  events every STOP_INTERVAL seconds, so as not to hold up stopping.
+# A path that doesn't exist yet (eg. the mirror's .git, before mirror_kcna
+#  first runs) is never created, which would leave mirror_kcna with an empty
+#  .git it takes for a repository; its nearest existing ancestor is watched
+#  instead, until it appears.
+class InotifyWatcher(object):
+    name = 'inotify'
+    STOP_INTERVAL = 1
+
+    def __init__(self, paths, min_interval, max_interval):
+        self.paths = paths
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.mask = pyinotify.IN_CLOSE_WRITE | pyinotify.IN_MOVED_TO | pyinotify.IN_CREATE
+        self.watch_manager = pyinotify.WatchManager()
+        self.notifier = pyinotify.Notifier(self.watch_manager)
+        # {watched directory: watch descriptor}
+        self.watches = {}
+        self._update_watches()
+
+    # _update_watches watches each of our paths, or the nearest ancestor of
+    #  those which don't exist yet, and stops watching any others
+    def _update_watches(self):
+        roots = set(_get_watch_root(path) for path in self.paths)
+        for root in set(self.watches) - roots:
+            self.watch_manager.rm_watch(self.watches.pop(root))
+        for root in roots - set(self.watches):
+            self.watches[root] = self.watch_manager.add_watch(root, self.mask)[root]
+
+    def wait(self, stop, found_work):
+        if found_work:
+            stop.wait(self.min_interval)
+            return
+        waited = 0
+        while waited < self.max_interval and not stop.is_set():
+            self._update_watches()
+            timeout = min(self.STOP_INTERVAL, self.max_interval - waited)
+            if self.notifier.check_events(timeout=int(round(timeout * 1000))):
+                self.notifier.read_events()
+                self.notifier.process_events()
+                self._update_watches()
+                stop.wait(self.min_interval)
+                return
+            waited += timeout
+
+    def close(self):
+        self.notifier.stop()
+
+class Service(object):
+
+    def __init__(self, watcher, journal, coll, store, queue_size, batch_size, linger):
+        self.watcher = watcher
+        self.journal = journal
+        self.coll = coll
+        self.store = store
+        self.batch_size = batch_size
+        self.linger = linger
+        self.stop = threading.Event()
+
+        # claimed html filenames waiting to be jsonified, and wake ups for the
+        #  import stage (one per jsonified file, or None for files found ready)
+        self.json_queue = Queue.Queue(queue_size)
+        self.db_queue = Queue.Queue(queue_size)
+        self.head_commit = None
+
+    # _put puts item on queue, blocking while the queue is full (which holds
+    #  back the stage feeding it) unless we're stopping. Returns False if
+    #  the item wasn't queued because we're stopping.
+    def _put(self, queue, item):
+        while not self.stop.is_set():
+            try:
+                queue.put(item, timeout=1)
+                return True
+            except Queue.Full:
+                continue
+        return False
+
+    # _scan queues any changed articles from new mirror commits, and claims
+    #  as many HTML files ready to jsonify as json_queue has room for,
+    #  returning whether it found any work (including files still ready to
+    #  claim once there's room)
+    def _scan(self):
+        logger = logging.getLogger('')
+        found_work = False
+
+        # only diff the mirror when its HEAD has moved since we last did, and
+        #  not at all until mirror_kcna has made its first commit
+        head_commit = None
+        if os.path.exists(os.path.join(queuer_kcna.MIRROR_ROOT, '.git', 'HEAD')):
+            try:
+                head_commit = queuer_kcna._git('rev-parse', '--verify', '-q', 'HEAD').strip()
+            except subprocess.CalledProcessError:
+                logger.debug("Mirror has no commits yet.")
+        if head_commit is not None and head_commit != self.head_commit:
+            with metrics.timer('service.queue_changed_articles'):
+                if queuer_kcna.queue_changed_articles():
+                    found_work = True
+            self.head_commit = head_commit
+
+        room = self.json_queue.maxsize - self.json_queue.qsize()
+        if room > 0:
+            for html_filename in self.journal.claim('jsonify', room):
+                if not self._put(self.json_queue, html_filename):
+                    return found_work
+                found_work = True
+
+        # files left ready because json_queue is full are still work, which
+        #  no new file will wake us for
+        if not found_work and self.journal.get_counts('jsonify')['ready']:
+            found_work = True
+
+        if self.journal.get_counts('import')['ready']:
+            self._put(self.db_queue, None)
+
+        if found_work:
+            logger.debug("Scan found work; {} files queued to jsonify.".format(self.json_queue.qsize()))
+        return found_work
+
+    def _watch_stage(self):
+        logger = logging.getLogger('')
+        while not self.stop.is_set():
+            found_work = False
+            try:
+                found_work = self._scan()
+            except Exception as e:
+                logger.exception("{}: {} when scanning for new work.".format(type(e).__name__, e))
+            self.watcher.wait(self.stop, found_work)
+
+    def _jsonify_stage(self):
+        logger = logging.getLogger('')
+        while not self.stop.is_set():
+            try:
+                html_filename = self.json_queue.get(timeout=1)
+            except Queue.Empty:
+                continue
+
+            # _process_html_file records each file done or failed in our journal
+            html_file_path = os.path.join(jsonifier_kcna.INBOX_JSON_ROOT, html_filename)
+            try:
+                html_filename, ok, worker_pid, seconds, worker_metrics = jsonifier_kcna._process_html_file(html_filename)
+                metrics.merge(worker_metrics)
+            except Exception as e:
+                logger.exception("{}: {} when converting [{}] to JSON.".format(type(e).__name__, e, html_file_path))
+                self.journal.fail('jsonify', html_filename, "{}: {}".format(type(e).__name__, e))
+                continue
+
+            if ok:
+                metrics.count('service.articles_jsonified')
+                self._put(self.db_queue, html_filename)
+            elif os.path.exists(html_file_path):
+                logger.warning("html_to_json error: {} was not successfully processed from HTML -> JSON.".format(html_file_path))
+
+    def _import_stage(self):
+        logger = logging.getLogger('')
+        while not self.stop.is_set():
+            try:
+                self.db_queue.get(timeout=1)
+            except Queue.Empty:
+                continue
+
+            # linger briefly, so files jsonified close together are imported
+            #  in one batch
+            deadline = time.time() + self.linger
+            while time.time() < deadline:
+                try:
+                    self.db_queue.get(timeout=max(deadline - time.time(), 0.01))
+                except Queue.Empty:
+                    break
+
+            try:
+                json_filenames = self.journal.iter_claims('import', self.batch_size)
+                total_articles, processed_articles, skipped_articles = dbimporter_kcna.import_json_files(
+                    self.coll, self.store, json_filenames, self.batch_size)
+            except Exception as e:
+                logger.exception("{}: {} when importing JSON documents.".format(type(e).__name__, e))
+                # return our claims for the next attempt, and back off rather
+                #  than spin on (eg.) an unreachable MongoDB
+                self.journal.release('import')
+                self.stop.wait(5)
+                continue
+
+            metrics.count('service.articles_imported', processed_articles)
+            logger.info("Imported {} json articles out of {} ({} were unchanged and skipped).".format(
+                        processed_articles, total_articles, skipped_articles))
+
+    # run runs every stage until stopped (eg. by SIGTERM), finishing the
+    #  article each stage is working on before returning
+    def run(self):
+        logger = logging.getLogger('')
+
+        threads = []
+        for stage in [self._watch_stage, self._jsonify_stage, self._import_stage]:
+            thread = threading.Thread(target=stage, name=stage.__name__)
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+
+        metrics_written = time.time()
+        while not self.stop.is_set():
+            # wait with a timeout, as python 2 can't deliver signals to a
+            #  thread blocked waiting on an event without one
+            self.stop.wait(1)
+            if time.time() - metrics_written > METRICS_INTERVAL:
+                metrics.write_summary(LOG_FILE_PATH)
+                metrics_written = time.time()
+
+        logger.info("Stopping; waiting for each stage to finish its current work...")
+        for thread in threads:
+            thread.join()
+        self.watcher.close()
+
+# _get_args parses command line arguments
+def _get_args():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--poll', action='store_true',
+                        help="poll for new work, even if pyinotify is installed")
+    parser.add_argument('--min-interval', type=float, default=0.5,
+                        help="seconds between scans while there's work turning up (default: 0.5)")
+    parser.add_argument('--max-interval', type=float, default=30,
+                        help="most seconds between scans while idle (default: 30)")
+    parser.add_argument('--queue-size', type=int, default=1000,
+                        help="most files waiting between any two stages (default: 1000)")
+    parser.add_argument('--batch-size', type=int, default=1000,
+                        help="number of documents inserted per bulk write (default: 1000)")
+    parser.add_argument('--linger', type=float, default=1.0,
+                        help="seconds to gather jsonified files before importing them as a batch (default: 1.0)")
+    parser.add_argument('--store', choices=['mongo', 'columnar', 'both'], default='mongo',
+                        help="import in to MongoDB, dbimporter_kcna's columnar store, or both (default: mongo)")
+    parser.add_argument('--detector', choices=['ngram', 'google'], default='ngram',
+                        help="language detection backend: offline ngram model or Google Translate API (default: ngram)")
+    return parser.parse_args()
+
+def main():
+    args = _get_args()
+    logger = _get_logger()
+    logger.info("{} started at {}.".format(os.path.basename(__file__),TIME_START))
+    logger.debug("SCRIPT_ROOT {}".format(SCRIPT_ROOT))
+    logger.debug("PROJECT_ROOT {}".format(PROJECT_ROOT))
+    logger.debug("LOG_FILE_PATH {}".format(LOG_FILE_PATH))
+
+    # warm everything up once: language detector, journal, output
+    #  directories, and our MongoDB connection and indexes
+    jsonifier_kcna.DETECTOR = jsonifier_kcna._get_detector(args.detector)
+
+    pipeline_journal = journal.Journal(queuer_kcna.JOURNAL_PATH)
+    jsonifier_kcna.JOURNAL = pipeline_journal
+    dbimporter_kcna.JOURNAL = pipeline_journal
+    for directory in [jsonifier_kcna.INBOX_JSON_ROOT, jsonifier_kcna.INBOX_JSON_ARCHIVE,
+                      os.path.join(jsonifier_kcna.INBOX_JSON_ARCHIVE,'spanish'), dbimporter_kcna.INBOX_DB_ROOT]:
+        if( not os.path.exists(directory) ):
+            os.makedirs(directory)
+
+    for stage, inbox_root, regex in [('jsonify', jsonifier_kcna.INBOX_JSON_ROOT, r'.htm'),
+                                     ('import', dbimporter_kcna.INBOX_DB_ROOT, r'.json')]:
+        if not pipeline_journal.is_seeded(stage):
+            pipeline_journal.seed(stage, filter(lambda x:re.search(regex, x), os.listdir(inbox_root)))
+        pipeline_journal.recover(stage)
+
+    coll = None
+    if args.store in ('mongo', 'both'):
+        coll = nkir_db.get_collection(dbimporter_kcna.COLLECTION_NAME)
+        dbimporter_kcna._ensure_unique_urls(coll)
+        dbimporter_kcna.ensure_indexes(coll)
+
+    store = None
+    if args.store in ('columnar', 'both'):
+        if not columnar.is_available():
+            logger.error("Columnar store requested, but pyarrow isn't installed; exiting.")
+            sys.exit(1)
+        store = columnar.ArticleStore(dbimporter_kcna.COLUMNAR_ROOT)
+
+    if pyinotify is not None and not args.poll:
+        watcher = InotifyWatcher([os.path.join(queuer_kcna.MIRROR_ROOT, '.git')],
+                                 args.min_interval, args.max_interval)
+    else:
+        watcher = PollWatcher(args.min_interval, args.max_interval)
+    logger.info("Watching for new mirror commits by {}.".format(watcher.name))
+
+    service = Service(watcher, pipeline_journal, coll, store, args.queue_size, args.batch_size, args.linger)
+
+    def _stop(signum, frame):
+        logger.info("Received signal {}.".format(signum))
+        service.stop.set()
+    signal.signal(signal.SIGTERM, _stop)
+    signal.signal(signal.SIGINT, _stop)
+
+    service.run()
+
+    metrics.write_summary(LOG_FILE_PATH)
+    TIME_END = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+    logger.info("{} finished at {}.".format(os.path.basename(__file__),TIME_END))
+
+    return(0)
+
+if(__name__ == '__main__'):
+    main()
+    sys.exit(0)
@@ -0,0 +1 @@
+"""Shared library code for the NKIR collectors and reporters."""
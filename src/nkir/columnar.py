@@ -0,0 +1,271 @@
+#!/usr/bin/env python
+
+"""Append-only, year partitioned Parquet store of articles, for reporters to read without MongoDB."""
+
+# The store is a directory of Parquet files looking like:
+#   <root>/year=1997/part-<TIMESTAMP>-<PID>.parquet
+#   <root>/year=2014/part-<TIMESTAMP>-<PID>.parquet
+# Every append writes new part files and never rewrites old ones, so an
+#  article re-imported later simply has more than one row; get_latest_rows
+#  finds only the most recently imported row of each url, and reads columns
+#  of just those rows, as Arrow arrays. compact rewrites each year's parts as
+#  one file of latest rows.
+#
+# Columns added to COLUMNS later read as nulls from parts written before.
+#
+# pyarrow (and numpy) are optional dependencies, only needed to use a store:
+#  `pip install pyarrow`.
+
+import datetime
+import logging
+import os
+import re
+
+try:
+    import numpy
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+# column name: Arrow type name, for every column we store
+COLUMNS = [
+    ('url',          'string'),
+    ('parent_url',   'string'),
+    ('published',    'string'),
+    ('title',        'string'),
+    ('location',     'string'),
+    ('news_service', 'string'),
+    ('text',         'string'),   # paragraphs joined with newlines
+    ('imported_us',  'int64'),    # microseconds since the epoch, UTC
+    ('tokens',       'string'),   # token stream, see nkir.tokens
+    ('tokens_version', 'int64'),
+]
+
+REGEX_YEAR = re.compile(r"^(\d\d\d\d)").match
+REGEX_PARTITION = re.compile(r"^year=(\d\d\d\d)$").match
+EPOCH = datetime.datetime(1970, 1, 1)
+
+def is_available():
+    return pyarrow is not None
+
+def get_imported_us(imported):
+    return int((imported - EPOCH).total_seconds() * 1000000)
+
+# get_numpy returns the values of array, an Arrow array of integers, as a
+#  numpy int64 array, with null_value for its nulls
+def get_numpy(array, null_value):
+    values = array.to_numpy(zero_copy_only=False)
+    if array.null_count:
+        # nulls come back as NaN, in floats
+        values = numpy.where(numpy.isnan(values), null_value, values)
+    return values.astype(numpy.int64)
+
+# map_values returns a numpy object array of func applied to each value of
+#  array, an Arrow array, calling func only once per distinct value (eg. to
+#  normalize a column of dates)
+def map_values(array, func):
+    encoded = array.dictionary_encode()
+    # nulls' ids are -1, and so are mapped to the last result, func(None)
+    results = numpy.array([func(value) for value in encoded.dictionary.to_pylist()] + [func(None)], dtype=object)
+    return results[get_numpy(encoded.indices, -1)]
+
+# take returns the values of array, an Arrow array, at indices, as a list of
+#  python objects
+def take(array, indices):
+    return array.take(pyarrow.array(indices, type=pyarrow.int64())).to_pylist()
+
+# _get_array returns chunked, a pyarrow ChunkedArray, as one Array
+def _get_array(chunked):
+    if chunked.num_chunks == 1:
+        return chunked.chunk(0)
+    if chunked.num_chunks == 0:
+        return pyarrow.array([], type=chunked.type)
+    return pyarrow.concat_arrays(chunked.chunks)
+
+# _get_empty_array returns an empty Array of column's type
+def _get_empty_array(column):
+    return pyarrow.array([], type=getattr(pyarrow, dict(COLUMNS)[column])())
+
+# get_row returns a store row for an article in our MongoDB JSON schema
+def get_row(json_data):
+    metadata = json_data['data']['metadata']
+    return {
+        'url':          metadata.get('article_url'),
+        'parent_url':   metadata.get('parent_url'),
+        'published':    metadata.get('date_published'),
+        'title':        metadata.get('title'),
+        'location':     metadata.get('location'),
+        'news_service': metadata.get('news_service'),
+        'text':         "\n".join(json_data['data'].get('text') or []),
+        'imported_us':  get_imported_us(json_data.get('imported') or datetime.datetime.utcnow()),
+        'tokens':       json_data.get('tokens'),
+        'tokens_version': json_data.get('tokens_version'),
+    }
+
+class ArticleStore(object):
+
+    def __init__(self, root):
+        if pyarrow is None:
+            raise ImportError("the columnar article store needs pyarrow and numpy installed")
+        self.root = root
+
+    def _get_year(self, row):
+        year = REGEX_YEAR(row.get('published') or '')
+        return year.group(1) if year else '0000'
+
+    def _get_part_paths(self, years=None):
+        part_paths = []
+        if not os.path.isdir(self.root):
+            return part_paths
+
+        for partition in sorted(os.listdir(self.root)):
+            year = REGEX_PARTITION(partition)
+            if not year or (years is not None and year.group(1) not in years):
+                continue
+            partition_root = os.path.join(self.root, partition)
+            part_paths.extend(os.path.join(partition_root, part)
+                              for part in sorted(os.listdir(partition_root)) if part.endswith('.parquet'))
+        return part_paths
+
+    def _write_part(self, year, rows):
+        arrays = [pyarrow.array([row.get(name) for row in rows], type=getattr(pyarrow, type_name)())
+                  for name, type_name in COLUMNS]
+        return self._write_table(year, pyarrow.Table.from_arrays(arrays, names=[name for name, type_name in COLUMNS]))
+
+    def _write_table(self, year, table):
+        partition_root = os.path.join(self.root, 'year=' + year)
+        if( not os.path.exists(partition_root) ):
+            os.makedirs(partition_root)
+
+        # write to a temporary (non-.parquet) name first and then rename, so
+        #  readers never see a partially written part
+        part_path = os.path.join(partition_root, 'part-{}-{}.parquet'.format(
+                                 datetime.datetime.utcnow().strftime("%Y%m%d_%H%M%S_%f"), os.getpid()))
+        pyarrow.parquet.write_table(table, part_path + '.partial')
+        os.rename(part_path + '.partial', part_path)
+        return part_path
+
+    # append writes rows (dicts of COLUMNS, see get_row) as one new part file
+    #  per year they were published in
+    def append(self, rows):
+        logger = logging.getLogger('')
+
+        rows_by_year = {}
+        for row in rows:
+            rows_by_year.setdefault(self._get_year(row), []).append(row)
+
+        for year, year_rows in sorted(rows_by_year.items()):
+            part_path = self._write_part(year, year_rows)
+            logger.debug("Appended {} articles to columnar store part {}.".format(len(year_rows), part_path))
+
+    # _read_part returns a pyarrow Table of columns from the part at
+    #  part_path, with nulls for any columns the part was written without
+    def _read_part(self, part_path, columns):
+        part_columns = set(pyarrow.parquet.read_schema(part_path, memory_map=True).names)
+        table = pyarrow.parquet.read_table(part_path, columns=[column for column in columns if column in part_columns],
+                                           memory_map=True)
+        if part_columns.issuperset(columns):
+            return table
+
+        types = dict(COLUMNS)
+        arrays = [table.column(column) if column in part_columns
+                  else pyarrow.array([None] * table.num_rows, type=getattr(pyarrow, types[column])())
+                  for column in columns]
+        return pyarrow.Table.from_arrays(arrays, names=columns)
+
+    # _read_parts returns a pyarrow Table of columns from the parts at
+    #  part_paths, or None if there are none
+    def _read_parts(self, part_paths, columns):
+        tables = [self._read_part(part_path, columns) for part_path in part_paths]
+        if not tables:
+            return None
+        return pyarrow.concat_tables(tables)
+
+    # read returns a pyarrow Table of columns from every part (of years, if
+    #  given), memory mapping each part file rather than reading it in
+    def read(self, columns, years=None):
+        return self._read_parts(self._get_part_paths(years), columns)
+
+    # get_latest_rows returns the LatestRows of every part (of years, if
+    #  given): one row per url, its most recently imported, leaving out whole
+    #  old style daily pages which have since been split in to articles
+    def get_latest_rows(self, years=None):
+        part_paths = self._get_part_paths(years)
+        table = self._read_parts(part_paths, ['url', 'parent_url', 'imported_us'])
+        if table is None:
+            return LatestRows(self, part_paths, numpy.array([], dtype=numpy.int64))
+
+        # urls and parent urls as ids of one dictionary, so that they're
+        #  compared as integers rather than as python strings
+        urls = _get_array(table.column('url'))
+        url_ids = get_numpy(pyarrow.concat_arrays([urls, _get_array(table.column('parent_url'))]).dictionary_encode().indices, -1)
+        url_ids, parent_url_ids = url_ids[:len(urls)], url_ids[len(urls):]
+
+        # newest rows first (stable, so later parts win ties), then the first
+        #  row of each url
+        order = numpy.argsort(-get_numpy(_get_array(table.column('imported_us')), 0), kind='mergesort')
+        unique_ids, first = numpy.unique(url_ids[order], return_index=True)
+        latest = order[first]
+
+        parent_url_ids = parent_url_ids[latest]
+        parent_url_ids = parent_url_ids[parent_url_ids >= 0]
+        if len(parent_url_ids):
+            latest = latest[~numpy.in1d(url_ids[latest], parent_url_ids)]
+
+        # in stored order, for reading
+        return LatestRows(self, part_paths, numpy.sort(latest))
+
+    # read_latest returns {column: pyarrow Array} of columns of our latest
+    #  rows, see get_latest_rows
+    def read_latest(self, columns, years=None):
+        return self.get_latest_rows(years).read(columns)
+
+    # compact rewrites each year's part files as a single part of latest rows
+    def compact(self):
+        logger = logging.getLogger('')
+        column_names = [name for name, type_name in COLUMNS]
+
+        years = sorted(set(REGEX_PARTITION(os.path.basename(os.path.dirname(part_path))).group(1)
+                           for part_path in self._get_part_paths()))
+        for year in years:
+            part_paths = self._get_part_paths([year])
+            if len(part_paths) < 2:
+                continue
+
+            latest = self.read_latest(column_names, [year])
+            table = pyarrow.Table.from_arrays([latest[name] for name in column_names], names=column_names)
+            self._write_table(year, table)
+            for part_path in part_paths:
+                os.remove(part_path)
+            logger.info("Compacted {} columnar store parts for {} in to one of {} articles.".format(len(part_paths), year, table.num_rows))
+
+# LatestRows are the rows of an ArticleStore's parts holding the latest import
+#  of each article, found by ArticleStore.get_latest_rows, from which any of
+#  their columns can be read. Reading columns as they're needed, rather than
+#  all at once, reads each from the same parts, so rows always line up.
+class LatestRows(object):
+
+    def __init__(self, store, part_paths, indices):
+        self.store = store
+        self.part_paths = part_paths
+        self.indices = indices
+
+    def __len__(self):
+        return len(self.indices)
+
+    # filter returns the LatestRows of just our rows where mask, a numpy array
+    #  of booleans (one per row), is True
+    def filter(self, mask):
+        return LatestRows(self.store, self.part_paths, self.indices[mask])
+
+    # read returns {column: pyarrow Array} of our rows' columns, as Arrow
+    #  arrays, so that (string) columns only become python objects when and
+    #  where they're used, eg. a slice at a time with to_pylist
+    def read(self, columns):
+        table = self.store._read_parts(self.part_paths, columns) if len(self.indices) else None
+        if table is None:
+            return dict((column, _get_empty_array(column)) for column in columns)
+
+        indices = pyarrow.array(self.indices)
+        return dict((column, _get_array(table.column(column)).take(indices)) for column in columns)
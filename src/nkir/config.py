@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+
+"""Read this machine's NKIR configuration from etc/nkir.ini."""
+
+import ConfigParser
+import os
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+CONFIG_FILE_PATH = os.path.join(PROJECT_ROOT, 'etc/nkir.ini')
+
+# defaults for every setting, so that an empty (or missing) nkir.ini works
+DEFAULTS = {
+    'mongodb': {
+        'host':                  'localhost',
+        'port':                  '28017',
+        'db_name':               'NKODP',
+        'max_pool_size':         '10',
+        'connect_timeout_ms':    '20000',
+        'socket_timeout_ms':     '',
+        'wait_queue_timeout_ms': '',
+    },
+    'metrics': {
+        'textfile_dir':          '',
+    },
+    'logging': {
+        'level':                 'DEBUG',
+        'console_level':         'INFO',
+        'max_bytes':             '104857600',
+        'compress_after_days':   '1',
+        'keep_days':             '90',
+    },
+    # levels for particular modules' messages, looking like {module: level}
+    'logging_levels': {
+    },
+}
+
+# config singleton, see get_config
+_CONFIG = None
+
+# get_config returns our parsed configuration, reading nkir.ini on first use
+def get_config():
+    global _CONFIG
+
+    if _CONFIG is None:
+        _CONFIG = ConfigParser.RawConfigParser()
+        for section, options in DEFAULTS.items():
+            _CONFIG.add_section(section)
+            for option, value in options.items():
+                _CONFIG.set(section, option, value)
+        _CONFIG.read(CONFIG_FILE_PATH)
+
+    return _CONFIG
+
+def get(section, option):
+    return get_config().get(section, option)
+
+# getint returns an integer setting, or None if the setting is left blank
+def getint(section, option):
+    value = get(section, option).strip()
+    if not value:
+        return None
+    return int(value)
@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+
+"""Memoized normalization of KCNA publish dates, shared by NKIR collectors and reporters."""
+
+# KCNA pages date their articles like "February 3 2014 Juche 103", with the
+#  odd misspelt or abbreviated month ("Februar", "Sept."). There are only a
+#  few thousand distinct date strings across the whole archive, so every
+#  normalization here is remembered, and repeats cost one dict lookup.
+#
+# Dates end up in three forms:
+#  - ISO date strings ("2014-02-03"), as output by reporters
+#  - "2014-02-03 00:00:00" strings, as jsonifier_kcna has always written
+#    data.metadata.date_published
+#  - native datetimes (at midnight), as dbimporter_kcna stores "published" in
+#    MongoDB, so reporters needn't parse strings at all
+
+import datetime
+import re
+
+# Juche year 1 is 1912
+JUCHE_EPOCH = 1911
+
+# month numbers by the first three letters of their (lowercased) names, so
+#  that truncated and abbreviated months are recognized too
+MONTHS = dict((datetime.date(2000, month, 1).strftime("%B")[:3].lower(), month) for month in range(1, 13))
+
+REGEX_KCNA_DATE = re.compile(r"^\s*([A-Za-z]{3,})\s*(\d{1,2})(?:\s+(\d{4}))?").match
+REGEX_ISO_DATE = re.compile(r"^\s*(\d{4})-(\d{2})-(\d{2})").match
+
+# most distinct values we remember (far more than KCNA has dates) before
+#  starting over
+CACHE_SIZE = 100000
+_CACHE = {}
+
+# _parse returns the date in value (a KCNA date string, or an ISO date or
+#  datetime string), using juche_year for KCNA dates without a year, or None
+#  if it has none
+def _parse(value, juche_year):
+    iso_match = REGEX_ISO_DATE(value)
+    if iso_match:
+        year, month, day = [int(group) for group in iso_match.groups()]
+    else:
+        kcna_match = REGEX_KCNA_DATE(value.replace('Juche', '').replace('.', ' ').replace(',', ' '))
+        if not kcna_match:
+            return None
+        month_name, day, year = kcna_match.groups()
+        month = MONTHS.get(month_name[:3].lower())
+        if month is None:
+            return None
+        if year is None:
+            if juche_year is None:
+                return None
+            year = int(juche_year) + JUCHE_EPOCH
+        year, day = int(year), int(day)
+
+    try:
+        return datetime.date(year, month, day)
+    except ValueError:
+        return None
+
+# get_date returns value (a KCNA date string, an ISO date or datetime string,
+#  or a date or datetime) as a datetime.date, or None if it isn't a date
+def get_date(value, juche_year=None):
+    if value is None:
+        return None
+    if isinstance(value, datetime.datetime):
+        return value.date()
+    if isinstance(value, datetime.date):
+        return value
+
+    key = (value, juche_year)
+    try:
+        return _CACHE[key][0]
+    except KeyError:
+        pass
+
+    if len(_CACHE) >= CACHE_SIZE:
+        _CACHE.clear()
+    date = _parse(value, juche_year)
+    _CACHE[key] = (date, date.isoformat() if date is not None else None)
+    return date
+
+# get_iso_date returns value (as for get_date) as an ISO date string
+#  ("2014-02-03"), or None if it isn't a date
+def get_iso_date(value, juche_year=None):
+    if isinstance(value, basestring):
+        cached = _CACHE.get((value, juche_year))
+        if cached is not None:
+            return cached[1]
+
+    date = get_date(value, juche_year)
+    return date.isoformat() if date is not None else None
+
+# get_datetime returns value (as for get_date) as a native datetime at
+#  midnight, as stored in MongoDB, or None if it isn't a date
+def get_datetime(value, juche_year=None):
+    date = get_date(value, juche_year)
+    if date is None:
+        return None
+    return datetime.datetime(date.year, date.month, date.day)
@@ -0,0 +1,45 @@
+#!/usr/bin/env python
+
+"""Shared, connection pooled MongoDB access for NKIR collectors and reporters."""
+
+import logging
+import os
+
+from pymongo import MongoClient
+
+from nkir import config
+
+# client singleton, see get_client
+_CLIENT = None
+_CLIENT_PID = None
+
+# get_client returns one pooled MongoClient per process, configured by the
+#  [mongodb] section of etc/nkir.ini. A forked worker process gets its own
+#  client on first use, as pymongo's sockets can't be shared across a fork.
+def get_client():
+    global _CLIENT, _CLIENT_PID
+
+    if _CLIENT is None or _CLIENT_PID != os.getpid():
+        logger = logging.getLogger('')
+
+        host = config.get('mongodb', 'host')
+        port = config.getint('mongodb', 'port')
+        options = {'max_pool_size': config.getint('mongodb', 'max_pool_size')}
+        for option, setting in [('connectTimeoutMS',   'connect_timeout_ms'),
+                                ('socketTimeoutMS',    'socket_timeout_ms'),
+                                ('waitQueueTimeoutMS', 'wait_queue_timeout_ms')]:
+            value = config.getint('mongodb', setting)
+            if value is not None:
+                options[option] = value
+
+        logger.debug("Connecting to MongoDB at {}:{} with {}.".format(host, port, options))
+        _CLIENT = MongoClient(host, port, **options)
+        _CLIENT_PID = os.getpid()
+
+    return _CLIENT
+
+def get_db():
+    return get_client()[config.get('mongodb', 'db_name')]
+
+def get_collection(collection_name):
+    return get_db()[collection_name]
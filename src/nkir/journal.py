@@ -0,0 +1,201 @@
+#!/usr/bin/env python
+
+"""Crash-safe SQLite journal of each queued file's progress through the NKIR pipeline stages."""
+
+# Every file queued for a pipeline stage (eg. an HTML article queued for
+#  jsonifier_kcna, stage 'jsonify') is a journal item, moving through states:
+#
+#   ready -> claimed -> done
+#                    -> failed (-> ready again, with retry_failed)
+#
+# Workers claim ready items in one transaction, so any number of them (in
+#  one process or many) can share a stage without scanning directories or
+#  claiming the same item twice. finish marks items done and queues the
+#  items they produced for the next stage in the same transaction, so a
+#  crash leaves every item either wholly done and handed on or still claimed;
+#  recover returns claims held by workers which are no longer running to
+#  ready, so a restarted stage resumes exactly where it stopped.
+#
+# Moving files in to archive directories is still done, but only to tidy up
+#  after the journal records an item done, never to track progress.
+#
+# The journal is in WAL mode, so readers never block the single writer.
+
+import datetime
+import logging
+import os
+import socket
+import sqlite3
+import threading
+
+STATES = ('ready', 'claimed', 'done', 'failed')
+
+SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS items "
+    "(stage TEXT, name TEXT, state TEXT, worker TEXT, attempts INTEGER, "
+    "error TEXT, updated TEXT, PRIMARY KEY (stage, name))",
+    "CREATE INDEX IF NOT EXISTS items_stage_state ON items (stage, state, name)",
+    "CREATE TABLE IF NOT EXISTS seeded (stage TEXT PRIMARY KEY, updated TEXT)",
+]
+
+def _get_now():
+    return datetime.datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
+
+# get_worker returns this process's worker id, as recorded against its claims
+def get_worker():
+    return "{}:{}".format(socket.gethostname(), os.getpid())
+
+# _is_running returns whether worker (from get_worker) may still be running,
+#  which we can only rule out for processes on this host
+def _is_running(worker):
+    hostname, pid = worker.rsplit(':', 1)
+    if hostname != socket.gethostname():
+        return True
+    try:
+        os.kill(int(pid), 0)
+    except OSError:
+        return False
+    return True
+
+# Journal is a pipeline's journal at path. Connections are opened lazily per
+#  process and thread, so one Journal can be shared with forked worker
+#  processes and with threads.
+class Journal(object):
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+
+    def _get_conn(self):
+        if getattr(self._local, 'pid', None) != os.getpid():
+            directory = os.path.dirname(self.path)
+            if( directory and not os.path.exists(directory) ):
+                os.makedirs(directory)
+            conn = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            for statement in SCHEMA:
+                conn.execute(statement)
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return self._local.conn
+
+    # _write runs func(conn) in a single write transaction, returning its result
+    def _write(self, func):
+        conn = self._get_conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            result = func(conn)
+        except:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+        return result
+
+    def _add(self, conn, stage, names, replace=True):
+        verb = "INSERT OR REPLACE" if replace else "INSERT OR IGNORE"
+        now = _get_now()
+        conn.executemany(verb + " INTO items (stage, name, state, worker, attempts, error, updated) "
+                         "VALUES (?, ?, 'ready', NULL, 0, NULL, ?)",
+                         ((stage, name, now) for name in names))
+
+    # add queues names as ready for stage, requeueing any already journaled
+    #  (eg. an article changed again in the mirror since we processed it)
+    def add(self, stage, names):
+        self._write(lambda conn: self._add(conn, stage, names))
+
+    # is_seeded returns whether stage has been seeded
+    def is_seeded(self, stage):
+        return self._get_conn().execute("SELECT 1 FROM seeded WHERE stage = ?", (stage,)).fetchone() is not None
+
+    # seed queues names (eg. files found in a stage's inbox when it was first
+    #  journaled) as ready for stage, leaving any already journaled as they
+    #  are, and records stage as seeded
+    def seed(self, stage, names):
+        def _seed(conn):
+            self._add(conn, stage, names, replace=False)
+            conn.execute("INSERT OR REPLACE INTO seeded (stage, updated) VALUES (?, ?)", (stage, _get_now()))
+        self._write(_seed)
+
+    # claim claims (up to limit) ready items of stage for this worker, in name
+    #  order, returning their names
+    def claim(self, stage, limit=100):
+        worker = get_worker()
+        def _claim(conn):
+            names = [row[0] for row in conn.execute(
+                     "SELECT name FROM items WHERE stage = ? AND state = 'ready' ORDER BY name LIMIT ?",
+                     (stage, limit))]
+            now = _get_now()
+            conn.executemany("UPDATE items SET state = 'claimed', worker = ?, attempts = attempts + 1, updated = ? "
+                             "WHERE stage = ? AND name = ?",
+                             ((worker, now, stage, name) for name in names))
+            return names
+        return self._write(_claim)
+
+    # iter_claims yields the names of ready items of stage, claiming them
+    #  limit at a time as they're needed, until none are ready
+    def iter_claims(self, stage, limit=100):
+        while True:
+            names = self.claim(stage, limit)
+            if not names:
+                return
+            for name in names:
+                yield name
+
+    # finish marks names of stage done and, in the same transaction, queues
+    #  next_names as ready for next_stage
+    def finish(self, stage, names, next_stage=None, next_names=()):
+        def _finish(conn):
+            now = _get_now()
+            conn.executemany("UPDATE items SET state = 'done', error = NULL, updated = ? WHERE stage = ? AND name = ?",
+                             ((now, stage, name) for name in names))
+            if next_stage is not None:
+                self._add(conn, next_stage, next_names)
+        self._write(_finish)
+
+    # fail marks name of stage failed, with error, so it isn't claimed again
+    #  until retry_failed
+    def fail(self, stage, name, error):
+        self._write(lambda conn: conn.execute(
+                    "UPDATE items SET state = 'failed', error = ?, updated = ? WHERE stage = ? AND name = ?",
+                    (error, _get_now(), stage, name)))
+
+    # retry_failed returns every failed item of stage to ready, returning how many
+    def retry_failed(self, stage):
+        return self._write(lambda conn: conn.execute(
+                           "UPDATE items SET state = 'ready', updated = ? WHERE stage = ? AND state = 'failed'",
+                           (_get_now(), stage)).rowcount)
+
+    # recover returns claimed items of stage whose worker is no longer running
+    #  (eg. after a crash) to ready, returning how many
+    def recover(self, stage):
+        logger = logging.getLogger('')
+        def _recover(conn):
+            workers = [row[0] for row in conn.execute(
+                       "SELECT DISTINCT worker FROM items WHERE stage = ? AND state = 'claimed'", (stage,))]
+            recovered = 0
+            for worker in workers:
+                if worker is None or not _is_running(worker):
+                    recovered += conn.execute("UPDATE items SET state = 'ready', updated = ? "
+                                              "WHERE stage = ? AND state = 'claimed' AND worker IS ?",
+                                              (_get_now(), stage, worker)).rowcount
+            return recovered
+        recovered = self._write(_recover)
+        if recovered:
+            logger.info("Recovered {} {} journal items claimed by workers no longer running.".format(recovered, stage))
+        return recovered
+
+    # release returns this worker's claimed items of stage to ready (eg. after
+    #  an error part way through a batch), returning how many
+    def release(self, stage):
+        return self._write(lambda conn: conn.execute(
+                           "UPDATE items SET state = 'ready', updated = ? WHERE stage = ? AND state = 'claimed' AND worker = ?",
+                           (_get_now(), stage, get_worker())).rowcount)
+
+    # get_counts returns the number of items of stage in each state
+    def get_counts(self, stage):
+        counts = dict((state, 0) for state in STATES)
+        for state, count in self._get_conn().execute(
+                "SELECT state, COUNT(*) FROM items WHERE stage = ? GROUP BY state", (stage,)):
+            counts[state] = count
+        return counts
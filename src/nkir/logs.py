@@ -0,0 +1,308 @@
+#!/usr/bin/env python
+
+"""Shared logging setup for NKIR scripts: queued, non-blocking logfiles, per-module levels, and rotated, compressed var/logs."""
+
+# Usage, in a script:
+#
+#   logger = logs.get_logger(LOG_FILE_PATH)
+#   logger.debug("output line: %s", line)
+#
+# which logs to LOG_FILE_PATH and the console, as every script always has,
+#  but:
+#
+#  - log calls only put their record on a queue; a listener thread formats
+#    and writes them in batches, so a script's hot loop never waits on disk
+#    (in forked worker processes, which the listener thread doesn't survive
+#    in to, records are written directly, as before)
+#  - messages are formatted on that thread too, if passed %-style arguments
+#    rather than already .format()ed, and not at all if nothing is logged at
+#    their level, so per-article messages should pass their arguments (any
+#    which are later changed, eg. a dict, are logged as they are by then)
+#  - levels for the logfile, the console, and for particular modules are
+#    read from the [logging] and [logging_levels] sections of etc/nkir.ini
+#  - logs of earlier runs are gzipped, and deleted once old enough, and a
+#    long running script's log (eg. service_kcna's) is started afresh, with
+#    the full one gzipped, when it grows too large
+
+import atexit
+import collections
+import gzip
+import logging
+import os
+import re
+import shutil
+import threading
+import time
+
+from nkir import config
+
+FILE_FORMAT = '%(asctime)s: %(levelname)-8s: %(message)s'
+FILE_DATE_FORMAT = '%m/%d/%Y %I:%M:%S %p'
+CONSOLE_FORMAT = '%(levelname)-8s %(message)s'
+
+DAY_SECONDS = 24 * 60 * 60
+
+# the run logs we rotate, eg. jsonifier_kcna_20150101_000000.log, its rotated
+#  parts (.log.1) and metrics summaries, and their gzipped copies; others in
+#  var/logs, eg. mongod's, are left to whatever writes them
+REGEX_RUN_LOG = re.compile(r"^.+_\d{8}_\d{6}\.(?:log(?:\.\d+)?|metrics\.json)(?:\.gz)?$")
+
+# the listener of the logger set up by get_logger, see get_logger
+_LISTENER = None
+
+# _get_level returns the logging level named name (eg. "DEBUG")
+def _get_level(name):
+    level = logging.getLevelName(name.strip().upper())
+    if not isinstance(level, int):
+        raise ValueError("unknown logging level {}".format(name))
+    return level
+
+# _get_module_levels returns the levels set for modules in [logging_levels],
+#  looking like {module: level}, where module is a script's or nkir module's
+#  name (eg. "map_countries_kcna" or "db")
+def _get_module_levels():
+    return dict((module, _get_level(level)) for module, level in config.get_config().items('logging_levels'))
+
+# QueueHandler puts records logged on its listener's queue, for it to write
+#  (as Python 3's logging.handlers.QueueHandler does), leaving the record to
+#  be formatted when it's written
+class QueueHandler(logging.Handler):
+
+    def __init__(self, listener):
+        logging.Handler.__init__(self)
+        self.listener = listener
+
+    # handle queues record if any of our listener's handlers would write it,
+    #  without taking the lock Handler.handle does, which appending to a
+    #  deque doesn't need
+    def handle(self, record):
+        for handler in self.listener.handlers:
+            if record.levelno >= handler.level and handler.filter(record):
+                self.emit(record)
+                return True
+        return False
+
+    def emit(self, record):
+        if os.getpid() != self.listener.pid:
+            # a forked worker process, which has a copy of the queue but no
+            #  listener thread
+            self.listener.handle_directly(record)
+            return
+        # a deque's append is atomic, so needs no lock of ours
+        self.listener.queue.append(record)
+
+# QueueListener writes records from its queue to its handlers on its own
+#  thread, until stopped (as Python 3's logging.handlers.QueueListener
+#  does), in batches every FLUSH_SECONDS, flushing each handler once a batch
+class QueueListener(object):
+
+    FLUSH_SECONDS = 0.1
+
+    def __init__(self, *handlers):
+        self.queue = collections.deque()
+        self.handlers = handlers
+        self.pid = os.getpid()
+        self._stopping = threading.Event()
+        self._thread = None
+        self._forked = False
+
+    def start(self):
+        self._thread = threading.Thread(target=self._monitor, name='nkir.logs')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _handle(self, record):
+        for handler in self.handlers:
+            if record.levelno >= handler.level:
+                handler.handle(record)
+
+    def _flush(self):
+        for handler in self.handlers:
+            getattr(handler, 'flush_now', handler.flush)()
+
+    def _drain(self):
+        if not self.queue:
+            return
+        while True:
+            try:
+                record = self.queue.popleft()
+            except IndexError:
+                break
+            self._handle(record)
+        self._flush()
+
+    def _monitor(self):
+        while not self._stopping.is_set():
+            self._stopping.wait(self.FLUSH_SECONDS)
+            self._drain()
+
+    # handle_directly writes record straight to our handlers, from a forked
+    #  process, giving them new locks, as one may have been held by our
+    #  thread when the process forked. Records are flushed at once, as pool
+    #  workers exit without flushing open files.
+    def handle_directly(self, record):
+        if not self._forked:
+            self._forked = True
+            for handler in self.handlers:
+                handler.createLock()
+        self._handle(record)
+        self._flush()
+
+    # stop writes any records still queued, then stops our thread
+    def stop(self):
+        if self._thread is not None and os.getpid() == self.pid:
+            self._stopping.set()
+            self._thread.join()
+            self._thread = None
+            self._drain()
+
+# _ModuleLevelFilter passes records at or above the level set for the module
+#  they're from, or at or above default if none is
+class _ModuleLevelFilter(logging.Filter):
+
+    def __init__(self, default, module_levels):
+        logging.Filter.__init__(self)
+        self.default = default
+        self.module_levels = module_levels
+
+    def filter(self, record):
+        return record.levelno >= self.module_levels.get(record.module, self.default)
+
+# _compress gzips the file at path to path.gz, keeping its mtime, and
+#  removes it
+def _compress(path):
+    stat = os.stat(path)
+    with open(path, 'rb') as f_in:
+        with gzip.open(path + '.gz.partial', 'wb') as f_out:
+            shutil.copyfileobj(f_in, f_out)
+    os.utime(path + '.gz.partial', (stat.st_atime, stat.st_mtime))
+    os.rename(path + '.gz.partial', path + '.gz')
+    os.remove(path)
+
+# RotatingFileHandler writes a logfile which, once it's max_bytes long, is
+#  moved aside and gzipped (to eg. service_kcna_20150101_000000.log.1.gz),
+#  and started afresh
+class RotatingFileHandler(logging.FileHandler):
+
+    def __init__(self, path, max_bytes=None):
+        logging.FileHandler.__init__(self, path)
+        self.max_bytes = max_bytes
+
+    # flush does nothing, as it's called after every record written; our
+    #  listener calls flush_now once a batch of them instead
+    def flush(self):
+        pass
+
+    def flush_now(self):
+        logging.FileHandler.flush(self)
+
+    def emit(self, record):
+        logging.FileHandler.emit(self, record)
+        if self.max_bytes and self.stream is not None and self.stream.tell() >= self.max_bytes:
+            self.rotate()
+
+    def rotate(self):
+        self.stream.close()
+        self.stream = None
+
+        number = 1
+        while os.path.exists('{}.{}'.format(self.baseFilename, number)) or os.path.exists('{}.{}.gz'.format(self.baseFilename, number)):
+            number += 1
+        rotated_path = '{}.{}'.format(self.baseFilename, number)
+        try:
+            os.rename(self.baseFilename, rotated_path)
+            _compress(rotated_path)
+        except (IOError, OSError):
+            pass
+
+        self.stream = self._open()
+
+# rotate_logs gzips run logs in logs_root (other than current_path) last
+#  written to over compress_after_days ago, and deletes gzipped logs and
+#  metrics summaries older than keep_days, returning how many of each it did;
+#  either being None means never
+def rotate_logs(logs_root, current_path=None, compress_after_days=1, keep_days=None):
+    now = time.time()
+    compressed = deleted = 0
+    for filename in os.listdir(logs_root):
+        path = os.path.join(logs_root, filename)
+        if not REGEX_RUN_LOG.match(filename) or os.path.abspath(path) == current_path:
+            continue
+        try:
+            age_days = (now - os.path.getmtime(path)) / DAY_SECONDS
+            if filename.endswith('.gz') or filename.endswith('.metrics.json'):
+                if keep_days is not None and age_days > keep_days:
+                    os.remove(path)
+                    deleted += 1
+            elif compress_after_days is not None and age_days > compress_after_days:
+                _compress(path)
+                compressed += 1
+        except (IOError, OSError):
+            # eg. compressed or deleted by another script's rotate_logs
+            continue
+    return compressed, deleted
+
+# get_logger sets up, and returns, the root logger, logging to the logfile at
+#  log_file_path (in var/logs) and to the console, configured by the
+#  [logging] and [logging_levels] sections of etc/nkir.ini. Our listener is
+#  stopped, having written every record logged, when the script exits.
+def get_logger(log_file_path, console=True):
+    global _LISTENER
+
+    logs_root = os.path.dirname(log_file_path)
+    if( not os.path.exists(logs_root) ):
+        os.makedirs(logs_root)
+
+    level = _get_level(config.get('logging', 'level'))
+    console_level = _get_level(config.get('logging', 'console_level'))
+    module_levels = _get_module_levels()
+
+    # the logfile, at level, or a module's own level
+    _file_handler = RotatingFileHandler(log_file_path, config.getint('logging', 'max_bytes'))
+    _file_handler.setFormatter(logging.Formatter(FILE_FORMAT, FILE_DATE_FORMAT))
+    _file_handler.addFilter(_ModuleLevelFilter(level, module_levels))
+    _handlers = [_file_handler]
+
+    if console:
+        _console_handler = logging.StreamHandler()
+        _console_handler.setLevel(console_level)
+        _console_handler.setFormatter(logging.Formatter(CONSOLE_FORMAT))
+        _handlers.append(_console_handler)
+
+    # set up afresh, eg. by a benchmark running several scripts
+    if _LISTENER is not None:
+        _LISTENER.stop()
+        for handler in _LISTENER.handlers:
+            handler.close()
+    _LISTENER = QueueListener(*_handlers)
+    _queue_handler = QueueHandler(_LISTENER)
+
+    _root_logger = logging.getLogger('')
+    for handler in list(_root_logger.handlers):
+        _root_logger.removeHandler(handler)
+    _root_logger.addHandler(_queue_handler)
+    # the least level anything is logged at, so that messages below it are
+    #  dropped before a record is even made
+    _root_logger.setLevel(min([level, console_level if console else logging.CRITICAL] + module_levels.values()))
+
+    # our formats use none of the thread and process fields of records, so
+    #  they needn't be looked up for every record made
+    logging.logThreads = logging.logProcesses = logging.logMultiprocessing = 0
+
+    _LISTENER.start()
+
+    compressed, deleted = rotate_logs(logs_root, os.path.abspath(log_file_path),
+                                      config.getint('logging', 'compress_after_days'), config.getint('logging', 'keep_days'))
+    if compressed or deleted:
+        _root_logger.debug("Compressed %d and deleted %d old files in %s.", compressed, deleted, logs_root)
+
+    return _root_logger
+
+# stop writes any records still queued, and stops our listener
+def stop():
+    if _LISTENER is not None:
+        _LISTENER.stop()
+
+# registered after logging's own shutdown, so run before it, while our
+#  handlers are still open
+atexit.register(stop)
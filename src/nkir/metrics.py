@@ -0,0 +1,183 @@
+#!/usr/bin/env python
+
+"""Per-run timers and counters for NKIR scripts, summarized next to their logs."""
+
+# Usage, in a script:
+#
+#   with metrics.timer('jsonifier.parse_html'):
+#       soup = BeautifulSoup(...)
+#   metrics.count('jsonifier.spanish_articles')
+#   ...
+#   metrics.write_summary(LOG_FILE_PATH)
+#
+# which writes var/logs/<script>_<TIMESTAMP>.metrics.json beside the log, and
+#  if [metrics] textfile_dir is set in etc/nkir.ini, also a Prometheus
+#  textfile (for node_exporter's textfile collector) of the same numbers.
+#
+# Metrics may be recorded from several threads at once (eg. by service_kcna's
+#  stages). Pool worker processes should be started with
+#  initializer=metrics.reset, so that the metrics they hand back with
+#  snapshot don't include their copy of their parent's.
+
+import contextlib
+import functools
+import json
+import logging
+import os
+import re
+import threading
+import time
+
+from nkir import config
+
+# this process's timers, looking like {name: [calls, total seconds, max seconds]}
+_TIMERS = {}
+# this process's counters, looking like {name: value}
+_COUNTERS = {}
+# held while reading or changing _TIMERS or _COUNTERS
+_LOCK = threading.Lock()
+
+# _add_time records one call of timer name which took seconds; callers hold
+#  _LOCK
+def _add_time(name, seconds, calls=1, max_seconds=None):
+    timer = _TIMERS.setdefault(name, [0, 0.0, 0.0])
+    timer[0] += calls
+    timer[1] += seconds
+    timer[2] = max(timer[2], seconds if max_seconds is None else max_seconds)
+
+# timer is a context manager timing the block it wraps under name
+@contextlib.contextmanager
+def timer(name):
+    time_start = time.time()
+    try:
+        yield
+    finally:
+        seconds = time.time() - time_start
+        with _LOCK:
+            _add_time(name, seconds)
+
+# timed is a decorator timing every call of the function it wraps under name
+def timed(name):
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with timer(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+# timed_iter yields each item of iterable, timing every fetch under name, for
+#  timing work a generator or MongoDB cursor does lazily as it's consumed
+def timed_iter(name, iterable):
+    iterator = iter(iterable)
+    while True:
+        with timer(name):
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+        yield item
+
+# _count adds value to counter name; callers hold _LOCK
+def _count(name, value):
+    _COUNTERS[name] = _COUNTERS.get(name, 0) + value
+
+def count(name, value=1):
+    with _LOCK:
+        _count(name, value)
+
+# reset forgets this process's metrics, with a new lock in case another
+#  thread held ours when this process was forked; for a Pool's initializer
+def reset():
+    global _LOCK
+    _LOCK = threading.Lock()
+    _TIMERS.clear()
+    _COUNTERS.clear()
+
+# snapshot returns (and then resets) this process's metrics, so a worker
+#  process can hand them back to its parent to merge
+def snapshot():
+    with _LOCK:
+        metrics = {'timers': _TIMERS.copy(), 'counters': _COUNTERS.copy()}
+        # the timers' lists go with the snapshot, rather than being copied
+        _TIMERS.clear()
+        _COUNTERS.clear()
+    return metrics
+
+# merge adds metrics returned by snapshot (eg. in a worker process) to ours
+def merge(metrics):
+    with _LOCK:
+        for name, (calls, seconds, max_seconds) in metrics['timers'].items():
+            _add_time(name, seconds, calls, max_seconds)
+        for name, value in metrics['counters'].items():
+            _count(name, value)
+
+# get_summary returns this process's metrics in the form we write out
+def get_summary():
+    with _LOCK:
+        timer_values = [(name, list(timer)) for name, timer in _TIMERS.items()]
+        counters = dict(_COUNTERS)
+    timers = {}
+    for name, (calls, seconds, max_seconds) in timer_values:
+        timers[name] = {
+            'calls':        calls,
+            'seconds':      seconds,
+            'mean_seconds': seconds / calls if calls else 0.0,
+            'max_seconds':  max_seconds,
+        }
+    return {'timers': timers, 'counters': counters}
+
+def _get_prometheus_name(name):
+    return 'nkir_' + re.sub(r'[^a-zA-Z0-9_]', '_', name)
+
+# _write_prometheus_textfile writes summary for node_exporter's textfile
+#  collector, with every metric labelled by the script it came from
+def _write_prometheus_textfile(textfile_dir, script_name, summary):
+    lines = []
+    label = '{{script="{}"}}'.format(script_name)
+    for name, timer_summary in sorted(summary['timers'].items()):
+        metric = _get_prometheus_name(name)
+        lines.append("# TYPE {}_seconds summary".format(metric))
+        lines.append("{}_seconds_count{} {}".format(metric, label, timer_summary['calls']))
+        lines.append("{}_seconds_sum{} {!r}".format(metric, label, timer_summary['seconds']))
+    for name, value in sorted(summary['counters'].items()):
+        metric = _get_prometheus_name(name)
+        lines.append("# TYPE {}_total counter".format(metric))
+        lines.append("{}_total{} {}".format(metric, label, value))
+    lines.append("# TYPE nkir_last_run_timestamp_seconds gauge")
+    lines.append("nkir_last_run_timestamp_seconds{} {}".format(label, int(time.time())))
+
+    if( not os.path.exists(textfile_dir) ):
+        os.makedirs(textfile_dir)
+    textfile_path = os.path.join(textfile_dir, script_name + '.prom')
+    with open(textfile_path + '.partial', 'w') as f:
+        f.write("\n".join(lines) + "\n")
+    os.rename(textfile_path + '.partial', textfile_path)
+    return textfile_path
+
+# write_summary writes this run's metrics as JSON beside log_file_path
+#  (eg. var/logs/jsonifier_kcna_<TIMESTAMP>.metrics.json), logging the slowest
+#  timers, and returns the JSON summary's path
+def write_summary(log_file_path):
+    logger = logging.getLogger('')
+    summary = get_summary()
+
+    summary_path = os.path.splitext(log_file_path)[0] + '.metrics.json'
+    with open(summary_path + '.partial', 'w') as f:
+        json.dump(summary, f, indent=4, sort_keys=True)
+    os.rename(summary_path + '.partial', summary_path)
+
+    slowest = sorted(summary['timers'].items(), key=lambda x: x[1]['seconds'], reverse=True)
+    for name, timer_summary in slowest[:5]:
+        logger.info("{} took {:.2f}s over {} calls ({:.2f}ms mean).".format(
+                    name, timer_summary['seconds'], timer_summary['calls'], timer_summary['mean_seconds'] * 1000))
+    logger.info("Wrote run metrics to {}.".format(summary_path))
+
+    textfile_dir = config.get('metrics', 'textfile_dir').strip()
+    if textfile_dir:
+        # script name is the log filename without its timestamp
+        script_name = re.sub(r'_\d{8}_\d{6}$', '', os.path.splitext(os.path.basename(log_file_path))[0])
+        textfile_path = _write_prometheus_textfile(textfile_dir, script_name, summary)
+        logger.info("Wrote run metrics to Prometheus textfile {}.".format(textfile_path))
+
+    return summary_path
@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+
+"""Fingerprinted, precompressed publishing of static files to NKIR's public_html."""
+
+# Published files are made cheap to serve and to cache, see static_server:
+#
+#  - each page asset is copied to a fingerprinted name holding a hash of its
+#    contents (eg. nk_mention_map.js -> nk_mention_map.3f2a9c1b0d.js), so it
+#    can be cached by browsers for good, as any change to it is a new name
+#  - a manifest maps each asset's plain name to its fingerprinted name, and is
+#    rewritten in to the page that uses them, which itself is never cached
+#  - every compressible file gets gzip (and, if `brotli` is installed, brotli)
+#    compressed variants beside it (eg. map_countries_kcna.csv.gz), compressed
+#    once at their highest levels when published, rather than per request
+#
+# Fingerprinted files from the previous publish are kept, so that a page
+#  loaded just before a publish can still fetch its assets; older ones are
+#  removed.
+
+import cStringIO
+import gzip
+import hashlib
+import json
+import os
+import re
+import shutil
+
+# brotli is optional; without it, only gzip variants are written
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+FINGERPRINT_LENGTH = 10
+REGEX_FINGERPRINTED = re.compile(r"\.[0-9a-f]{" + str(FINGERPRINT_LENGTH) + r"}\.[^./]+$")
+
+# compressed variant file extensions by content encoding
+ENCODINGS = {'br': '.br', 'gzip': '.gz'}
+
+COMPRESSIBLE_EXTENSIONS = ('.css', '.csv', '.html', '.js', '.json', '.svg', '.txt')
+# files smaller than this gain nothing worth a variant from compression
+MIN_COMPRESS_SIZE = 256
+
+# brotli's best quality is slow (about 1MB/s), so larger files (eg. full
+#  report csvs) are compressed at a quality many times faster, and barely
+#  larger
+BROTLI_QUALITY = 11
+BROTLI_LARGE_QUALITY = 9
+BROTLI_LARGE_SIZE = 1024 * 1024
+
+MANIFEST_NAME = 'manifest.json'
+
+# get_encodings returns the content encodings we write variants in, in order
+#  of preference
+def get_encodings():
+    return ['br', 'gzip'] if brotli is not None else ['gzip']
+
+# is_fingerprinted returns whether path is a fingerprinted name
+def is_fingerprinted(path):
+    return REGEX_FINGERPRINTED.search(path) is not None
+
+# get_fingerprint returns a fingerprint of the contents of the file at path
+def get_fingerprint(path):
+    _hash = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), ''):
+            _hash.update(chunk)
+    return _hash.hexdigest()[:FINGERPRINT_LENGTH]
+
+# is_up_to_date returns whether variant_path is a compressed variant of the
+#  file at path as it is now; variants carry their file's mtime, which
+#  os.utime only sets to the microsecond
+def is_up_to_date(path, variant_path):
+    try:
+        return abs(os.stat(variant_path).st_mtime - os.stat(path).st_mtime) < 0.00001
+    except OSError:
+        return False
+
+# get_fingerprinted_name returns name (eg. "js/d3.min.js") with fingerprint
+#  inserted before its extension (eg. "js/d3.min.3f2a9c1b0d.js")
+def get_fingerprinted_name(name, fingerprint):
+    root, extension = os.path.splitext(name)
+    return root + '.' + fingerprint + extension
+
+# fingerprint copies file name (relative to publish_root), along with its
+#  compressed variants (see precompress), to its fingerprinted name, unless
+#  already published, and returns the fingerprinted name
+def fingerprint(publish_root, name):
+    path = os.path.join(publish_root, name)
+    fingerprinted_name = get_fingerprinted_name(name, get_fingerprint(path))
+    fingerprinted_path = os.path.join(publish_root, fingerprinted_name)
+    if not os.path.exists(fingerprinted_path):
+        precompress(path)
+        # variants first, so that the file is only published complete
+        for extension in ENCODINGS.values():
+            if os.path.exists(path + extension):
+                shutil.copy2(path + extension, fingerprinted_path + extension + '.partial')
+                os.rename(fingerprinted_path + extension + '.partial', fingerprinted_path + extension)
+        shutil.copy2(path, fingerprinted_path + '.partial')
+        os.rename(fingerprinted_path + '.partial', fingerprinted_path)
+    return fingerprinted_name
+
+def _compress(data, encoding, mtime):
+    if encoding == 'br':
+        return brotli.compress(data, quality=BROTLI_QUALITY if len(data) < BROTLI_LARGE_SIZE else BROTLI_LARGE_QUALITY)
+
+    # the file's own mtime (and no file name) in the gzip header, so that
+    #  unchanged files compress to identical bytes
+    _buffer = cStringIO.StringIO()
+    _gzip = gzip.GzipFile(filename='', mode='wb', compresslevel=9, fileobj=_buffer, mtime=mtime)
+    _gzip.write(data)
+    _gzip.close()
+    return _buffer.getvalue()
+
+# precompress writes compressed variants of the file at path beside it (eg.
+#  path.gz), unless they're already up to date, returning the encodings of
+#  variants written. Variants which aren't smaller than path are removed.
+def precompress(path):
+    if not path.endswith(COMPRESSIBLE_EXTENSIONS):
+        return []
+    stat = os.stat(path)
+
+    written = []
+    data = None
+    for encoding in get_encodings():
+        variant_path = path + ENCODINGS[encoding]
+        if is_up_to_date(path, variant_path):
+            continue
+
+        if data is None:
+            with open(path, 'rb') as f:
+                data = f.read()
+        compressed = _compress(data, encoding, int(stat.st_mtime)) if len(data) >= MIN_COMPRESS_SIZE else None
+        if compressed is None or len(compressed) >= len(data):
+            if os.path.exists(variant_path):
+                os.remove(variant_path)
+            continue
+
+        with open(variant_path + '.partial', 'wb') as f:
+            f.write(compressed)
+        os.utime(variant_path + '.partial', (stat.st_atime, stat.st_mtime))
+        os.rename(variant_path + '.partial', variant_path)
+        written.append(encoding)
+
+    return written
+
+# precompress_tree precompresses every file under root, returning how many
+#  variants were written
+def precompress_tree(root):
+    total = 0
+    for directory, _, filenames in os.walk(root):
+        for filename in filenames:
+            total += len(precompress(os.path.join(directory, filename)))
+    return total
+
+# read_manifest returns the manifest last published to publish_root, looking
+#  like {"js/d3.min.js": "js/d3.min.3f2a9c1b0d.js", ...}, or {} if none was
+def read_manifest(publish_root):
+    path = os.path.join(publish_root, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r') as f:
+        return json.load(f)
+
+def write_manifest(publish_root, manifest):
+    path = os.path.join(publish_root, MANIFEST_NAME)
+    with open(path + '.partial', 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.rename(path + '.partial', path)
+
+# remove_stale removes fingerprinted files (and their variants) under
+#  publish_root which aren't named in keep, returning how many were removed
+def remove_stale(publish_root, keep):
+    keep = set(os.path.join(publish_root, name) for name in keep)
+    removed = 0
+    for directory, _, filenames in os.walk(publish_root):
+        for filename in filenames:
+            path = os.path.join(directory, filename)
+            for extension in ENCODINGS.values():
+                if path.endswith(extension):
+                    path = path[:-len(extension)]
+                    break
+            if is_fingerprinted(path) and path not in keep:
+                os.remove(os.path.join(directory, filename))
+                removed += 1
+    return removed
+
+# rewrite_html returns html with every src or href attribute naming a file in
+#  manifest pointed at its fingerprinted name instead, and with manifest
+#  itself defined as the javascript global variable, for scripts to look up
+#  the data files they fetch in
+def rewrite_html(html, manifest, variable='ASSET_MANIFEST'):
+    def _rewrite(match):
+        return match.group(1) + manifest.get(match.group(2), match.group(2)) + match.group(3)
+    html = re.sub(r'''((?:src|href)=["'])([^"']+)(["'])''', _rewrite, html)
+
+    script = '  <script type="text/javascript">var {} = {};</script>\n  '.format(
+             variable, json.dumps(manifest, sort_keys=True, separators=(',', ':')))
+    return html.replace('</head>', script + '</head>', 1)
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+
+"""Read polygon shapefiles (eg. Natural Earth's) and their attributes directly, without GDAL."""
+
+# A shapefile is a .shp of geometries and a .dbf (dBase III table) of their
+#  attributes, one record each, in the same order; see ESRI's "Shapefile
+#  Technical Description". We only read what Natural Earth's admin polygons
+#  need: polygon (and null) shapes, and character and numeric attributes.
+#
+# Shapes are read as lists of rings, each a list of (x, y) tuples with its
+#  first point repeated last; outer rings run clockwise and holes
+#  anticlockwise, as in the shapefile.
+
+import os
+import struct
+import zipfile
+
+SHAPE_NULL = 0
+SHAPE_POLYGON = 5
+
+# _read_shapes returns each record's shape in shp (the .shp file's bytes), as
+#  a list of rings
+def _read_shapes(shp):
+    file_code, = struct.unpack(">i", shp[:4])
+    if file_code != 9994:
+        raise ValueError("not a shapefile")
+
+    shapes = []
+    offset = 100
+    while offset < len(shp):
+        _, content_length = struct.unpack(">ii", shp[offset:offset + 8])
+        content = shp[offset + 8:offset + 8 + content_length * 2]
+        offset += 8 + content_length * 2
+
+        shape_type, = struct.unpack("<i", content[:4])
+        if shape_type == SHAPE_NULL:
+            shapes.append([])
+            continue
+        if shape_type != SHAPE_POLYGON:
+            raise ValueError("unsupported shape type {}".format(shape_type))
+
+        # shape type, bounding box, then part and point counts
+        part_count, point_count = struct.unpack("<ii", content[36:44])
+        parts = list(struct.unpack("<{}i".format(part_count), content[44:44 + 4 * part_count]))
+        coordinates = struct.unpack("<{}d".format(2 * point_count), content[44 + 4 * part_count:44 + 4 * part_count + 16 * point_count])
+        points = zip(coordinates[0::2], coordinates[1::2])
+
+        shapes.append([points[start:end] for start, end in zip(parts, parts[1:] + [point_count])])
+
+    return shapes
+
+# _read_records returns each record's attributes in dbf (the .dbf file's
+#  bytes) as a dict, with fields whose names aren't in fields (if given)
+#  left out, and text decoded from encoding
+def _read_records(dbf, fields=None, encoding='latin-1'):
+    record_count, header_length, record_length = struct.unpack("<IHH", dbf[4:12])
+
+    columns = []
+    offset = 1  # each record starts with its deletion flag
+    for position in range(32, header_length - 1, 32):
+        descriptor = dbf[position:position + 32]
+        name = descriptor[:11].split('\x00')[0]
+        field_type, length, decimals = descriptor[11], ord(descriptor[16]), ord(descriptor[17])
+        if fields is None or name in fields:
+            columns.append((name, field_type, offset, length, decimals))
+        offset += length
+
+    records = []
+    for position in range(header_length, header_length + record_count * record_length, record_length):
+        record = {}
+        for name, field_type, offset, length, decimals in columns:
+            value = dbf[position + offset:position + offset + length].strip(' \x00')
+            if field_type == 'N' or field_type == 'F':
+                if not value or value.startswith('*'):
+                    value = None
+                else:
+                    value = float(value) if decimals or '.' in value else int(value)
+            else:
+                value = value.decode(encoding)
+            record[name] = value
+        records.append(record)
+
+    return records
+
+# read_zip returns [(shape, attributes), ...] of the shapefile in the zip file
+#  at path, named name (eg. "ne_110m_admin_0_countries"), or the only one in it
+#  if name is None; see _read_records for fields and encoding
+def read_zip(path, name=None, fields=None, encoding='latin-1'):
+    with zipfile.ZipFile(path) as archive:
+        if name is None:
+            shp_names = [member for member in archive.namelist() if member.lower().endswith('.shp')]
+            if len(shp_names) != 1:
+                raise ValueError("{} doesn't hold exactly one shapefile".format(path))
+            name = os.path.splitext(shp_names[0])[0]
+        shp = archive.read(name + '.shp')
+        dbf = archive.read(name + '.dbf')
+
+    shapes = _read_shapes(shp)
+    records = _read_records(dbf, fields, encoding)
+    if len(shapes) != len(records):
+        raise ValueError("{} has {} shapes but {} records".format(path, len(shapes), len(records)))
+    return zip(shapes, records)
@@ -0,0 +1,230 @@
+#!/usr/bin/env python
+
+"""Threaded, caching static file server for NKIR's public_html, serving nkir.publish's precompressed variants."""
+
+# A drop in for `python -m SimpleHTTPServer`, eg. from srv/public_html:
+#
+#   PYTHONPATH=<project>/src python -m nkir.static_server 8871
+#
+# On top of SimpleHTTPServer, it:
+#
+#  - handles each request in its own thread, with keep-alive connections
+#  - serves a file's brotli or gzip variant (see nkir.publish) in its place
+#    to clients accepting that encoding, if the variant is up to date
+#  - sends ETag and Last-Modified headers, and answers conditional requests
+#    (If-None-Match, If-Modified-Since) with 304 Not Modified
+#  - lets fingerprinted files be cached for a year, as their contents never
+#    change, and has clients revalidate everything else on every use
+#  - answers single byte range requests (Range, If-Range) with 206 Partial
+#    Content, from the uncompressed file
+
+import argparse
+import BaseHTTPServer
+import email.utils
+import os
+import re
+import SimpleHTTPServer
+import SocketServer
+import urlparse
+
+from nkir import publish
+
+CACHE_FOREVER = 'public, max-age=31536000, immutable'
+CACHE_REVALIDATE = 'no-cache'
+
+REGEX_RANGE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+# StaticRequestHandler serves files under its server's root
+class StaticRequestHandler(SimpleHTTPServer.SimpleHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    extensions_map = dict(SimpleHTTPServer.SimpleHTTPRequestHandler.extensions_map)
+    extensions_map.update({'.csv': 'text/csv', '.json': 'application/json', '.js': 'application/javascript'})
+
+    # translate_path maps a url path to a file path under our server's root
+    #  (rather than under the current directory)
+    def translate_path(self, path):
+        path = SimpleHTTPServer.SimpleHTTPRequestHandler.translate_path(self, path)
+        return os.path.join(self.server.root, os.path.relpath(path, os.getcwd()))
+
+    # _get_variant returns the content encoding and path of the best up to
+    #  date variant of the file at path this client accepts, or (None, path)
+    def _get_variant(self, path):
+        accepted = set()
+        for coding in self.headers.get('Accept-Encoding', '').split(','):
+            parts = [part.strip() for part in coding.split(';')]
+            if parts[0] and 'q=0' not in parts[1:]:
+                accepted.add(parts[0].lower())
+
+        for encoding in ['br', 'gzip']:
+            variant_path = path + publish.ENCODINGS[encoding]
+            if encoding in accepted and publish.is_up_to_date(path, variant_path):
+                return encoding, variant_path
+        return None, path
+
+    # _is_not_modified returns whether the client's cached copy, per its
+    #  conditional request headers, is of the same etag or modified time
+    def _is_not_modified(self, etag, mtime):
+        if_none_match = self.headers.get('If-None-Match')
+        if if_none_match is not None:
+            return if_none_match.strip() == '*' or etag in [tag.strip() for tag in if_none_match.split(',')]
+
+        if_modified_since = self.headers.get('If-Modified-Since')
+        if if_modified_since is not None:
+            since = email.utils.parsedate_tz(if_modified_since)
+            if since is not None:
+                return int(mtime) <= email.utils.mktime_tz(since)
+        return False
+
+    # _get_range returns the (first, last) bytes of the single range this
+    #  client requested of size bytes, None for the whole file, or False if
+    #  its range can't be satisfied
+    def _get_range(self, size, etag, last_modified):
+        header = self.headers.get('Range')
+        if header is None:
+            return None
+
+        # a range of a since changed file is no use, so send it all
+        if_range = self.headers.get('If-Range')
+        if if_range is not None and if_range.strip() not in (etag, last_modified):
+            return None
+
+        match = REGEX_RANGE.match(header.strip())
+        if not match or match.groups() == ('', ''):
+            return None
+        first, last = match.groups()
+        if first == '':
+            first, last = max(0, size - int(last)), size - 1
+        else:
+            first, last = int(first), min(int(last), size - 1) if last else size - 1
+        if first >= size or first > last:
+            return False
+        return first, last
+
+    # send_head sends the headers for (and returns the open file of) the file
+    #  requested, or None if there's no body to send
+    def send_head(self):
+        self._remaining = None
+
+        path = self.translate_path(self.path)
+        if os.path.isdir(path):
+            parts = urlparse.urlsplit(self.path)
+            if not parts.path.endswith('/'):
+                # redirect to the directory, as SimpleHTTPServer does, but
+                #  with a length, so keep-alive clients needn't wait for more
+                self.send_response(301)
+                self.send_header("Location", urlparse.urlunsplit((parts[0], parts[1], parts[2] + '/', parts[3], parts[4])))
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return None
+            index_path = os.path.join(path, 'index.html')
+            if not os.path.isfile(index_path):
+                # directory listings, as SimpleHTTPServer does
+                return SimpleHTTPServer.SimpleHTTPRequestHandler.send_head(self)
+            path = index_path
+        if not os.path.isfile(path):
+            self.send_error(404, "File not found")
+            return None
+
+        # ranges are of the uncompressed file
+        encoding, variant_path = self._get_variant(path) if 'Range' not in self.headers else (None, path)
+
+        stat = os.stat(path)
+        etag = '"{:x}-{:x}{}"'.format(int(stat.st_mtime), stat.st_size, '-' + encoding if encoding else '')
+        last_modified = self.date_time_string(stat.st_mtime)
+        cache_control = CACHE_FOREVER if publish.is_fingerprinted(path) else CACHE_REVALIDATE
+
+        if self._is_not_modified(etag, stat.st_mtime):
+            self.send_response(304)
+            self._send_cache_headers(etag, last_modified, cache_control)
+            self.end_headers()
+            return None
+
+        try:
+            f = open(variant_path, 'rb')
+        except IOError:
+            self.send_error(404, "File not found")
+            return None
+        size = os.fstat(f.fileno()).st_size
+
+        byte_range = self._get_range(size, etag, last_modified)
+        if byte_range is False:
+            f.close()
+            self.send_response(416)
+            self.send_header("Content-Range", "bytes */{}".format(size))
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return None
+
+        if byte_range is None:
+            self.send_response(200)
+            first, last = 0, size - 1
+        else:
+            self.send_response(206)
+            first, last = byte_range
+            self.send_header("Content-Range", "bytes {}-{}/{}".format(first, last, size))
+            f.seek(first)
+        self._remaining = last - first + 1
+
+        self.send_header("Content-Type", self.guess_type(path))
+        if encoding is not None:
+            self.send_header("Content-Encoding", encoding)
+        self.send_header("Content-Length", str(self._remaining))
+        self.send_header("Accept-Ranges", "bytes")
+        self._send_cache_headers(etag, last_modified, cache_control)
+        self.end_headers()
+        return f
+
+    def _send_cache_headers(self, etag, last_modified, cache_control):
+        self.send_header("ETag", etag)
+        self.send_header("Last-Modified", last_modified)
+        self.send_header("Cache-Control", cache_control)
+        self.send_header("Vary", "Accept-Encoding")
+
+    # copyfile copies only the requested range of source to outputfile
+    def copyfile(self, source, outputfile):
+        remaining = self._remaining
+        if remaining is None:
+            # eg. a directory listing
+            return SimpleHTTPServer.SimpleHTTPRequestHandler.copyfile(self, source, outputfile)
+        while remaining > 0:
+            chunk = source.read(min(64 * 1024, remaining))
+            if not chunk:
+                break
+            outputfile.write(chunk)
+            remaining -= len(chunk)
+
+# StaticServer serves files under root, each request in its own thread
+class StaticServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, root):
+        self.root = os.path.abspath(root)
+        BaseHTTPServer.HTTPServer.__init__(self, address, StaticRequestHandler)
+
+# serve serves files under root on port until interrupted
+def serve(root, port, bind=''):
+    server = StaticServer((bind, port), root)
+    print "Serving {} on {} port {} ...".format(server.root, bind or '0.0.0.0', port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('port', type=int, nargs='?', default=8000,
+                        help="port to serve on (default: 8000)")
+    parser.add_argument('--bind', default='',
+                        help="address to serve on (default: all)")
+    parser.add_argument('--root', default=os.getcwd(),
+                        help="directory to serve (default: the current directory)")
+    args = parser.parse_args()
+    serve(args.root, args.port, args.bind)
+
+if(__name__ == '__main__'):
+    main()
@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+
+"""Tokenizes NKIR articles in to compact, reusable token streams for phrase matching."""
+
+# A token stream is one unicode string holding an article's word tokens,
+#  space separated, with a newline between each of its fields (title,
+#  location, news service, and each paragraph), so that no phrase can match
+#  across two fields, eg.:
+#
+#   u"DPRK Premier Meets Chinese Delegation\nPyongyang\nKCNA\nPremier Pak ..."
+#
+# dbimporter_kcna stores each article's stream (as "tokens", along with
+#  "tokens_version") when it imports it, so that reporters match phrases
+#  against it without fetching, lowercasing and rescanning every article's
+#  full text on every run.
+#
+# Tokens keep their case, and are runs of letters, digits and underscores;
+#  all punctuation is dropped, so "U.S." is the tokens "U" and "S", and
+#  "Guinea-Bissau" is "Guinea" and "Bissau".
+
+import re
+
+# stored streams of any other version are stale, and are tokenized again
+VERSION = 1
+
+REGEX_TOKEN = re.compile(r"\w+", re.UNICODE).findall
+
+# tokenize returns the list of tokens in text
+def tokenize(text):
+    return REGEX_TOKEN(text)
+
+# get_article_fields returns the fields of an article that are tokenized, as
+#  a list of strings, from its metadata and list of text paragraphs
+def get_article_fields(metadata, text):
+    fields = [ metadata.get("title"),
+               metadata.get("location"),
+               metadata.get("news_service") ]
+    fields.extend(text or [])
+    return [field for field in fields if field]
+
+# get_stream returns the token stream of fields (a list of strings)
+def get_stream(fields):
+    return u"\n".join(u" ".join(tokenize(field)) for field in fields)
+
+# get_article_stream returns the token stream of an article in our MongoDB
+#  JSON schema
+def get_article_stream(json_data):
+    data = json_data.get('data', {})
+    return get_stream(get_article_fields(data.get('metadata', {}), data.get('text')))
+
+# get_token_lists returns a token stream as a list of each field's tokens
+def get_token_lists(stream):
+    return [field.split(u" ") for field in stream.split(u"\n") if field]
@@ -0,0 +1,275 @@
+#!/usr/bin/env python
+
+"""Build quantized, simplified TopoJSON topologies of polygon features, as the topojson command line tool does."""
+
+# Building a topology of polygons (eg. countries) takes four steps, each
+#  shrinking what a browser downloads and parses:
+#
+#  1. quantize: every point is snapped to an integer grid of quantization
+#     steps across the features' bounding box, and repeated points dropped
+#  2. join and cut: junctions, points where rings meet or part, are found,
+#     and every ring is cut at its junctions in to arcs, so that a border
+#     shared by two countries is stored once, as one arc both use (one of
+#     them backwards)
+#  3. simplify: each arc is simplified once, with Douglas-Peucker, keeping its
+#     end points, so shared borders stay shared and neighbours never gap or
+#     overlap however much they're simplified
+#  4. encode: arcs are delta encoded, as small integers
+#
+# Features are (rings, properties) tuples, with rings as nkir.shapes reads
+#  them: lists of (x, y) points, first point repeated last, outer rings
+#  clockwise and holes anticlockwise. See the TopoJSON specification for the
+#  output: https://github.com/topojson/topojson-specification
+
+# VERSION goes in to the cache keys of built topologies; bump it whenever
+#  a change here (or in nkir.shapes) changes what's built
+VERSION = 1
+
+# _get_area returns twice the signed area of ring, negative if clockwise
+def _get_area(ring):
+    return sum(x0 * y1 - x1 * y0 for (x0, y0), (x1, y1) in zip(ring, ring[1:]))
+
+# _contains returns whether point is inside ring
+def _contains(ring, point):
+    x, y = point
+    inside = False
+    for (x0, y0), (x1, y1) in zip(ring, ring[1:]):
+        if (y0 > y) != (y1 > y) and x < x0 + (y - y0) * (x1 - x0) / float(y1 - y0):
+            inside = not inside
+    return inside
+
+# _get_polygons groups rings in to polygons, each a list of an outer ring
+#  followed by its holes
+def _get_polygons(rings):
+    polygons = []
+    holes = []
+    for ring in rings:
+        if _get_area(ring) < 0:
+            polygons.append([ring])
+        else:
+            holes.append(ring)
+
+    for hole in holes:
+        for polygon in polygons:
+            if _contains(polygon[0], hole[0]):
+                polygon.append(hole)
+                break
+        else:
+            # a hole without an outer ring is taken to be one drawn the wrong
+            #  way around
+            polygons.append([hole[::-1]])
+
+    return polygons
+
+# _quantize returns features with their points snapped to a grid of
+#  quantization by quantization steps across their bounding box, and the
+#  TopoJSON transform back from the grid. Repeated points are dropped, as
+#  are rings left with no area.
+def _quantize(features, quantization):
+    xs = [x for rings, _ in features for ring in rings for x, y in ring]
+    ys = [y for rings, _ in features for ring in rings for x, y in ring]
+    x0, x1, y0, y1 = min(xs), max(xs), min(ys), max(ys)
+    kx = (quantization - 1) / float(x1 - x0) if x1 > x0 else 1.0
+    ky = (quantization - 1) / float(y1 - y0) if y1 > y0 else 1.0
+
+    quantized = []
+    for rings, properties in features:
+        quantized_rings = []
+        for ring in rings:
+            quantized_ring = []
+            for x, y in ring:
+                point = (int(round((x - x0) * kx)), int(round((y - y0) * ky)))
+                if not quantized_ring or point != quantized_ring[-1]:
+                    quantized_ring.append(point)
+            if len(quantized_ring) >= 4 and quantized_ring[0] == quantized_ring[-1] and _get_area(quantized_ring):
+                quantized_rings.append(quantized_ring)
+        quantized.append((quantized_rings, properties))
+
+    return quantized, {"scale": [1 / kx, 1 / ky], "translate": [x0, y0]}
+
+# _get_junctions returns the set of points of rings at which rings meet or
+#  part, ie. which appear more than once with different neighbours
+def _get_junctions(rings):
+    neighbours = {}
+    junctions = set()
+    for ring in rings:
+        count = len(ring) - 1
+        for i in range(count):
+            point = ring[i]
+            around = (ring[i - 1] if i else ring[count - 1], ring[i + 1])
+            seen = neighbours.setdefault(point, around)
+            if seen != around and seen != around[::-1]:
+                junctions.add(point)
+    return junctions
+
+# _get_canonical_ring returns ring rotated to start at its least point, so
+#  that the same ring drawn from any start is the same
+def _get_canonical_ring(ring):
+    points = ring[:-1]
+    start = points.index(min(points))
+    points = points[start:] + points[:start]
+    return points + [points[0]]
+
+# _cut returns ring cut at junctions, as a list of arcs, each starting with
+#  the last point of the arc before it, or as the one canonical ring (see
+#  _get_canonical_ring) if it has no junctions
+def _cut(ring, junctions):
+    points = ring[:-1]
+    cuts = [i for i, point in enumerate(points) if point in junctions]
+    if not cuts:
+        return [_get_canonical_ring(ring)]
+
+    start = cuts[0]
+    points = points[start:] + points[:start] + [points[start]]
+    bounds = [cut - start for cut in cuts] + [len(points) - 1]
+    return [points[first:last + 1] for first, last in zip(bounds, bounds[1:])]
+
+# _ArcIndex holds each distinct arc once, whichever way around it's used
+class _ArcIndex(object):
+
+    def __init__(self):
+        self.arcs = []
+        self._indexes = {}
+
+    # add returns the index of arc, adding it if it's new, or the one's
+    #  complement of the index of the arc it's the reverse of. A canonical
+    #  arc (a whole ring without junctions) is the reverse of another if it's
+    #  the same ring drawn the other way around from any start.
+    def add(self, arc, canonical=False):
+        key = tuple(arc)
+        if key in self._indexes:
+            return self._indexes[key]
+
+        if canonical:
+            reverse_key = tuple(_get_canonical_ring(arc[::-1]))
+        else:
+            reverse_key = key[::-1]
+        if reverse_key in self._indexes:
+            return ~self._indexes[reverse_key]
+
+        self._indexes[key] = len(self.arcs)
+        self.arcs.append(arc)
+        return self._indexes[key]
+
+# _get_distance2 returns the squared distance of point from the line through
+#  first and last, scaled by scale (so in the features' own units)
+def _get_distance2(point, first, last, scale):
+    sx, sy = scale
+    px, py = (point[0] - first[0]) * sx, (point[1] - first[1]) * sy
+    lx, ly = (last[0] - first[0]) * sx, (last[1] - first[1]) * sy
+    length2 = lx * lx + ly * ly
+    if not length2:
+        return px * px + py * py
+    cross = px * ly - py * lx
+    return cross * cross / length2
+
+# _simplify_line returns line simplified with Douglas-Peucker to within
+#  tolerance, keeping its first and last points
+def _simplify_line(line, tolerance, scale):
+    keep = [False] * len(line)
+    keep[0] = keep[-1] = True
+    tolerance2 = tolerance * tolerance
+
+    stack = [(0, len(line) - 1)]
+    while stack:
+        first, last = stack.pop()
+        farthest, farthest_distance2 = None, tolerance2
+        for i in range(first + 1, last):
+            distance2 = _get_distance2(line[i], line[first], line[last], scale)
+            if distance2 > farthest_distance2:
+                farthest, farthest_distance2 = i, distance2
+        if farthest is not None:
+            keep[farthest] = True
+            stack.append((first, farthest))
+            stack.append((farthest, last))
+
+    return [point for point, kept in zip(line, keep) if kept]
+
+# _simplify returns arc simplified to within tolerance. An arc which is a
+#  whole ring is split at the point farthest from its start, and each half
+#  simplified, as Douglas-Peucker needs distinct end points.
+def _simplify(arc, tolerance, scale):
+    if len(arc) <= 2 or not tolerance:
+        return arc
+    if arc[0] != arc[-1]:
+        return _simplify_line(arc, tolerance, scale)
+
+    split = max(range(1, len(arc) - 1), key=lambda i: _get_distance2(arc[i], arc[0], arc[0], scale))
+    return _simplify_line(arc[:split + 1], tolerance, scale)[:-1] + _simplify_line(arc[split:], tolerance, scale)
+
+# _encode returns arc delta encoded: its first point, then each point's
+#  offset from the point before it
+def _encode(arc):
+    return [list(arc[0])] + [[x1 - x0, y1 - y0] for (x0, y0), (x1, y1) in zip(arc, arc[1:])]
+
+# _get_ring returns the ring made of the arcs (as indexes in to arcs) in turn
+def _get_ring(arcs, indexes):
+    ring = []
+    for index in indexes:
+        arc = arcs[index] if index >= 0 else arcs[~index][::-1]
+        ring.extend(arc[1:] if ring else arc)
+    return ring
+
+# _simplify_arcs returns arcs simplified to within tolerance, except those of
+#  any of rings (lists of arc indexes) simplification would collapse or turn
+#  inside out, which are left as they are. Such rings (eg. a small island
+#  drawn as a triangle) would be drawn as filling the rest of the globe.
+def _simplify_arcs(arcs, rings, tolerance, scale):
+    simplified = [_simplify(arc, tolerance, scale) for arc in arcs]
+    areas = [_get_area(_get_ring(arcs, ring)) for ring in rings]
+
+    # restoring one ring's arcs can only fix those it shares with others, so
+    #  this settles within a pass or two
+    restored = True
+    while restored:
+        restored = False
+        for ring, area in zip(rings, areas):
+            simplified_area = _get_area(_get_ring(simplified, ring))
+            if simplified_area * area <= 0:
+                for index in ring:
+                    index = index if index >= 0 else ~index
+                    if simplified[index] is not arcs[index]:
+                        simplified[index] = arcs[index]
+                        restored = True
+
+    return simplified
+
+# get_topology returns a TopoJSON topology of features, as a dict, with them
+#  as a GeometryCollection named object_name. Points are quantized to
+#  quantization steps across, and arcs simplified to within tolerance (in
+#  the features' own units, eg. degrees; 0 to not simplify).
+def get_topology(features, object_name, quantization=10000, tolerance=0):
+    features, transform = _quantize(features, quantization)
+    junctions = _get_junctions([ring for rings, _ in features for ring in rings])
+
+    arc_index = _ArcIndex()
+    geometries = []
+    ring_arcs = []
+    for rings, properties in features:
+        polygons = []
+        for polygon in _get_polygons(rings):
+            polygon_arcs = []
+            for ring in polygon:
+                arcs = _cut(ring, junctions)
+                polygon_arcs.append([arc_index.add(arc, canonical=len(arcs) == 1 and arc[0] not in junctions) for arc in arcs])
+                ring_arcs.append(polygon_arcs[-1])
+            polygons.append(polygon_arcs)
+        if not polygons:
+            geometry = {"type": None}
+        elif len(polygons) == 1:
+            geometry = {"type": "Polygon", "arcs": polygons[0]}
+        else:
+            geometry = {"type": "MultiPolygon", "arcs": polygons}
+        geometry["properties"] = properties
+        geometries.append(geometry)
+
+    arcs = arc_index.arcs
+    if tolerance:
+        arcs = _simplify_arcs(arcs, ring_arcs, tolerance, transform["scale"])
+
+    return {
+        "type":      "Topology",
+        "transform": transform,
+        "objects":   {object_name: {"type": "GeometryCollection", "geometries": geometries}},
+        "arcs":      [_encode(arc) for arc in arcs],
+    }
@@ -0,0 +1,246 @@
+#!/usr/bin/env python
+
+"""Build country co-mention matrices of KCNA articles, overall and by month; export as a compact graph json."""
+
+import argparse
+import datetime
+import json
+import logging
+import os
+import re
+import shutil
+import sys
+
+SCRIPT_ROOT = os.path.dirname(os.path.realpath(__file__))
+PROJECT_ROOT_REGEX = re.search("^(.*)/src/.*$", SCRIPT_ROOT)
+PROJECT_ROOT = PROJECT_ROOT_REGEX.group(1)
+
+# make our shared nkir library importable
+sys.path.append(os.path.join(PROJECT_ROOT, 'src'))
+from nkir import columnar
+from nkir import logs
+from nkir import metrics
+
+# country mentions come from exactly where map_countries_kcna gets them
+import map_countries_kcna
+from mention_scanner import MentionScanner
+
+# numpy and scipy are optional dependencies, only needed by this reporter:
+#  `pip install numpy scipy`.
+try:
+    import numpy
+    import scipy.sparse
+except ImportError:
+    scipy = None
+
+TIME_START = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+LOG_FILE_PATH = os.path.join(PROJECT_ROOT, 'var/logs/comention_kcna_'+TIME_START+'.log')
+OUTPUT_ROOT = os.path.join(PROJECT_ROOT, 'data/reporter_kcna/output_comention_kcna')
+PUBLISH_ROOT = os.path.join(PROJECT_ROOT, 'srv/public_html')
+
+# instantiate a logging object singleton for use throughout script, see
+#  nkir.logs
+def _get_logger():
+    return logs.get_logger(LOG_FILE_PATH)
+
+# _get_incidence returns the sparse article by country incidence matrix of
+#  mentions (see map_countries_kcna), a csr matrix with a 1 where an article
+#  mentions a country, along with the month ("2014-02") each article (row)
+#  was published in, and the country code of each column of country_codes.
+# This is the only pass over mentions in Python; everything after it is done
+#  with whole arrays.
+def _get_incidence(mentions, country_codes):
+    _country_index = dict((_country_code, i) for i, _country_code in enumerate(country_codes))
+    _article_index = {}
+    _months = []
+    _rows = []
+    _cols = []
+    for _country_code, _article in mentions:
+        _row = _article_index.get(_article["url"])
+        if _row is None:
+            _row = _article_index[_article["url"]] = len(_months)
+            _months.append(_article["published"][:7])
+        _rows.append(_row)
+        _cols.append(_country_index[_country_code])
+
+    _incidence = scipy.sparse.csr_matrix((numpy.ones(len(_rows), dtype=numpy.int32), (_rows, _cols)),
+                                         shape=(len(_months), len(country_codes)))
+    # a mention repeated (eg. by an article re-imported in to the index)
+    #  still only counts once
+    _incidence.data[:] = 1
+
+    return _incidence, numpy.array(_months, dtype=object)
+
+# _get_comentions returns country by country co-mention counts of incidence
+#  (see _get_incidence) overall, and for each month in months_of_rows (a
+#  month index per article), as coo matrices. Overall counts are:
+#
+#   incidence.T * incidence
+#
+#  whose entry [i, j] is the number of articles mentioning both countries i
+#  and j, and entry [i, i] the number mentioning country i at all.
+#  Monthly counts are found with the same single product, by first moving
+#  each article's mentions in to a block of columns for its month, so that
+#  entry [month * countries + i, j] counts articles of that month.
+def _get_comentions(incidence, months_of_rows, month_count):
+    _articles, _countries = incidence.shape
+
+    _overall = (incidence.T * incidence).tocoo()
+
+    _rows_of_mentions = numpy.repeat(numpy.arange(_articles), numpy.diff(incidence.indptr))
+    _by_month = scipy.sparse.csr_matrix((incidence.data,
+                                         incidence.indices + months_of_rows[_rows_of_mentions] * _countries,
+                                         incidence.indptr),
+                                        shape=(_articles, month_count * _countries))
+    _monthly = (_by_month.T * incidence).tocoo()
+
+    return _overall, _monthly
+
+# _get_nodes_and_edges splits co-mention counts of country rows by country
+#  cols (each count optionally keyed by months too) in to nodes, the diagonal
+#  (articles mentioning a country), and edges, the upper triangle of counts
+#  of at least min_count, renumbering countries through remap. Returns them
+#  as sorted lists of [(month,) country, count] and
+#  [(month,) country, country, count].
+def _get_nodes_and_edges(rows, cols, counts, remap, min_count, months=None):
+    _keys = [] if months is None else [months]
+
+    _nodes = rows == cols
+    _edges = (rows < cols) & (counts >= min_count)
+
+    _node_columns = [_key[_nodes] for _key in _keys] + [remap[rows[_nodes]], counts[_nodes]]
+    _edge_columns = [_key[_edges] for _key in _keys] + [remap[rows[_edges]], remap[cols[_edges]], counts[_edges]]
+
+    # numpy.lexsort sorts by its last key first
+    _node_order = numpy.lexsort(_node_columns[-2::-1])
+    _edge_order = numpy.lexsort(_edge_columns[-2::-1])
+
+    return (numpy.column_stack([_column[_node_order] for _column in _node_columns]).tolist(),
+            numpy.column_stack([_column[_edge_order] for _column in _edge_columns]).tolist())
+
+# _get_graph returns our publishable graph of country co-mentions, looking like:
+#  {"countries": ["CHN", "USA", ...],
+#   "months": ["2014-01", "2014-02", ...],
+#   "nodes": [[country index, articles mentioning it], ...],
+#   "edges": [[country index, country index, articles mentioning both], ...],
+#   "monthly_nodes": [[month index, country index, articles], ...],
+#   "monthly_edges": [[month index, country index, country index, articles], ...]}
+#  with only countries mentioned at least once, and only edges between
+#  countries co-mentioned in at least min_count articles.
+def _get_graph(mentions, country_codes, min_count):
+    logger = logging.getLogger('')
+
+    with metrics.timer('comention.incidence'):
+        _incidence, _months = _get_incidence(mentions, country_codes)
+    _month_codes, _months_of_rows = numpy.unique(_months, return_inverse=True)
+    logger.info("Built {}x{} article by country incidence matrix of {} mentions over {} months.".format(
+                _incidence.shape[0], _incidence.shape[1], _incidence.nnz, len(_month_codes)))
+
+    with metrics.timer('comention.multiply'):
+        _overall, _monthly = _get_comentions(_incidence, _months_of_rows, len(_month_codes))
+
+    # drop countries which are never mentioned, renumbering the rest
+    _mentioned = numpy.flatnonzero(_overall.diagonal())
+    _remap = numpy.full(len(country_codes), -1, dtype=_overall.row.dtype)
+    _remap[_mentioned] = numpy.arange(len(_mentioned))
+
+    with metrics.timer('comention.output'):
+        _nodes, _edges = _get_nodes_and_edges(_overall.row, _overall.col, _overall.data, _remap, min_count)
+        _monthly_nodes, _monthly_edges = _get_nodes_and_edges(_monthly.row % len(country_codes), _monthly.col, _monthly.data,
+                                                              _remap, min_count, _monthly.row // len(country_codes))
+
+    logger.info("Found {} country co-mention edges overall, and {} by month.".format(len(_edges), len(_monthly_edges)))
+
+    return {
+        "countries":     [country_codes[i] for i in _mentioned],
+        "months":        _month_codes.tolist(),
+        "nodes":         _nodes,
+        "edges":         _edges,
+        "monthly_nodes": _monthly_nodes,
+        "monthly_edges": _monthly_edges,
+    }
+
+# _output_graph writes graph to our output file, and from there to our
+#  publishable /srv/public_html location
+def _output_graph(graph):
+    logger = logging.getLogger('')
+
+    if( not os.path.exists(OUTPUT_ROOT) ):
+        os.makedirs(OUTPUT_ROOT)
+
+    if( not os.path.exists(PUBLISH_ROOT) ):
+        os.makedirs(PUBLISH_ROOT)
+
+    _output_path = os.path.join(OUTPUT_ROOT, 'comention_kcna_'+TIME_START+'.json')
+    with open(_output_path + '.partial', 'w') as f:
+        json.dump(graph, f, separators=(',', ':'))
+    os.rename(_output_path + '.partial', _output_path)
+    logger.info("Wrote graph of {} countries by {} months to {}.".format(len(graph["countries"]), len(graph["months"]), _output_path))
+
+    # copy this output file to publishable /srv/public_html location
+    _publish_path = os.path.join(PUBLISH_ROOT, 'comention_kcna.json')
+
+    try:
+        shutil.copy2(_output_path, _publish_path + '.partial')
+        os.rename(_publish_path + '.partial', _publish_path)
+    except (IOError, OSError) as e:
+        logger.warning("I/O error: {} when attempting copy from [{}] to [{}]".format(e.strerror, _output_path, _publish_path))
+    else:
+        logger.info("Copied {} to publishable public_html location.".format(_output_path))
+
+    return(0)
+
+# _get_args parses command line arguments
+def _get_args():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--backend', choices=['mongo', 'columnar'], default='mongo',
+                        help="read country mentions from map_countries_kcna's MongoDB mention index (bringing it up to date first), or scan dbimporter_kcna's columnar store without MongoDB (default: mongo)")
+    parser.add_argument('--full', action='store_true',
+                        help="rebuild the mention index from every article instead of only those imported since it was last updated")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="number of worker processes to scan articles with, as for map_countries_kcna (default: 1)")
+    parser.add_argument('--min-count', type=int, default=1,
+                        help="leave out edges between countries co-mentioned in fewer articles than this (default: 1)")
+    args = parser.parse_args()
+    if args.workers < 1:
+        parser.error("--workers must be at least 1")
+    return args
+
+def main():
+    args = _get_args()
+    logger = _get_logger()
+    logger.info("{} started at {}.".format(os.path.basename(__file__),TIME_START))
+    logger.debug("SCRIPT_ROOT {}".format(SCRIPT_ROOT))
+    logger.debug("PROJECT_ROOT {}".format(PROJECT_ROOT))
+    logger.debug("LOG_FILE_PATH {}".format(LOG_FILE_PATH))
+    logger.debug("OUTPUT_ROOT {}".format(OUTPUT_ROOT))
+
+    if scipy is None:
+        logger.error("Co-mention matrices need numpy and scipy, which aren't installed; exiting.")
+        sys.exit(1)
+
+    countries = map_countries_kcna._get_countries()
+    scanner = MentionScanner(countries)
+
+    if args.backend == 'columnar':
+        if not columnar.is_available():
+            logger.error("Columnar backend requested, but pyarrow isn't installed; exiting.")
+            sys.exit(1)
+        mentions = map_countries_kcna._get_columnar_mentions(scanner, args.workers)
+    else:
+        mentions = map_countries_kcna._update_mongo_mentions(scanner, args.full, args.workers)
+
+    graph = _get_graph(mentions, sorted(countries), args.min_count)
+    with metrics.timer('comention.output_graph'):
+        _output_graph(graph)
+
+    metrics.write_summary(LOG_FILE_PATH)
+
+    TIME_END = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+    logger.info("{} finished at {}.".format(os.path.basename(__file__),TIME_END))
+
+    return(0)
+
+if(__name__ == '__main__'):
+    main()
+    sys.exit(0)
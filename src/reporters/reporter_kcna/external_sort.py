@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+
+"""External merge sort of string lines, spilling sorted runs to disk above a memory budget."""
+
+import heapq
+import logging
+import marshal
+import os
+import tempfile
+
+# _write_run spills one sorted run to a temporary file, returning its path.
+# Runs are marshalled record by record rather than written as text lines, as
+#  our csv lines hold utf_16_be encoded strings which may contain newline bytes.
+def _write_run(lines, tmp_dir):
+    fd, run_path = tempfile.mkstemp(prefix='sort_run_', suffix='.marshal', dir=tmp_dir)
+    with os.fdopen(fd, 'wb') as f:
+        for line in sorted(lines):
+            marshal.dump(line, f)
+    return run_path
+
+def _read_run(run_path):
+    with open(run_path, 'rb') as f:
+        while True:
+            try:
+                yield marshal.load(f)
+            except EOFError:
+                break
+
+# sorted_lines is a generator yielding every line of lines in sorted order.
+#  At most roughly memory_budget bytes of lines are held in memory at once;
+#  beyond that, sorted runs are spilled to tmp_dir and merged back together.
+def sorted_lines(lines, memory_budget, tmp_dir=None):
+    logger = logging.getLogger('')
+
+    run_paths = []
+    chunk = []
+    chunk_bytes = 0
+    try:
+        for line in lines:
+            chunk.append(line)
+            chunk_bytes += len(line)
+            if chunk_bytes >= memory_budget:
+                run_paths.append(_write_run(chunk, tmp_dir))
+                chunk = []
+                chunk_bytes = 0
+
+        if not run_paths:
+            for line in sorted(chunk):
+                yield line
+            return
+
+        if chunk:
+            run_paths.append(_write_run(chunk, tmp_dir))
+            chunk = []
+
+        logger.info("Merging {} sorted runs spilled to disk.".format(len(run_paths)))
+        for line in heapq.merge(*[_read_run(run_path) for run_path in run_paths]):
+            yield line
+    finally:
+        for run_path in run_paths:
+            if os.path.exists(run_path):
+                os.remove(run_path)
@@ -1,51 +1,65 @@
 #!/usr/bin/env python
 
-"""Query MongoDB for map countries data; export in csv."""
+"""Query MongoDB for map countries data; export in csv, with per country csvs and pre-aggregated count cubes."""
 
+import argparse
 import datetime
+import hashlib
+import json
 import logging
+import multiprocessing
 import os
 import re
 import shutil
 import sys
 
-from pymongo import MongoClient
+import external_sort
 
 # TODOs
-# Refactor common functionality (logging, setup, teardown, etc) to library
-# Singleton of MongoDB connection instead of new connection each country
+# Refactor remaining common functionality (logging, setup, teardown, etc) to nkir library
+
+COLLECTION_NAME = 'KCNA'
+INDEX_COLLECTION_NAME = 'KCNA_mentions'
+STATE_COLLECTION_NAME = 'reporter_state'
+REPORTER_NAME = 'map_countries_kcna'
 
 SCRIPT_ROOT = os.path.dirname(os.path.realpath(__file__))
 PROJECT_ROOT_REGEX = re.search("^(.*)/src/.*$", SCRIPT_ROOT)
 PROJECT_ROOT = PROJECT_ROOT_REGEX.group(1)
+
+# make our shared nkir library importable
+sys.path.append(os.path.join(PROJECT_ROOT, 'src'))
+from nkir import columnar
+from nkir import dates
+from nkir import db as nkir_db
+from nkir import logs
+from nkir import metrics
+from nkir import tokens as nkir_tokens
+
+from mention_scanner import MentionScanner
+
 TIME_START = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
 LOG_FILE_PATH = os.path.join(PROJECT_ROOT, 'var/logs/map_countries_kcna_'+TIME_START+'.log')
 OUTPUT_ROOT = os.path.join(PROJECT_ROOT, 'data/reporter_kcna/output_map_countries_kcna')
 PUBLISH_ROOT = os.path.join(PROJECT_ROOT, 'srv/public_html')
-
-# instantiate a logging object singleton for use throughout script
+PUBLISH_COUNTRIES_ROOT = os.path.join(PUBLISH_ROOT, 'map_countries_kcna')
+COUNTRIES_FILE_PATH = os.path.join(PROJECT_ROOT, 'var/datasets/admin3-country-aliases.txt')
+COLUMNAR_ROOT = os.path.join(PROJECT_ROOT, 'data/collector_kcna/columnar_kcna')
+
+# set before any workers are forked, which inherit them rather than being
+#  sent them, see _scan_partition and _scan_rows
+SCANNER = None
+ARTICLES = None
+
+# the most rows a worker turns in to python strings, and scans, at once, so
+#  that only so many articles' token streams are held as both Arrow arrays
+#  and python strings
+SCAN_CHUNK_ROWS = 10000
+
+# instantiate a logging object singleton for use throughout script, see
+#  nkir.logs
 def _get_logger():
-    logs_root_dir = re.search("^(.*/logs)/.*$", LOG_FILE_PATH).group(1)
-
-    if( not os.path.exists(logs_root_dir) ):
-        os.makedirs(logs_root_dir)
-
-    # init the root logger (which logs to persistent local logfile)
-    logging.basicConfig(filename=LOG_FILE_PATH,
-                        format='%(asctime)s: %(levelname)-8s: %(message)s',
-                        datefmt='%m/%d/%Y %I:%M:%S %p',
-                        level=logging.DEBUG)
-
-    # configure console logger
-    _console_logger = logging.StreamHandler()
-    _console_logger.setLevel(logging.INFO) #DEV: Can modify tthis level
-    _formatter = logging.Formatter('%(levelname)-8s %(message)s')
-    _console_logger.setFormatter(_formatter)
-
-    # add the console logger to root (file) logging handler
-    _root_logger = logging.getLogger('')
-    _root_logger.addHandler(_console_logger)
-    return _root_logger
+    return logs.get_logger(LOG_FILE_PATH)
 
 # _get_countries returns a dict of lists with each entry looking like:
 #  {ISO 3166-1 alpha-3 code : [ISO 3166 Country Name, Alias1, Alias2],
@@ -55,13 +69,11 @@ def _get_logger():
 def _get_countries():
     _country_map = {}
 
-    _COUNTRIES_FILE_PATH = os.path.join(PROJECT_ROOT, 'var/datasets/admin3-country-aliases.txt')
-
     logger = logging.getLogger('')
 
     # make sure we have the list of countries file
-    if os.path.isfile(_COUNTRIES_FILE_PATH):
-        with open(_COUNTRIES_FILE_PATH, 'r') as f:
+    if os.path.isfile(COUNTRIES_FILE_PATH):
+        with open(COUNTRIES_FILE_PATH, 'r') as f:
             for line in f:
                 # parse line which looks like:
                 # "NLD|Netherlands;Holland\n"
@@ -72,139 +84,563 @@ def _get_countries():
                     _country_map[_country_code].append(_alias)
             logger.info("Retrieved list of countries.")
     else:
-        logger.error("Countries list file {} wasn't available; exiting.".format(_COUNTRIES_FILE_PATH))
+        logger.error("Countries list file {} wasn't available; exiting.".format(COUNTRIES_FILE_PATH))
         # can't run if we don't have a list of countries, so exit program
         sys.exit(1)
 
     return _country_map
 
-# _get_articles returns a list of articles (with each article being a
-#  PyMongo document from the aggregate function on a MongoDB collection
-#  in Python dict form).
-def _get_articles(country_code, alias_list):
-    _articles = []
-
-    # constants
-    _DB_HOST = 'localhost'
-    _DB_PORT = 28017
-    _DB_NAME = 'NKODP'
-    _COLLECTION_NAME = 'KCNA'
-
+# _get_aliases_hash returns a hash of the country aliases file, so that we
+#  know to rebuild the mention index whenever aliases are added or changed.
+def _get_aliases_hash():
+    with open(COUNTRIES_FILE_PATH, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+# _get_state returns this reporter's saved state document, looking like:
+#  {"_id": "map_countries_kcna",
+#   "high_water": <latest "imported" datetime already in the mention index>,
+#   "aliases_hash": <sha1 of aliases file the mention index was built with>}
+#  or None if the mention index has never been built.
+def _get_state(db):
+    return db[STATE_COLLECTION_NAME].find_one({"_id": REPORTER_NAME})
+
+def _save_state(db, high_water, aliases_hash):
+    db[STATE_COLLECTION_NAME].save({"_id":          REPORTER_NAME,
+                                    "high_water":   high_water,
+                                    "aliases_hash": aliases_hash})
+
+# _add_token_streams tokenizes docs (articles imported before dbimporter_kcna
+#  cached their token streams, or with an old tokenizer version), fetching
+#  their full text from MongoDB in one query, and yields them
+def _add_token_streams(db, docs):
+    _texts = {}
+    with metrics.timer('reporter.mongo_get_untokenized'):
+        for _doc in db[COLLECTION_NAME].find({"_id": {"$in": [_doc["_id"] for _doc in docs]}},
+                                             {"data.metadata.location": 1, "data.metadata.news_service": 1, "data.text": 1}):
+            _texts[_doc["_id"]] = _doc.get("data", {})
+
+    for _doc in docs:
+        _data = _texts.get(_doc["_id"], {})
+        _metadata = dict(_data.get("metadata", {}))
+        _metadata["title"] = _doc.get("data", {}).get("metadata", {}).get("title")
+        with metrics.timer('reporter.tokenize'):
+            _doc["tokens"] = nkir_tokens.get_stream(nkir_tokens.get_article_fields(_metadata, _data.get("text")))
+        yield _doc
+
+# _get_query returns a MongoDB query for articles imported after high_water
+#  (or every article if high_water is None), with _ids from lower (inclusive)
+#  to upper (exclusive), either of which may be None for no bound
+def _get_query(high_water, lower=None, upper=None):
+    _query = {}
+    if high_water is not None:
+        _query["imported"] = {"$gt": high_water}
+
+    _id_range = {}
+    if lower is not None:
+        _id_range["$gte"] = lower
+    if upper is not None:
+        _id_range["$lt"] = upper
+    if _id_range:
+        _query["_id"] = _id_range
+
+    return _query
+
+# _get_partitions splits the articles matching query in to (up to) count
+#  partitions of about the same size, returning each one's _id bounds as a
+#  list of (lower, upper) tuples for _get_query
+def _get_partitions(db, query, count):
+    _total = db[COLLECTION_NAME].find(query).count()
+
+    _bounds = set()
+    for i in range(1, count):
+        for _doc in db[COLLECTION_NAME].find(query, {"_id": 1}).sort("_id", 1).skip(_total * i // count).limit(1):
+            _bounds.add(_doc["_id"])
+    _bounds = sorted(_bounds)
+
+    return zip([None] + _bounds, _bounds + [None])
+
+# _get_articles yields KCNA articles in MongoDB matching query (see
+#  _get_query), projecting only the fields that end up in the output csv and
+#  each article's cached token stream, which is matched against instead of
+#  its text.
+# Articles without a current token stream are tokenized here, batch_size at a
+#  time; `dbimporter_kcna.py --update-existing` caches them all once.
+def _get_articles(db, query, batch_size=500):
     logger = logging.getLogger('')
 
-    logger.info("Looking for country \"{}\".".format(alias_list[0]))
-
-    # NOTE:
-    # We want to return all relevant docs for a given country, no matter
-    #  which alias is used to find that article, but without duplicating
-    #  articles.
-    # Ideally this would entail a text search that OR's all the aliases for a
-    #  given country.
-    # BUT, MongoDB currently has a text search limitation where if one of
-    #  search terms is a phrase in double quotes, like "\"North Korea\"",
-    #  this phrase will be ANDed with the rest of your search terms.
-    # So you can't run a search like:  "United States" || "US" || "USA"
-    #  as MongoDB will instead search: "United States" && ("US" || "USA")
-    # As a result, we run seperate queries for each alias and append our
-    #  found docs by url to a temp dict before returning our final _articles
-    #  list for the given country parameter.
-    _temp_article_dict = {}
-    for alias in alias_list:
-        # connect to MongoDB
-        _client = MongoClient(_DB_HOST, _DB_PORT)
-        _db = _client[_DB_NAME]
-        _coll = _db[_COLLECTION_NAME]
-
-        # query for data
-        _PIPELINE = [
-            { "$match":   { "$text":      { "$search": '"{}"'.format(alias) } } },
-            { "$sort":    { "textScore":  { "$meta": "textScore"  } } },
-            { "$project": {"_id": 0,
-                            "published":  "$data.metadata.date_published",
-                            "modified":   "$data.metadata.html_modified",
-                            "title":      "$data.metadata.title",
-                            "location":   "$data.metadata.location",
-                            "url":        "$data.metadata.article_url",
-                            "textScore":  { "$meta": "textScore" },
-                            "country":    { "$literal": '"{}"'.format(country_code) },
-                            "searchterm": { "$literal": '"{}"'.format(alias) },
-                            "textbody":   "$data.text",
-            }}
-        ]
-
-        logger.info("Querying MongoDB for mentions of \"{}\"...".format(alias))
-
-        # execute query
-        _cursor = _coll.aggregate(_PIPELINE, cursor={})
-
-        # push return to _temp_article_dict with KEY on url.
-        # duplicate articles as we loop through aliases won't appear
-        for _doc in _cursor:
-            _temp_article_dict[_doc["url"]] = _doc
-
-    # build return list of article/doc dictionaries
-    for _url in _temp_article_dict:
-        _articles.append(_temp_article_dict[_url])
-
-    # throw message if queried list is empty
-    if len(_articles) == 0:
-        logger.info("No results found for \"{}\".".format(alias_list[0]))
-    else:
-        logger.info("{} results found.".format(len(_articles)))
-
-    return _articles
-
-# _get_output_line returns an output csv string for each article dictionary
-def _get_output_line(article):
+    _PROJECTION = { "_id": 1,
+                    "imported":                     1,
+                    "published":                    1,
+                    "data.metadata.date_published": 1,
+                    "data.metadata.title":          1,
+                    "data.metadata.article_url":    1,
+                    "data.metadata.parent_url":     1,
+                    "tokens":                       1,
+                    "tokens_version":               1,
+    }
+
+    _untokenized = []
+    _total_untokenized = 0
+    for _doc in metrics.timed_iter('reporter.mongo_get_articles', db[COLLECTION_NAME].find(query, _PROJECTION)):
+        if _doc.get("tokens_version") == nkir_tokens.VERSION:
+            yield _doc
+            continue
+
+        _untokenized.append(_doc)
+        if len(_untokenized) >= batch_size:
+            _total_untokenized += len(_untokenized)
+            for _doc in _add_token_streams(db, _untokenized):
+                yield _doc
+            _untokenized = []
+
+    if _untokenized:
+        _total_untokenized += len(_untokenized)
+        for _doc in _add_token_streams(db, _untokenized):
+            yield _doc
+
+    if _total_untokenized:
+        logger.info("Tokenized {} articles without cached token streams; run dbimporter_kcna.py --update-existing to cache them.".format(_total_untokenized))
+    metrics.count('reporter.articles_tokenized', _total_untokenized)
+
+# _update_index streams each article's token stream through the scanner once,
+#  and upserts the countries it mentions in to the mention index, keyed by
+#  article url.
+#  Returns the latest "imported" datetime seen, for use as the next run's
+#  high water mark.
+#
+# NOTE:
+# Previously we ran a MongoDB $text query per alias per country, re-reading
+#  the whole corpus hundreds of times per run (and working around MongoDB
+#  ANDing quoted phrases together, and stemming short aliases like "US" in to
+#  matching "us"). Now one scanner over all aliases finds every country in one
+#  pass over each article's cached token stream, and only articles imported
+#  since our last run are scanned at all, so adding aliases costs a single
+#  rescan of token streams however many are added.
+# dbimporter_kcna upserts articles on their (unique) url, so an article that
+#  was re-imported is simply re-scanned and its index entry replaced. Articles
+#  split out of an old style daily page replace the whole page's entry.
+def _update_index(db, scanner, articles, high_water):
     logger = logging.getLogger('')
 
-    _country_REGEX = re.search("^\"(.*)\"$", article["country"])
-    _country = _country_REGEX.group(1)
+    _index = db[INDEX_COLLECTION_NAME]
+    _removed_parent_urls = set()
+
+    _total_articles = 0
+    _total_mentions = 0
+    for _doc in articles:
+        _total_articles += 1
+        _data = _doc.get("data", {})
+        _metadata = _data.get("metadata", {})
+
+        _parent_url = _metadata.get("parent_url")
+        if _parent_url is not None and _parent_url not in _removed_parent_urls:
+            _index.remove({"_id": _parent_url})
+            _removed_parent_urls.add(_parent_url)
+
+        with metrics.timer('reporter.scan_mentions'):
+            _countries = sorted(scanner.scan(_doc.get("tokens")))
+        _total_mentions += len(_countries)
+
+        # articles imported before dbimporter_kcna stored native publish
+        #  dates only have their date string
+        _published = dates.get_iso_date(_doc.get("published") or _metadata.get("date_published"))
+
+        with metrics.timer('reporter.mongo_index_save'):
+            _index.save({   "_id":        _metadata.get("article_url"),
+                            "published":  _published,
+                            "title":      _metadata.get("title"),
+                            "countries":  _countries,
+            })
+
+        _imported = _doc.get("imported")
+        if _imported is not None and (high_water is None or _imported > high_water):
+            high_water = _imported
+
+    logger.info("Indexed {} country mentions in {} new articles.".format(_total_mentions, _total_articles))
+    metrics.count('reporter.articles_scanned', _total_articles)
+    metrics.count('reporter.mentions_indexed', _total_mentions)
+
+    return high_water
+
+# _scan_partition scans one partition of articles, a (lower _id, upper _id,
+#  high_water) tuple, in to the mention index with SCANNER, over this
+#  process's own MongoDB connection, so that any number of worker processes
+#  index partitions side by side.
+#  Returns the partition's high water mark (see _update_index) and metrics;
+#  metrics are handed back rather than kept, as workers may be other processes.
+def _scan_partition(partition):
+    lower, upper, high_water = partition
+    db = nkir_db.get_db()
+    high_water = _update_index(db, SCANNER, _get_articles(db, _get_query(high_water, lower, upper)), high_water)
+    return high_water, metrics.snapshot()
+
+# _map returns func applied to each of jobs, in order, in a pool of up to
+#  workers processes forked from ours (starting without our metrics, so the
+#  ones they hand back are only their own), or in our own process if
+#  workers is 1
+def _map(func, jobs, workers):
+    if workers <= 1 or len(jobs) <= 1:
+        return [func(job) for job in jobs]
+
+    pool = multiprocessing.Pool(min(workers, len(jobs)), initializer=metrics.reset)
+    try:
+        results = pool.map(func, jobs)
+    except:
+        pool.terminate()
+        raise
+    pool.close()
+    pool.join()
+    return results
+
+# _get_mentions yields a (country code, article) tuple for every country
+#  mentioned in every dated article of the mention index, with its publish
+#  date as an ISO date string, or only for countries in country_codes, if
+#  given.
+def _get_mentions(db, country_codes=None):
+    _index = db[INDEX_COLLECTION_NAME]
+
+    _PROJECTION = {"published": 1, "title": 1, "countries": 1}
+    _query = {"countries": {"$ne": []}}
+    if country_codes is not None:
+        _query = {"countries": {"$in": list(country_codes)}}
+
+    for _doc in metrics.timed_iter('reporter.mongo_get_mentions', _index.find(_query, _PROJECTION)):
+        # index entries from before we stored ISO dates hold date strings
+        _published = dates.get_iso_date(_doc["published"])
+        if _published is None:
+            continue
+
+        _article = {
+            "published":  _published,
+            "title":      _doc["title"],
+            "url":        _doc["_id"],
+        }
+        for _country_code in _doc["countries"]:
+            if country_codes is None or _country_code in country_codes:
+                yield _country_code, _article
+
+# _scan_rows scans rows from start up to end of ARTICLES (see
+#  _get_columnar_mentions) with SCANNER, returning the sorted list of country
+#  codes mentioned in each row, and metrics. Only these rows' token streams
+#  (and texts, of rows without a current token stream) become python strings.
+def _scan_rows(chunk):
+    start, end = chunk
+
+    with metrics.timer('reporter.columnar_convert'):
+        _streams = ARTICLES["tokens"].slice(start, end - start).to_pylist()
+        _stale = [i for i in range(start, end) if ARTICLES["tokens_version"][i] != nkir_tokens.VERSION]
+        if _stale:
+            _fields = ["title", "location", "news_service", "text"]
+            _values = dict((_field, columnar.take(ARTICLES[_field], _stale)) for _field in _fields)
+
+    for j, i in enumerate(_stale):
+        _metadata = {"title": _values["title"][j], "location": _values["location"][j], "news_service": _values["news_service"][j]}
+        with metrics.timer('reporter.tokenize'):
+            _streams[i - start] = nkir_tokens.get_stream(nkir_tokens.get_article_fields(_metadata, (_values["text"][j] or "").split("\n")))
+        metrics.count('reporter.articles_tokenized')
+
+    _results = []
+    for _tokens in _streams:
+        with metrics.timer('reporter.scan_mentions'):
+            _results.append(sorted(SCANNER.scan(_tokens)))
+
+    return _results, metrics.snapshot()
+
+# _get_columnar_mentions yields a (country code, article) tuple for every
+#  country mentioned in every article of dbimporter_kcna's columnar store,
+#  which holds everything we need, so no MongoDB server is needed at all.
+# The store is memory mapped and de-duplicated (keeping the latest import of
+#  each article) on its url, parent url and import time columns alone, and
+#  publish dates are normalized once per distinct date; articles without a
+#  publish date can't be mapped, so only the other columns of dated articles
+#  are read. They're kept as Arrow arrays, which workers turn in to python
+#  strings a chunk at a time as they scan them. The text column (with the
+#  location and news service columns) is only read if some articles were
+#  stored without a current token stream, and only theirs are converted.
+# Rows are scanned in contiguous chunks of at most SCAN_CHUNK_ROWS, shared
+#  between worker processes if there's more than one, and their results are
+#  put back together in row order.
+def _get_columnar_mentions(scanner, workers=1):
+    logger = logging.getLogger('')
 
-    _date_published_REGEX = re.search("^(\d\d\d\d-\d\d-\d\d).*$", article["published"])
-    _date_published = _date_published_REGEX.group(1)
+    _store = columnar.ArticleStore(COLUMNAR_ROOT)
+    with metrics.timer('reporter.columnar_read'):
+        _latest = _store.get_latest_rows()
+        _published = columnar.map_values(_latest.read(["published"])["published"], dates.get_iso_date)
+        # ISO dates are never empty, so only missing ones are False
+        _dated = _published.astype(bool)
+        _latest = _latest.filter(_dated)
+
+        _articles = _latest.read(["url", "title", "tokens", "tokens_version"])
+        _articles["published"] = _published[_dated]
+        _articles["tokens_version"] = columnar.get_numpy(_articles["tokens_version"], -1)
+        if (_articles["tokens_version"] != nkir_tokens.VERSION).any():
+            _articles.update(_latest.read(["location", "news_service", "text"]))
+    logger.info("Read {} articles from columnar store {}.".format(len(_latest), COLUMNAR_ROOT))
+
+    # workers are forked with these, rather than being sent them
+    global SCANNER, ARTICLES
+    SCANNER = scanner
+    ARTICLES = _articles
+
+    _total_articles = len(_latest)
+    _chunk_size = max(1, min(SCAN_CHUNK_ROWS, -(-_total_articles // max(1, workers))))
+    _chunks = [(_start, min(_start + _chunk_size, _total_articles)) for _start in range(0, _total_articles, _chunk_size)]
+    if len(_chunks) > 1:
+        logger.info("Scanning articles in {} chunks with {} worker processes.".format(len(_chunks), max(1, min(workers, len(_chunks)))))
+
+    _row_countries = []
+    for _chunk_countries, worker_metrics in _map(_scan_rows, _chunks, workers):
+        metrics.merge(worker_metrics)
+        _row_countries.extend(_chunk_countries)
+
+    _titles = _articles["title"].to_pylist()
+    _urls = _articles["url"].to_pylist()
+    _total_mentions = 0
+    for i, _countries in enumerate(_row_countries):
+        _total_mentions += len(_countries)
+        _article = {"published": _articles["published"][i], "title": _titles[i] or u"", "url": _urls[i]}
+        for _country_code in _countries:
+            yield _country_code, _article
+
+    metrics.count('reporter.articles_scanned', _total_articles)
+    metrics.count('reporter.mentions_indexed', _total_mentions)
+
+# _get_output_line returns an output csv string for each country mention, of
+#  an article whose publish date is an ISO date string
+def _get_output_line(country_code, article):
+    logger = logging.getLogger('')
 
-    _output_line = ",".join([   _country,
-                                _date_published,
+    _output_line = ",".join([   country_code,
+                                article["published"],
                                 "\"{}\"".format(article["title"].encode('utf_16_be')),
                                 "\"{}\"".format(article["url"].encode('utf_16_be')),
                             ])
 
-    logger.debug("output line: {}".format(_output_line))
+    logger.debug("output line: %s", _output_line)
 
     return _output_line
 
-# _output_csv prints out output csv file
-def _output_csv(data, header):
+# _write_atomically streams lines in to a temporary file beside path, and
+#  renames it over path once complete, so readers never see a partial file
+def _write_atomically(path, header, lines):
+    _partial_path = path + '.partial'
+    with open(_partial_path, 'w') as f:
+        f.write(header)
+        for line in lines:
+            f.write(line)
+            f.write("\n")
+    os.rename(_partial_path, path)
+
+# _split_by_country passes sorted csv lines straight through, while also
+#  writing each country's lines to its own csv in PUBLISH_COUNTRIES_ROOT (for
+#  the map to fetch lazily) and counting mentions per (country, date) in to
+#  counts for our pre-aggregated cubes
+def _split_by_country(lines, header, counts):
     logger = logging.getLogger('')
 
-    if( not os.path.exists(OUTPUT_ROOT) ):
-        os.makedirs(OUTPUT_ROOT)
+    if( not os.path.exists(PUBLISH_COUNTRIES_ROOT) ):
+        os.makedirs(PUBLISH_COUNTRIES_ROOT)
 
-    _output_path = os.path.join(OUTPUT_ROOT, 'map_countries_kcna_'+TIME_START+'.csv')
+    _country_file = None
+    _country_path = None
+    _current_country = None
+    _total_countries = 0
+    try:
+        for line in lines:
+            _country, _date = line.split(",", 2)[:2]
+            counts[(_country, _date)] = counts.get((_country, _date), 0) + 1
+
+            # lines are sorted, so each country's lines arrive together
+            if _country != _current_country:
+                if _country_file is not None:
+                    _country_file.close()
+                    os.rename(_country_path + '.partial', _country_path)
+                _current_country = _country
+                _total_countries += 1
+                _country_path = os.path.join(PUBLISH_COUNTRIES_ROOT, _country + '.csv')
+                _country_file = open(_country_path + '.partial', 'w')
+                _country_file.write(header)
+
+            _country_file.write(line)
+            _country_file.write("\n")
+            yield line
+    finally:
+        if _country_file is not None:
+            _country_file.close()
+            os.rename(_country_path + '.partial', _country_path)
+
+    logger.info("Wrote per country csv files for {} countries.".format(_total_countries))
+
+# _get_period returns the start date of the week or month containing date
+def _get_period(date, granularity):
+    if granularity == 'day':
+        return date
+    elif granularity == 'month':
+        return date[:8] + '01'
+    else:
+        _date = datetime.datetime.strptime(date, "%Y-%m-%d").date()
+        return (_date - datetime.timedelta(days=_date.weekday())).isoformat()
+
+# _output_cubes writes compact, pre-aggregated mention counts by country and
+#  period, for each granularity in granularities, to publishable json files
+#  named map_countries_kcna_cube_<granularity>.json, looking like:
+#  {"granularity": "day",
+#   "countries": ["CHN", "USA", ...],
+#   "dates": ["2014-01-01", "2014-01-02", ...],
+#   "counts": [[country index, date index, count], ...]}
+def _output_cubes(counts, granularities):
+    logger = logging.getLogger('')
 
-    with open(_output_path, 'w') as f:
-        f.write(header)
-        for line in sorted(data):
-            f.write(line)
-            f.write("\n")
+    for granularity in granularities:
+        _cube_counts = {}
+        for (_country, _date), _count in counts.items():
+            _key = (_country, _get_period(_date, granularity))
+            _cube_counts[_key] = _cube_counts.get(_key, 0) + _count
+
+        _countries = sorted(set(_country for _country, _period in _cube_counts))
+        _periods = sorted(set(_period for _country, _period in _cube_counts))
+        _country_index = dict((_country, i) for i, _country in enumerate(_countries))
+        _period_index = dict((_period, i) for i, _period in enumerate(_periods))
+
+        _cube = {
+            "granularity": granularity,
+            "countries":   _countries,
+            "dates":       _periods,
+            "counts":      [[_country_index[_country], _period_index[_period], _count]
+                            for (_country, _period), _count in sorted(_cube_counts.items())],
+        }
+
+        _cube_path = os.path.join(PUBLISH_ROOT, 'map_countries_kcna_cube_' + granularity + '.json')
+        with open(_cube_path + '.partial', 'w') as f:
+            json.dump(_cube, f, separators=(',', ':'))
+        os.rename(_cube_path + '.partial', _cube_path)
+
+        logger.info("Wrote {} cube of {} countries by {} dates to {}.".format(granularity, len(_countries), len(_periods), _cube_path))
+
+# _output_csv streams sorted csv lines to our output file, and from there to
+#  our publishable /srv/public_html location, along with per country csv files
+#  and pre-aggregated cubes of mention counts.
+#  If lines are only for some countries (see --countries), only their per
+#  country csv files are published, leaving the full csv and cubes as they are.
+def _output_csv(lines, header, memory_budget, granularities, partial=False):
+    logger = logging.getLogger('')
+
+    if( not os.path.exists(OUTPUT_ROOT) ):
+        os.makedirs(OUTPUT_ROOT)
 
-    # copy this output file to publishable /srv/public_html location
     if( not os.path.exists(PUBLISH_ROOT) ):
         os.makedirs(PUBLISH_ROOT)
 
+    _output_path = os.path.join(OUTPUT_ROOT, 'map_countries_kcna_'+('partial_' if partial else '')+TIME_START+'.csv')
+
+    _counts = {}
+    _sorted_lines = external_sort.sorted_lines(lines, memory_budget, OUTPUT_ROOT)
+    _write_atomically(_output_path, header, _split_by_country(_sorted_lines, header, _counts))
+
+    if partial:
+        logger.info("Wrote {} for some countries only; not publishing it or its cubes.".format(_output_path))
+        return(0)
+
+    with metrics.timer('reporter.output_cubes'):
+        _output_cubes(_counts, granularities)
+
+    # copy this output file to publishable /srv/public_html location
     _publish_path = os.path.join(PUBLISH_ROOT, 'map_countries_kcna.csv')
 
     try:
-        shutil.copy2(_output_path, _publish_path)
-    except IOError as e:
+        shutil.copy2(_output_path, _publish_path + '.partial')
+        os.rename(_publish_path + '.partial', _publish_path)
+    except (IOError, OSError) as e:
         logger.warning("I/O error: {} when attempting copy from [{}] to [{}]".format(e.strerror, _output_path, _publish_path))
     else:
         logger.info("Copied {} to publishable public_html location.".format(_output_path))
 
     return(0)
 
+# _update_mongo_mentions brings our MongoDB mention index up to date, and
+#  returns a generator of (country code, article) tuples for every mention in
+#  it (or only for country_codes), see _get_mentions.
+# With more than one worker, articles to scan are split in to a partition per
+#  worker by _id, and each worker process scans its partition over its own
+#  MongoDB connection, so that scanning is bounded by what MongoDB can serve
+#  rather than by one connection's round trips.
+def _update_mongo_mentions(scanner, full, workers=1, country_codes=None):
+    logger = logging.getLogger('')
+
+    db = nkir_db.get_db()
+
+    # only scan articles imported since our last run, unless this is our
+    #  first run, a full run was requested, or the country aliases changed
+    aliases_hash = _get_aliases_hash()
+    state = _get_state(db)
+    high_water = None
+    if full:
+        logger.info("Full run requested; rebuilding mention index.")
+    elif state is None:
+        logger.info("No mention index found; building mention index.")
+    elif state.get("aliases_hash") != aliases_hash:
+        logger.info("Country aliases changed; rebuilding mention index.")
+    else:
+        high_water = state.get("high_water")
+
+    if high_water is None:
+        with metrics.timer('reporter.mongo_clear_index'):
+            db[INDEX_COLLECTION_NAME].remove({})
+
+    if high_water is None:
+        logger.info("Querying MongoDB for all articles...")
+    else:
+        logger.info("Querying MongoDB for articles imported since {}...".format(high_water))
+
+    partitions = [(None, None)]
+    if workers > 1:
+        with metrics.timer('reporter.mongo_partition'):
+            partitions = _get_partitions(db, _get_query(high_water), workers)
+        logger.info("Scanning articles in {} partitions with {} worker processes.".format(len(partitions), min(workers, len(partitions))))
+
+    # workers are forked with the scanner, rather than being sent it
+    global SCANNER
+    SCANNER = scanner
+
+    # articles imported before we stamped import times have no "imported"
+    #  field, so fall back on when this scan started as our high water mark
+    scan_started = datetime.datetime.utcnow()
+    new_high_water = high_water
+    for partition_high_water, worker_metrics in _map(_scan_partition, [(lower, upper, high_water) for lower, upper in partitions], workers):
+        metrics.merge(worker_metrics)
+        if partition_high_water is not None and (new_high_water is None or partition_high_water > new_high_water):
+            new_high_water = partition_high_water
+    _save_state(db, new_high_water or scan_started, aliases_hash)
+
+    # newly indexed articles, along with everything indexed on previous runs
+    return _get_mentions(db, country_codes)
+
+# _get_args parses command line arguments
+def _get_args():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--backend', choices=['mongo', 'columnar'], default='mongo',
+                        help="read articles from MongoDB, or from dbimporter_kcna's columnar store without MongoDB (default: mongo)")
+    parser.add_argument('--full', action='store_true',
+                        help="rescan every article instead of only those imported since the last run")
+    parser.add_argument('--memory-budget', type=int, default=64,
+                        help="MB of csv lines to sort in memory before spilling sorted runs to disk (default: 64)")
+    parser.add_argument('--cube-granularities', default='day,week,month',
+                        help="comma separated periods to pre-aggregate mention counts by, of day, week and month (default: day,week,month)")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="number of worker processes to scan articles with, each over its own MongoDB connection (default: 1)")
+    parser.add_argument('--countries',
+                        help="comma separated ISO 3166-1 alpha-3 codes of countries to report on, publishing only their per country csvs (default: all)")
+    args = parser.parse_args()
+    for granularity in args.cube_granularities.split(","):
+        if granularity not in ('day', 'week', 'month'):
+            parser.error("unknown cube granularity \"{}\"".format(granularity))
+    if args.workers < 1:
+        parser.error("--workers must be at least 1")
+    return args
+
 def main():
+    args = _get_args()
     logger = _get_logger()
     logger.info("{} started at {}.".format(os.path.basename(__file__),TIME_START))
     logger.debug("SCRIPT_ROOT {}".format(SCRIPT_ROOT))
@@ -214,19 +650,38 @@ def main():
 
     # seed data's header csv string line
     header = "country,date,title,url\n"
-    data = []
 
     countries = _get_countries()
 
-    for country_code, alias_list in sorted(countries.iteritems()):
-        articles = _get_articles(country_code, alias_list)
+    country_codes = None
+    if args.countries:
+        country_codes = set(_country_code.strip().upper() for _country_code in args.countries.split(",") if _country_code.strip())
+        _unknown = sorted(country_codes - set(countries))
+        if _unknown:
+            logger.error("Unknown country codes {}; exiting.".format(", ".join(_unknown)))
+            sys.exit(1)
+        logger.info("Reporting on {} countries only: {}.".format(len(country_codes), ", ".join(sorted(country_codes))))
+
+    if args.backend == 'columnar':
+        if not columnar.is_available():
+            logger.error("Columnar backend requested, but pyarrow isn't installed; exiting.")
+            sys.exit(1)
+        # nothing is kept between columnar runs, so only scan for the
+        #  countries we're reporting on
+        if country_codes is not None:
+            countries = dict((_country_code, countries[_country_code]) for _country_code in country_codes)
+        mentions = _get_columnar_mentions(MentionScanner(countries), args.workers)
+    else:
+        # the mention index is kept for every country, so is kept up to date
+        #  with all of them, however few we're reporting on
+        mentions = _update_mongo_mentions(MentionScanner(countries), args.full, args.workers, country_codes)
 
-        for article in articles:
-            output_line = _get_output_line(article)
-            data.append(output_line)
-            logger.debug("{}".format(output_line))
+    # stream csv lines through an external sort in to our output file
+    lines = (_get_output_line(country_code, article) for country_code, article in mentions)
+    with metrics.timer('reporter.output_csv'):
+        _output_csv(lines, header, args.memory_budget * 1024 * 1024, args.cube_granularities.split(","), country_codes is not None)
 
-    _output_csv(data, header)
+    metrics.write_summary(LOG_FILE_PATH)
 
     TIME_END = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
     logger.info("{} finished at {}.".format(os.path.basename(__file__),TIME_END))
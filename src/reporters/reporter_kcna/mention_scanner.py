@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+
+"""Single-pass, token based phrase matcher for country mentions in article token streams."""
+
+# Aliases in admin3-country-aliases.txt are matched as whole token phrases
+#  (see nkir.tokens) against an article's token stream:
+#
+#  - an alias written in capitals (eg. "US", "UK", "U.S.A.") matches only
+#    exactly as written, so that eg. "US" doesn't match "us", and any other
+#    alias matches in any case
+#  - an alias may be followed by negative contexts, each after a "!", which
+#    contain the alias and rule out matches of it inside them; eg.
+#    "Korea!North Korea!South Korea" matches "Korea", but not the "Korea" of
+#    "North Korea" or "South Korea"
+#
+# Every alias of every country is looked up by its first (lowercased) token,
+#  so matching costs one dict lookup per token of an article however many
+#  aliases there are.
+
+import logging
+
+from nkir import tokens as nkir_tokens
+
+# Phrase is a tokenized alias or negative context: its lowercased tokens, and
+#  its tokens as written if it must match exactly as written (or else None)
+class Phrase(object):
+
+    def __init__(self, text):
+        if isinstance(text, str):
+            text = text.decode('utf-8')
+        phrase_tokens = nkir_tokens.tokenize(text)
+        self.lowered = [token.lower() for token in phrase_tokens]
+        self.exact = phrase_tokens if text.upper() == text and text.lower() != text else None
+
+    def __len__(self):
+        return len(self.lowered)
+
+    # matches returns whether this phrase is at start of tokens (and lowered,
+    #  the same tokens lowercased)
+    def matches(self, tokens, lowered, start):
+        end = start + len(self.lowered)
+        if start < 0 or end > len(tokens):
+            return False
+        if lowered[start:end] != self.lowered:
+            return False
+        return self.exact is None or tokens[start:end] == self.exact
+
+# Alias is a Phrase for a country, with the negative contexts which rule out
+#  its matches, as a list of (offset of alias within context, context Phrase)
+class Alias(Phrase):
+
+    def __init__(self, text, country_code, contexts):
+        Phrase.__init__(self, text)
+        self.country_code = country_code
+        self.contexts = []
+        for context_text in contexts:
+            context = Phrase(context_text)
+            for offset in range(len(context) - len(self) + 1):
+                if context.lowered[offset:offset + len(self)] == self.lowered:
+                    self.contexts.append((offset, context))
+                    break
+            else:
+                logging.getLogger('').warning("Negative context \"{}\" doesn't contain alias \"{}\"; ignoring it.".format(context_text, text))
+
+    # matches returns whether this alias is at start of tokens, outside of
+    #  any of its negative contexts
+    def matches(self, tokens, lowered, start):
+        if not Phrase.matches(self, tokens, lowered, start):
+            return False
+        for offset, context in self.contexts:
+            if context.matches(tokens, lowered, start - offset):
+                return False
+        return True
+
+# MentionScanner indexes every alias of every country by its first token, and
+#  then finds all countries mentioned in a token stream with a single pass
+#  over it.
+#
+# countries is the dict of lists returned by map_countries_kcna._get_countries:
+#  {ISO 3166-1 alpha-3 code : [ISO 3166 Country Name, Alias1, Alias2], ...}
+class MentionScanner(object):
+
+    def __init__(self, countries):
+        logger = logging.getLogger('')
+
+        # {first lowercased token: [Alias, ...]}
+        self._aliases = {}
+
+        alias_count = 0
+        for country_code, alias_list in countries.items():
+            for alias_text in alias_list:
+                alias_parts = [part.strip() for part in alias_text.split("!")]
+                alias = Alias(alias_parts[0], country_code, [part for part in alias_parts[1:] if part])
+                if len(alias):
+                    self._aliases.setdefault(alias.lowered[0], []).append(alias)
+                    alias_count += 1
+
+        logger.info("Built mention scanner over {} aliases ({} first tokens).".format(alias_count, len(self._aliases)))
+
+    # scan returns the set of country codes with at least one alias match in
+    #  stream, a token stream from nkir.tokens
+    def scan(self, stream):
+        found = set()
+        if not stream:
+            return found
+
+        aliases = self._aliases
+        for tokens in nkir_tokens.get_token_lists(stream):
+            lowered = [token.lower() for token in tokens]
+            for position, token in enumerate(lowered):
+                candidates = aliases.get(token)
+                if candidates is None:
+                    continue
+                for alias in candidates:
+                    if alias.country_code not in found and alias.matches(tokens, lowered, position):
+                        found.add(alias.country_code)
+
+        return found
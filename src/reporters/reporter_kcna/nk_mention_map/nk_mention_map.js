@@ -7,27 +7,30 @@ var margin = {top: 30, right: 30, bottom: 30, left: 30},
 // global data structures
 var data = [];
 var filter = {};
+var countryArticles = {}; // per country article rows, fetched lazily on click
 
 // global chart objects
 var brush = {};
 var dateBarChart = {};
 var countryMap = {};
 
+// published (fingerprinted) name of a data file, from the asset manifest
+//  publish_kcna.py writes in to our page
+function asset(name) {
+  return (typeof ASSET_MANIFEST !== "undefined" && ASSET_MANIFEST[name]) || name;
+}
+
 // queue all data file loading before proceeding further
 queue()
-  .defer(d3.csv, "map_countries_kcna.csv")
-  .defer(d3.json, "topo_countries.json")
+  .defer(d3.json, asset("map_countries_kcna_cube_day.json"))
+  .defer(d3.json, asset("topo_countries.json"))
   .await(ready);
 
 // runs after all dependencies have downloaded
-function ready(error, data, countries) {
+function ready(error, cube, countries) {
   if (error) return console.error(error);
 
-  // csv's load without type, so make date objects from dates and add indexes
-  data.forEach(function(d,i) {
-    d.index = i;
-    d.date = formatDate.parse(d.date);
-  });
+  data = cubeToRecords(cube);
 
   dateBarChart.dateDomain = d3.extent(data, function(d) { return d.date });
 
@@ -41,15 +44,75 @@ function ready(error, data, countries) {
   reDraw();
 }
 
+// expand the reporter's compact cube of [country index, date index, count]
+//  triples in to one record per country per date
+function cubeToRecords(cube) {
+  var dates = cube.dates.map(function(d) { return formatDate.parse(d); });
+
+  return cube.counts.map(function(c, i) {
+    return {
+      index: i,
+      country: cube.countries[c[0]],
+      date: dates[c[1]],
+      count: c[2]
+    };
+  });
+}
+
 function buildCrossfilter(data, filter) {
   filter.cf = crossfilter(data);
   filter.byDate = filter.cf.dimension(function(p) { return p.date; });
-  filter.groupByDate = filter.byDate.group();
+  filter.groupByDate = filter.byDate.group().reduceSum(function(p) { return p.count; });
   filter.byCountry = filter.cf.dimension(function(p) { return p.country; });
-  filter.groupByCountry = filter.byCountry.group();
+  filter.groupByCountry = filter.byCountry.group().reduceSum(function(p) { return p.count; });
   return filter;
 }
 
+// fetch a country's article rows the first time it's clicked, then list the
+//  articles published within the brushed date range
+function showCountryArticles(countryAlpha3) {
+
+  if (countryArticles[countryAlpha3]) {
+    listCountryArticles(countryAlpha3);
+    return;
+  }
+
+  d3.csv("map_countries_kcna/" + countryAlpha3 + ".csv", function(error, rows) {
+    if (error) rows = []; // no mentions of this country at all
+
+    rows.forEach(function(d) {
+      d.date = formatDate.parse(d.date);
+      // titles and urls are written as utf_16_be strings by the reporter
+      d.title = d.title.replace(/\u0000/g, "");
+      d.url = d.url.replace(/\u0000/g, "");
+    });
+
+    countryArticles[countryAlpha3] = rows;
+    listCountryArticles(countryAlpha3);
+  });
+}
+
+function listCountryArticles(countryAlpha3) {
+  var extent = brush.extent();
+  var rows = countryArticles[countryAlpha3].filter(function(d) {
+    return extent[0] <= d.date && d.date <= extent[1];
+  });
+
+  var container = d3.select("#article-list-container");
+  container.select(".title")
+    .text(countryAlpha3 + ": " + rows.length + " articles within selected time slice");
+
+  var items = container.select("ul").selectAll("li")
+    .data(rows, function(d) { return d.url; });
+  items.enter()
+    .append("li")
+    .append("a");
+  items.select("a")
+    .attr("href", function(d) { return d.url; })
+    .text(function(d) { return formatDate(d.date) + " " + d.title; });
+  items.exit().remove();
+}
+
 function initialize() {
 
   // variable declarations
@@ -163,7 +226,8 @@ function initialize() {
       .append("path")
       .attr("class", "country-poly")
       .attr("id", function(d) { return d.properties.adm0_a3 })
-      .attr("d", countryMap.path);
+      .attr("d", countryMap.path)
+      .on("click", function(d) { showCountryArticles(d.properties.adm0_a3); });
 
   countryMap.gHandle.append("path")
     .datum(countryMap.graticule)
@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+
+"""Publish the KCNA mention map to srv/public_html with fingerprinted, precompressed assets and an asset manifest."""
+
+# Run after every reporter has written its output to srv/public_html, this:
+#
+#  1. fingerprints the map's scripts, stylesheet and the data files it loads
+#     up front (see nkir.publish), and writes the manifest of them
+#  2. writes nk_mention_map.html from its source, pointed at fingerprinted
+#     names, with the manifest in it for nk_mention_map.js to look up data
+#     files in
+#  3. removes fingerprinted files from publishes before the previous one
+#  4. writes gzip (and brotli) variants of every compressible published file,
+#     including the per country csvs the map fetches lazily, which keep their
+#     plain names and are revalidated instead
+#
+# nkir.static_server serves the results.
+
+import argparse
+import datetime
+import glob
+import logging
+import os
+import re
+import sys
+
+SCRIPT_ROOT = os.path.dirname(os.path.realpath(__file__))
+PROJECT_ROOT_REGEX = re.search("^(.*)/src/.*$", SCRIPT_ROOT)
+PROJECT_ROOT = PROJECT_ROOT_REGEX.group(1)
+
+# make our shared nkir library importable
+sys.path.append(os.path.join(PROJECT_ROOT, 'src'))
+from nkir import logs
+from nkir import metrics
+from nkir import publish
+
+TIME_START = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+LOG_FILE_PATH = os.path.join(PROJECT_ROOT, 'var/logs/publish_kcna_'+TIME_START+'.log')
+PUBLISH_ROOT = os.path.join(PROJECT_ROOT, 'srv/public_html')
+HTML_SOURCE_PATH = os.path.join(SCRIPT_ROOT, 'nk_mention_map/nk_mention_map.html')
+HTML_NAME = 'nk_mention_map.html'
+
+# published files to fingerprint, as globs relative to PUBLISH_ROOT; any that
+#  haven't been published (eg. comention_kcna.json) are skipped. Only files
+#  the page loads up front belong here: the full map_countries_kcna.csv,
+#  which it never loads, and the per country csvs it fetches lazily keep
+#  their plain names.
+ASSETS = [
+    'nk_mention_map.css',
+    'nk_mention_map.js',
+    'js/*.js',
+    'topo_countries.json',
+    'map_countries_kcna_cube_*.json',
+    'comention_kcna.json',
+]
+
+# instantiate a logging object singleton for use throughout script, see
+#  nkir.logs
+def _get_logger():
+    return logs.get_logger(LOG_FILE_PATH)
+
+# _get_asset_names returns the names (relative to PUBLISH_ROOT) of published
+#  files matching ASSETS, leaving out fingerprinted copies of them
+def _get_asset_names():
+    _names = []
+    for _pattern in ASSETS:
+        for _path in sorted(glob.glob(os.path.join(PUBLISH_ROOT, _pattern))):
+            if not publish.is_fingerprinted(_path):
+                _names.append(os.path.relpath(_path, PUBLISH_ROOT))
+    return _names
+
+# _fingerprint_assets fingerprints every asset, and returns our manifest of
+#  their fingerprinted names
+def _fingerprint_assets():
+    logger = logging.getLogger('')
+
+    _manifest = {}
+    for _name in _get_asset_names():
+        _manifest[_name] = publish.fingerprint(PUBLISH_ROOT, _name)
+        logger.debug("Fingerprinted {} as {}.".format(_name, _manifest[_name]))
+
+    logger.info("Fingerprinted {} assets.".format(len(_manifest)))
+    return _manifest
+
+# _write_html writes our page from its source, rewritten to use manifest
+def _write_html(manifest):
+    logger = logging.getLogger('')
+
+    with open(HTML_SOURCE_PATH, 'r') as f:
+        _html = publish.rewrite_html(f.read(), manifest)
+
+    _html_path = os.path.join(PUBLISH_ROOT, HTML_NAME)
+    with open(_html_path + '.partial', 'w') as f:
+        f.write(_html)
+    os.rename(_html_path + '.partial', _html_path)
+
+    logger.info("Wrote {} with asset manifest.".format(_html_path))
+
+# _get_args parses command line arguments
+def _get_args():
+    parser = argparse.ArgumentParser(description=__doc__)
+    return parser.parse_args()
+
+def main():
+    args = _get_args()
+    logger = _get_logger()
+    logger.info("{} started at {}.".format(os.path.basename(__file__),TIME_START))
+    logger.debug("SCRIPT_ROOT {}".format(SCRIPT_ROOT))
+    logger.debug("PROJECT_ROOT {}".format(PROJECT_ROOT))
+    logger.debug("LOG_FILE_PATH {}".format(LOG_FILE_PATH))
+    logger.debug("PUBLISH_ROOT {}".format(PUBLISH_ROOT))
+
+    if( not os.path.exists(PUBLISH_ROOT) ):
+        os.makedirs(PUBLISH_ROOT)
+
+    if publish.brotli is None:
+        logger.info("brotli isn't installed; writing gzip variants only.")
+
+    previous_manifest = publish.read_manifest(PUBLISH_ROOT)
+
+    with metrics.timer('publish.fingerprint'):
+        manifest = _fingerprint_assets()
+    _write_html(manifest)
+    publish.write_manifest(PUBLISH_ROOT, manifest)
+
+    # the previous publish's assets may still be in use by pages loaded just
+    #  before this one, so only remove those of publishes before it
+    removed = publish.remove_stale(PUBLISH_ROOT, manifest.values() + previous_manifest.values())
+    logger.info("Removed {} fingerprinted files from earlier publishes.".format(removed))
+
+    with metrics.timer('publish.precompress'):
+        logger.info("Wrote {} compressed variants of published files.".format(publish.precompress_tree(PUBLISH_ROOT)))
+
+    metrics.write_summary(LOG_FILE_PATH)
+
+    TIME_END = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+    logger.info("{} finished at {}.".format(os.path.basename(__file__),TIME_END))
+
+    return(0)
+
+if(__name__ == '__main__'):
+    main()
+    sys.exit(0)
@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+
+"""Build the TopoJSON country map nk_mention_map draws, quantized and simplified, straight from Natural Earth's shapefile."""
+
+# Replaces unzip, ogr2ogr and the topojson command line tool: the shapefile is
+#  read from its zip with nkir.shapes, and built in to a topology with
+#  nkir.topology, keeping only the properties nk_mention_map.js uses.
+#
+# Built topologies are cached by a hash of the zip, our options and
+#  nkir.topology.VERSION, so rebuilding an unchanged map only copies the
+#  cached one in to place.
+
+import argparse
+import datetime
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import sys
+
+SCRIPT_ROOT = os.path.dirname(os.path.realpath(__file__))
+PROJECT_ROOT_REGEX = re.search("^(.*)/src/.*$", SCRIPT_ROOT)
+PROJECT_ROOT = PROJECT_ROOT_REGEX.group(1)
+
+# make our shared nkir library importable
+sys.path.append(os.path.join(PROJECT_ROOT, 'src'))
+from nkir import logs
+from nkir import metrics
+from nkir import shapes
+from nkir import topology
+
+TIME_START = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+LOG_FILE_PATH = os.path.join(PROJECT_ROOT, 'var/logs/topo_countries_'+TIME_START+'.log')
+SHAPEFILE_ZIP_PATH = os.path.join(PROJECT_ROOT, 'var/datasets/ne_110m_admin_0_countries.zip')
+OUTPUT_ROOT = os.path.join(PROJECT_ROOT, 'data/reporter_kcna/output_topo_countries')
+CACHE_ROOT = os.path.join(OUTPUT_ROOT, 'cache')
+PUBLISH_ROOT = os.path.join(PROJECT_ROOT, 'srv/public_html')
+
+# nk_mention_map.js reads the countries object, by these names
+OBJECT_NAME = 'countries'
+OUTPUT_NAME = 'topo_countries.json'
+
+# the defaults draw indistinguishably from topojson's own at the map's size, in
+#  about 80% of the bytes: 3000 steps is about 0.12 degrees of longitude,
+#  and borders move at most 0.1 degrees
+DEFAULT_QUANTIZATION = 3000
+DEFAULT_SIMPLIFY = 0.1
+DEFAULT_PROPERTIES = 'adm0_a3'
+
+# instantiate a logging object singleton for use throughout script, see
+#  nkir.logs
+def _get_logger():
+    return logs.get_logger(LOG_FILE_PATH)
+
+# _get_cache_key returns the key our topology of the shapefile zip at path,
+#  built with args, is cached by
+def _get_cache_key(path, args):
+    _hash = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), ''):
+            _hash.update(chunk)
+    _hash.update(json.dumps([topology.VERSION, args.quantization, args.simplify, args.properties]))
+    return _hash.hexdigest()
+
+# _build_topology builds our topology of the shapefile zip at path, with
+#  args, and writes it to cache_path
+def _build_topology(path, args, cache_path):
+    logger = logging.getLogger('')
+
+    with metrics.timer('topo_countries.read'):
+        _features = shapes.read_zip(path, fields=args.properties)
+    logger.info("Read {} features from {}.".format(len(_features), path))
+
+    with metrics.timer('topo_countries.build'):
+        _topology = topology.get_topology(_features, OBJECT_NAME, args.quantization, args.simplify)
+
+    if( not os.path.exists(CACHE_ROOT) ):
+        os.makedirs(CACHE_ROOT)
+
+    with open(cache_path + '.partial', 'w') as f:
+        json.dump(_topology, f, separators=(',', ':'))
+    os.rename(cache_path + '.partial', cache_path)
+    logger.info("Built topology of {} arcs, {} bytes, to {}.".format(len(_topology["arcs"]), os.path.getsize(cache_path), cache_path))
+
+    return(0)
+
+# _output_topology copies our cached topology to our output file, and from
+#  there to our publishable /srv/public_html location
+def _output_topology(cache_path):
+    logger = logging.getLogger('')
+
+    if( not os.path.exists(PUBLISH_ROOT) ):
+        os.makedirs(PUBLISH_ROOT)
+
+    for _path in [os.path.join(OUTPUT_ROOT, OUTPUT_NAME), os.path.join(PUBLISH_ROOT, OUTPUT_NAME)]:
+        try:
+            shutil.copy2(cache_path, _path + '.partial')
+            os.rename(_path + '.partial', _path)
+        except (IOError, OSError) as e:
+            logger.warning("I/O error: {} when attempting copy from [{}] to [{}]".format(e.strerror, cache_path, _path))
+        else:
+            logger.info("Copied {} to {}.".format(cache_path, _path))
+
+    return(0)
+
+# _get_args parses command line arguments
+def _get_args():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--quantization', type=int, default=DEFAULT_QUANTIZATION,
+                        help="snap points to a grid of this many steps across the map (default: {})".format(DEFAULT_QUANTIZATION))
+    parser.add_argument('--simplify', type=float, default=DEFAULT_SIMPLIFY,
+                        help="simplify borders to within this many degrees, keeping shared borders shared; 0 to not simplify (default: {})".format(DEFAULT_SIMPLIFY))
+    parser.add_argument('--properties', default=DEFAULT_PROPERTIES,
+                        help="comma separated shapefile attributes to keep as feature properties (default: {})".format(DEFAULT_PROPERTIES))
+    parser.add_argument('--force', action='store_true',
+                        help="rebuild the topology even if it's cached")
+    args = parser.parse_args()
+    if args.quantization < 2:
+        parser.error("--quantization must be at least 2")
+    if args.simplify < 0:
+        parser.error("--simplify can't be negative")
+    args.properties = sorted(set(_name.strip() for _name in args.properties.split(',') if _name.strip()))
+    return args
+
+def main():
+    args = _get_args()
+    logger = _get_logger()
+    logger.info("{} started at {}.".format(os.path.basename(__file__),TIME_START))
+    logger.debug("SCRIPT_ROOT {}".format(SCRIPT_ROOT))
+    logger.debug("PROJECT_ROOT {}".format(PROJECT_ROOT))
+    logger.debug("LOG_FILE_PATH {}".format(LOG_FILE_PATH))
+    logger.debug("OUTPUT_ROOT {}".format(OUTPUT_ROOT))
+
+    if( not os.path.exists(SHAPEFILE_ZIP_PATH) ):
+        logger.error("No shapefile at {}; exiting.".format(SHAPEFILE_ZIP_PATH))
+        sys.exit(1)
+
+    cache_path = os.path.join(CACHE_ROOT, 'topo_countries_' + _get_cache_key(SHAPEFILE_ZIP_PATH, args) + '.json')
+    if os.path.exists(cache_path) and not args.force:
+        logger.info("Topology for these options is cached at {}; not rebuilding.".format(cache_path))
+    else:
+        _build_topology(SHAPEFILE_ZIP_PATH, args, cache_path)
+
+    _output_topology(cache_path)
+
+    metrics.write_summary(LOG_FILE_PATH)
+
+    TIME_END = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+    logger.info("{} finished at {}.".format(os.path.basename(__file__),TIME_END))
+
+    return(0)
+
+if(__name__ == '__main__'):
+    main()
+    sys.exit(0)
@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+
+"""Tests for nkir.columnar's article store: latest rows, older parts, compaction, and Arrow helpers."""
+
+import os
+import re
+import shutil
+import sys
+import tempfile
+import unittest
+
+SCRIPT_ROOT = os.path.dirname(os.path.realpath(__file__))
+PROJECT_ROOT_REGEX = re.search("^(.*)/src/.*$", SCRIPT_ROOT)
+PROJECT_ROOT = PROJECT_ROOT_REGEX.group(1)
+
+sys.path.append(os.path.join(PROJECT_ROOT, 'src'))
+from nkir import columnar
+
+if columnar.is_available():
+    import pyarrow
+    import pyarrow.parquet
+
+# _row returns a store row for url, imported at imported_us
+def _row(url, imported_us, published='2014-01-02', title=None, parent_url=None):
+    return {'url': url, 'parent_url': parent_url, 'published': published, 'title': title or url,
+            'location': 'Pyongyang', 'news_service': 'KCNA', 'text': 'text of ' + url,
+            'imported_us': imported_us, 'tokens': None, 'tokens_version': None}
+
+@unittest.skipUnless(columnar.is_available(), "needs pyarrow and numpy")
+class ArticleStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.store = columnar.ArticleStore(self.root)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def _read_latest(self, columns):
+        return dict((column, array.to_pylist()) for column, array in self.store.read_latest(columns).items())
+
+    def test_latest_row_per_url(self):
+        self.store.append([_row('a', 1, title='a old'), _row('b', 2)])
+        self.store.append([_row('a', 3, title='a new'), _row('c', 1, published='2013-05-06')])
+        self.store.append([_row('b', 0, title='b older')])
+
+        latest = self._read_latest(['url', 'title'])
+        self.assertEqual(sorted(zip(latest['url'], latest['title'])),
+                         [('a', 'a new'), ('b', 'b'), ('c', 'c')])
+
+    def test_split_daily_pages_left_out(self):
+        self.store.append([_row('daily', 1)])
+        self.store.append([_row('daily-1', 2, parent_url='daily'), _row('daily-2', 2, parent_url='daily'), _row('other', 1)])
+
+        self.assertEqual(sorted(self._read_latest(['url'])['url']), ['daily-1', 'daily-2', 'other'])
+
+    def test_filter_and_read(self):
+        self.store.append([_row('a', 1), _row('b', 1), _row('c', 1)])
+        latest = self.store.get_latest_rows()
+        self.assertEqual(len(latest), 3)
+
+        urls = latest.read(['url'])['url'].to_pylist()
+        filtered = latest.filter(columnar.numpy.array([url != 'b' for url in urls]))
+        self.assertEqual(len(filtered), 2)
+        self.assertEqual(sorted(filtered.read(['url', 'text'])['text'].to_pylist()), ['text of a', 'text of c'])
+
+    def test_empty_store(self):
+        latest = self.store.read_latest(['url', 'imported_us'])
+        self.assertEqual(latest['url'].to_pylist(), [])
+        self.assertEqual(latest['imported_us'].to_pylist(), [])
+
+    def test_old_part_without_new_columns(self):
+        # a part written before the tokens columns were added
+        names = [name for name, type_name in columnar.COLUMNS if not name.startswith('tokens')]
+        types = dict(columnar.COLUMNS)
+        row = _row('old', 1)
+        table = pyarrow.Table.from_arrays([pyarrow.array([row[name]], type=getattr(pyarrow, types[name])()) for name in names],
+                                          names=names)
+        os.makedirs(os.path.join(self.root, 'year=2014'))
+        pyarrow.parquet.write_table(table, os.path.join(self.root, 'year=2014', 'part-old.parquet'))
+        self.store.append([_row('new', 2)])
+
+        latest = self.store.read_latest(['url', 'tokens_version'])
+        self.assertEqual(sorted(zip(latest['url'].to_pylist(), columnar.get_numpy(latest['tokens_version'], -1).tolist())),
+                         [('new', -1), ('old', -1)])
+
+    def test_compact(self):
+        self.store.append([_row('a', 1), _row('b', 1)])
+        self.store.append([_row('a', 2, title='a new')])
+        self.store.append([_row('c', 1, published='2013-01-01')])
+        before = self._read_latest(['url', 'title'])
+
+        self.store.compact()
+
+        self.assertEqual(len(os.listdir(os.path.join(self.root, 'year=2014'))), 1)
+        self.assertEqual(len(os.listdir(os.path.join(self.root, 'year=2013'))), 1)
+        after = self._read_latest(['url', 'title'])
+        self.assertEqual(sorted(zip(after['url'], after['title'])), sorted(zip(before['url'], before['title'])))
+
+@unittest.skipUnless(columnar.is_available(), "needs pyarrow and numpy")
+class ArrowHelpersTest(unittest.TestCase):
+
+    def test_get_numpy_nulls(self):
+        values = columnar.get_numpy(pyarrow.array([3, None, 5], type=pyarrow.int64()), -1)
+        self.assertEqual(values.tolist(), [3, -1, 5])
+        self.assertEqual(values.dtype, columnar.numpy.int64)
+
+    def test_map_values_once_per_value(self):
+        calls = []
+        def _upper(value):
+            calls.append(value)
+            return value.upper() if value is not None else None
+
+        values = columnar.map_values(pyarrow.array(['a', 'b', None, 'a', 'b']), _upper)
+        self.assertEqual(values.tolist(), ['A', 'B', None, 'A', 'B'])
+        self.assertEqual(sorted(calls), [None, 'a', 'b'])
+
+    def test_take(self):
+        self.assertEqual(columnar.take(pyarrow.array(['a', 'b', 'c']), [2, 0]), ['c', 'a'])
+
+if(__name__ == '__main__'):
+    unittest.main()
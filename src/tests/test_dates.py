@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+
+"""Tests for nkir.dates' normalization of KCNA publish dates, and its cache."""
+
+import datetime
+import os
+import re
+import sys
+import unittest
+
+SCRIPT_ROOT = os.path.dirname(os.path.realpath(__file__))
+PROJECT_ROOT_REGEX = re.search("^(.*)/src/.*$", SCRIPT_ROOT)
+PROJECT_ROOT = PROJECT_ROOT_REGEX.group(1)
+
+sys.path.append(os.path.join(PROJECT_ROOT, 'src'))
+from nkir import dates
+
+class DatesTest(unittest.TestCase):
+
+    def setUp(self):
+        dates._CACHE.clear()
+
+    def tearDown(self):
+        dates._CACHE.clear()
+
+    def test_kcna_dates(self):
+        self.assertEqual(dates.get_iso_date("February 3 2014 Juche 103"), "2014-02-03")
+        self.assertEqual(dates.get_iso_date("Februar 3, 2014"), "2014-02-03")
+        self.assertEqual(dates.get_iso_date("Sept. 12 2013"), "2013-09-12")
+        self.assertEqual(dates.get_iso_date("  december 31 1999"), "1999-12-31")
+
+    def test_juche_year(self):
+        self.assertEqual(dates.get_iso_date("February 3", "103"), "2014-02-03")
+        self.assertEqual(dates.get_iso_date("February 3 Juche", 103), "2014-02-03")
+        # juche year 1 is 1912
+        self.assertEqual(dates.get_iso_date("April 15", 1), "1912-04-15")
+        # a year given in the date wins
+        self.assertEqual(dates.get_iso_date("February 3 2013", 103), "2013-02-03")
+        self.assertEqual(dates.get_iso_date("February 3"), None)
+
+    def test_cached_by_juche_year(self):
+        self.assertEqual(dates.get_iso_date("March 1", 100), "2011-03-01")
+        self.assertEqual(dates.get_iso_date("March 1", 101), "2012-03-01")
+        self.assertEqual(dates.get_iso_date("March 1", 100), "2011-03-01")
+
+    def test_iso_dates(self):
+        self.assertEqual(dates.get_date("2014-02-03"), datetime.date(2014, 2, 3))
+        self.assertEqual(dates.get_date("2014-02-03 00:00:00"), datetime.date(2014, 2, 3))
+
+    def test_native_dates(self):
+        self.assertEqual(dates.get_date(datetime.datetime(2014, 2, 3, 12, 30)), datetime.date(2014, 2, 3))
+        self.assertEqual(dates.get_iso_date(datetime.date(2014, 2, 3)), "2014-02-03")
+        self.assertEqual(dates.get_datetime("February 3 2014"), datetime.datetime(2014, 2, 3))
+
+    def test_invalid_dates(self):
+        for value in [None, "", "bogus", "Smarch 3 2014", "February 30 2014", "2014-13-01", "2014-02-00"]:
+            self.assertEqual(dates.get_date(value), None, value)
+            self.assertEqual(dates.get_iso_date(value), None, value)
+            self.assertEqual(dates.get_datetime(value), None, value)
+
+    def test_invalid_dates_cached(self):
+        self.assertEqual(dates.get_iso_date("February 30 2014"), None)
+        self.assertIn(("February 30 2014", None), dates._CACHE)
+        self.assertEqual(dates.get_iso_date("February 30 2014"), None)
+
+    def test_cache_cleared_when_full(self):
+        cache_size = dates.CACHE_SIZE
+        dates.CACHE_SIZE = 3
+        try:
+            for day in range(1, 11):
+                self.assertEqual(dates.get_iso_date("May {} 2014".format(day)), "2014-05-{:02d}".format(day))
+                self.assertLessEqual(len(dates._CACHE), 3)
+            # normalized afresh once forgotten
+            self.assertNotIn(("May 1 2014", None), dates._CACHE)
+            self.assertEqual(dates.get_iso_date("May 1 2014"), "2014-05-01")
+        finally:
+            dates.CACHE_SIZE = cache_size
+
+if(__name__ == '__main__'):
+    unittest.main()
@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+
+"""Tests for dbimporter_kcna's content hash skipping upserts and its unique article url index."""
+
+import copy
+import os
+import re
+import sys
+import unittest
+
+SCRIPT_ROOT = os.path.dirname(os.path.realpath(__file__))
+PROJECT_ROOT_REGEX = re.search("^(.*)/src/.*$", SCRIPT_ROOT)
+PROJECT_ROOT = PROJECT_ROOT_REGEX.group(1)
+
+sys.path.append(os.path.join(PROJECT_ROOT, 'src'))
+sys.path.append(os.path.join(PROJECT_ROOT, 'src/collectors/collector_kcna'))
+import dbimporter_kcna
+
+URL_FIELD = 'data.metadata.article_url'
+
+# _get_article returns the JSON of an article as jsonifier_kcna writes it
+def _get_article(article_url, title, html_modified='2015-01-01T00:00:00'):
+    return {'data': {'article_title': title,
+                     'article_text': ["Pyongyang, January 1 (KCNA) -- " + title],
+                     'metadata': {'article_url': article_url, 'html_modified': html_modified}},
+            'tokens_version': 1}
+
+# _FakeCollection keeps documents by article url, supporting just the
+#  pymongo 2.x Collection calls dbimporter_kcna makes, and recording them
+class _FakeCollection(object):
+
+    def __init__(self, docs=None, indexes=None):
+        self.docs = list(docs or [])
+        self.indexes = dict(indexes or {'_id_': {'key': [('_id', 1)]}})
+        self.calls = []
+
+    def _urls(self, query):
+        return set(query[URL_FIELD]['$in'])
+
+    def find(self, query, projection):
+        self.calls.append('find')
+        urls = self._urls(query)
+        return [{'data': {'metadata': {'article_url': doc['data']['metadata']['article_url']}},
+                 'content_hash': doc.get('content_hash')}
+                for doc in self.docs if doc['data']['metadata']['article_url'] in urls]
+
+    def remove(self, query):
+        self.calls.append('remove')
+        if '_id' in query:
+            ids = set(query['_id']['$in'])
+            self.docs = [doc for doc in self.docs if doc['_id'] not in ids]
+        else:
+            urls = self._urls(query)
+            self.docs = [doc for doc in self.docs if doc['data']['metadata']['article_url'] not in urls]
+
+    def initialize_unordered_bulk_op(self):
+        return _FakeBulk(self)
+
+    def index_information(self):
+        self.calls.append('index_information')
+        return copy.deepcopy(self.indexes)
+
+    def create_index(self, key, unique=False):
+        self.calls.append('create_index')
+        self.indexes[key + '_1'] = {'key': [(key, 1)], 'unique': unique}
+
+    def aggregate(self, pipeline, **kwargs):
+        self.calls.append('aggregate')
+        ids = {}
+        for doc in self.docs:
+            ids.setdefault(doc['data']['metadata']['article_url'], []).append(doc['_id'])
+        return [{'_id': url, 'ids': url_ids, 'count': len(url_ids)} for url, url_ids in ids.items() if len(url_ids) > 1]
+
+class _FakeBulk(object):
+
+    def __init__(self, coll):
+        self.coll = coll
+        self.replacements = []
+
+    def find(self, query):
+        self.article_url = query[URL_FIELD]
+        return self
+
+    def upsert(self):
+        return self
+
+    def replace_one(self, doc):
+        self.replacements.append((self.article_url, copy.deepcopy(doc)))
+
+    def execute(self):
+        self.coll.calls.append('execute')
+        for article_url, doc in self.replacements:
+            self.coll.remove({URL_FIELD: {'$in': [article_url]}})
+            doc['_id'] = len(self.coll.docs) + 1
+            self.coll.docs.append(doc)
+
+class UpsertBatchTest(unittest.TestCase):
+
+    def setUp(self):
+        self.coll = _FakeCollection()
+        dbimporter_kcna._upsert_batch(self.coll, [('a.json', _get_article('a', "Talks Held")),
+                                                  ('b.json', _get_article('b', "Message Sent"))])
+        self.coll.calls = []
+
+    def test_unchanged_articles_are_skipped(self):
+        acknowledged, failed, skipped = dbimporter_kcna._upsert_batch(
+            self.coll, [('a.json', _get_article('a', "Talks Held")),
+                        ('b.json', _get_article('b', "Message Sent", html_modified='2015-06-01T00:00:00'))])
+        self.assertEqual(sorted(acknowledged), ['a.json', 'b.json'])
+        self.assertEqual(failed, {})
+        self.assertEqual(skipped, 2)
+        self.assertNotIn('execute', self.coll.calls)
+
+    def test_changed_articles_are_written(self):
+        acknowledged, failed, skipped = dbimporter_kcna._upsert_batch(
+            self.coll, [('a.json', _get_article('a', "Talks Held in Pyongyang")),
+                        ('b.json', _get_article('b', "Message Sent"))])
+        self.assertEqual(sorted(acknowledged), ['a.json', 'b.json'])
+        self.assertEqual(skipped, 1)
+        self.assertEqual(len(self.coll.docs), 2)
+        titles = dict((doc['data']['metadata']['article_url'], doc['data']['article_title']) for doc in self.coll.docs)
+        self.assertEqual(titles, {'a': "Talks Held in Pyongyang", 'b': "Message Sent"})
+
+    def test_retokenized_articles_are_written(self):
+        article = _get_article('a', "Talks Held")
+        article['tokens_version'] = 2
+        acknowledged, failed, skipped = dbimporter_kcna._upsert_batch(self.coll, [('a.json', article)])
+        self.assertEqual(skipped, 0)
+        self.assertIn('execute', self.coll.calls)
+
+    def test_last_queued_copy_is_written(self):
+        acknowledged, failed, skipped = dbimporter_kcna._upsert_batch(
+            self.coll, [('c1.json', _get_article('c', "First")),
+                        ('c2.json', _get_article('c', "Second"))])
+        self.assertEqual(sorted(acknowledged), ['c1.json', 'c2.json'])
+        self.assertEqual([doc['data']['article_title'] for doc in self.coll.docs
+                          if doc['data']['metadata']['article_url'] == 'c'], ["Second"])
+
+class EnsureUniqueUrlsTest(unittest.TestCase):
+
+    def test_duplicates_are_removed_before_indexing(self):
+        docs = []
+        for _id, (article_url, title) in enumerate([('a', "Old"), ('b', "Only"), ('a', "New")]):
+            doc = _get_article(article_url, title)
+            doc['_id'] = _id
+            docs.append(doc)
+        coll = _FakeCollection(docs)
+
+        dbimporter_kcna._ensure_unique_urls(coll)
+        self.assertEqual(sorted(doc['data']['article_title'] for doc in coll.docs), ["New", "Only"])
+        self.assertIn('create_index', coll.calls)
+        self.assertTrue(dbimporter_kcna._has_unique_url_index(coll))
+
+    def test_existing_index_skips_scan(self):
+        coll = _FakeCollection(indexes={'_id_': {'key': [('_id', 1)]},
+                                        URL_FIELD + '_1': {'key': [(URL_FIELD, 1.0)], 'unique': True}})
+        dbimporter_kcna._ensure_unique_urls(coll)
+        self.assertEqual(coll.calls, ['index_information'])
+
+    def test_non_unique_index_is_not_enough(self):
+        coll = _FakeCollection(indexes={'_id_': {'key': [('_id', 1)]},
+                                        'url': {'key': [(URL_FIELD, 1)]}})
+        self.assertFalse(dbimporter_kcna._has_unique_url_index(coll))
+
+if(__name__ == '__main__'):
+    unittest.main()
@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+
+"""Tests for external_sort's in memory sorts and its merges of runs spilled to disk."""
+
+import os
+import random
+import re
+import shutil
+import sys
+import tempfile
+import unittest
+
+SCRIPT_ROOT = os.path.dirname(os.path.realpath(__file__))
+PROJECT_ROOT_REGEX = re.search("^(.*)/src/.*$", SCRIPT_ROOT)
+PROJECT_ROOT = PROJECT_ROOT_REGEX.group(1)
+
+sys.path.append(os.path.join(PROJECT_ROOT, 'src/reporters/reporter_kcna'))
+import external_sort
+
+class SortedLinesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        random.seed(7)
+        # csv lines as map_countries_kcna writes them, with utf_16_be encoded
+        #  titles, which may hold newline bytes (u"\u0a0a" is two of them)
+        self.lines = ["{},2014-01-{:02d},".format(random.choice(['CHN', 'JPN', 'USA']), random.randint(1, 28)) +
+                      u"Title \u0a0a {}".format(random.randint(0, 1000)).encode('utf_16_be')
+                      for i in range(500)]
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_in_memory(self):
+        self.assertEqual(list(external_sort.sorted_lines(iter(self.lines), 10 ** 9, self.tmp_dir)), sorted(self.lines))
+        self.assertEqual(os.listdir(self.tmp_dir), [])
+
+    def test_spilled_runs(self):
+        lines = external_sort.sorted_lines(iter(self.lines), 1000, self.tmp_dir)
+        first = next(lines)
+        spilled = os.listdir(self.tmp_dir)
+        self.assertEqual([first] + list(lines), sorted(self.lines))
+
+        self.assertGreater(len(spilled), 1)
+        # runs are removed once merged
+        self.assertEqual(os.listdir(self.tmp_dir), [])
+
+    def test_runs_removed_when_abandoned(self):
+        lines = external_sort.sorted_lines(iter(self.lines), 1000, self.tmp_dir)
+        next(lines)
+        lines.close()
+        self.assertEqual(os.listdir(self.tmp_dir), [])
+
+    def test_empty(self):
+        self.assertEqual(list(external_sort.sorted_lines(iter([]), 1000, self.tmp_dir)), [])
+
+if(__name__ == '__main__'):
+    unittest.main()
@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+
+"""Tests that extract_kcna's fast path and jsonifier_kcna's HTML text match BeautifulSoup's html.parser."""
+
+import os
+import re
+import sys
+import unittest
+
+from bs4 import BeautifulSoup
+
+SCRIPT_ROOT = os.path.dirname(os.path.realpath(__file__))
+PROJECT_ROOT_REGEX = re.search("^(.*)/src/.*$", SCRIPT_ROOT)
+PROJECT_ROOT = PROJECT_ROOT_REGEX.group(1)
+
+sys.path.append(os.path.join(PROJECT_ROOT, 'src'))
+sys.path.append(os.path.join(PROJECT_ROOT, 'src/collectors/collector_kcna'))
+import extract_kcna
+import jsonifier_kcna
+
+ARTICLE = """<html>
+<head><title>KCNA</title></head>
+<body>
+<p><a href="../../../../index-e.htm?year=2008&month=9">Home</a> &gt;&gt; September 18 2008 Juche 97</p>
+<p>Greetings to the President&nbsp;of Argentina</p>
+<p>Pyongyang, September 18 (KCNA) -- Kim Jong Il sent a message of greetings.</p>
+<pre>  </pre>
+</body>
+</html>
+"""
+
+# pages lxml and html.parser parse differently, which our fast path must
+#  reject rather than parse its own way
+MISMATCHED = {
+    'entities without semicolons': "<html><body><p>a &nbsp b &copy c</p></body></html>",
+    'entity without semicolon before a tag': "<html><body><p>a&nbsp<b>b</b></p></body></html>",
+    'apos': "<html><body><p>a &apos; b</p></body></html>",
+    'control character references': "<html><body><p>a &#1; &#0; &#xd800; b</p></body></html>",
+    'empty references': "<html><body><p>a &#; &#x; b</p></body></html>",
+    'incomplete reference': "<html><body><p>a</p></body></html>&",
+    'cdata': "<html><body><p>a <![CDATA[ x < y ]]> b</p></body></html>",
+    'cdata in a script': "<html><body><script><![CDATA[ x ]]></script><p>a</p></body></html>",
+    'processing instruction': "<html><body><p>a <?pi b?> c</p></body></html>",
+    'stray <': "<html><body><p>a <<b>b</b> c <</p></body></html>",
+    'doctype in the body': "<html><body><p>a <!DOCTYPE html> b</p></body></html>",
+    'second body': "<html><body><p>a</p>\n<body> <p>b</p></body></html>",
+}
+
+# pages both parse alike
+MATCHED = {
+    'entities with semicolons': "<html><body><p>a &nbsp; b &copy; c &amp;nbsp d &#65; &#x42; &#150;</p></body></html>",
+    'entities in attributes': "<html><body><p><a href='?a=1&b=2&nbsp'>a</a> b</p></body></html>",
+    'unknown entities': "<html><body><p>a &bogus; &AMP; b</p></body></html>",
+    'numeric references without semicolons': "<html><body><p>a &#65 b &#x42 c</p></body></html>",
+    'doctype': "<!DOCTYPE html>\n<html><body><p>a</p></body></html>\n",
+    'doctype and comments': "<!DOCTYPE html>\r\n<!-- a -->\n\n<html>\n<body><p>a</p></body></html>",
+    'comments': "<html><body><p>a <!-- b --> c</p></body></html>",
+    'script': "<html><head><script>if (a < b) { c(); }</script></head><body><p>a</p></body></html>",
+    'whitespace': "<html>\n<head>\n<title>t</title>\n</head>\n<body>\n<p>a</p>\t \n<pre> \n </pre> </body>\n</html>\n\n",
+}
+
+# _get_soup_text returns the text BeautifulSoup's html.parser finds in html
+def _get_soup_text(html):
+    return BeautifulSoup(html, 'html.parser').get_text()
+
+@unittest.skipUnless(extract_kcna.is_available(), "lxml isn't installed")
+class GetTextTest(unittest.TestCase):
+
+    def test_article(self):
+        self.assertEqual(extract_kcna.get_text(ARTICLE), _get_soup_text(ARTICLE))
+
+    def test_mismatched_pages_are_rejected(self):
+        for name, html in sorted(MISMATCHED.items()):
+            self.assertIsNone(extract_kcna.get_text(html), name)
+
+    def test_matched_pages(self):
+        for name, html in sorted(MATCHED.items()):
+            self.assertEqual(extract_kcna.get_text(html), _get_soup_text(html), name)
+
+    def test_non_ascii_pages_are_rejected(self):
+        self.assertIsNone(extract_kcna.get_text("<html><body><p>a \xc2\xa0 b</p></body></html>"))
+
+class GetHtmlTextTest(unittest.TestCase):
+
+    # BeautifulSoup's default tree builder would be lxml's, here, which keeps
+    #  "&nbsp" and "&copy" as they are
+    def test_soup_uses_html_parser(self):
+        html = MISMATCHED['entities without semicolons']
+        self.assertEqual(jsonifier_kcna._get_html_text(html, 'soup'), u"a \xa0 b \xa9 c")
+
+    def test_auto_matches_soup(self):
+        for name, html in sorted(MISMATCHED.items() + MATCHED.items() + [('article', ARTICLE)]):
+            self.assertEqual(jsonifier_kcna._get_html_text(html, 'auto'), _get_soup_text(html), name)
+
+if(__name__ == '__main__'):
+    unittest.main()
@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+
+"""Tests for nkir.journal's claims, hand offs between stages, and recovery after a crash."""
+
+import os
+import re
+import shutil
+import sys
+import tempfile
+import unittest
+
+SCRIPT_ROOT = os.path.dirname(os.path.realpath(__file__))
+PROJECT_ROOT_REGEX = re.search("^(.*)/src/.*$", SCRIPT_ROOT)
+PROJECT_ROOT = PROJECT_ROOT_REGEX.group(1)
+
+sys.path.append(os.path.join(PROJECT_ROOT, 'src'))
+from nkir import journal
+
+class JournalTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.journal = journal.Journal(os.path.join(self.root, 'journal.sqlite'))
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    # _claim_and_crash claims limit items of stage in a forked process, which
+    #  then exits without finishing them, as if it crashed
+    def _claim_and_crash(self, stage, limit):
+        pid = os.fork()
+        if pid == 0:
+            try:
+                journal.Journal(self.journal.path).claim(stage, limit)
+            finally:
+                os._exit(0)
+        os.waitpid(pid, 0)
+
+    def test_claims_each_item_once(self):
+        self.journal.add('jsonify', ['c.htm', 'a.htm', 'b.htm'])
+        self.assertEqual(self.journal.claim('jsonify', 2), ['a.htm', 'b.htm'])
+        self.assertEqual(self.journal.claim('jsonify', 2), ['c.htm'])
+        self.assertEqual(self.journal.claim('jsonify', 2), [])
+
+    def test_finish_hands_on(self):
+        self.journal.add('jsonify', ['a.htm'])
+        self.journal.claim('jsonify')
+        self.journal.finish('jsonify', ['a.htm'], 'import', ['a.json'])
+
+        self.assertEqual(self.journal.get_counts('jsonify')['done'], 1)
+        self.assertEqual(list(self.journal.iter_claims('import')), ['a.json'])
+
+    def test_seed_keeps_journaled_items(self):
+        self.journal.add('jsonify', ['a.htm'])
+        self.journal.claim('jsonify')
+        self.journal.finish('jsonify', ['a.htm'])
+        self.assertFalse(self.journal.is_seeded('jsonify'))
+
+        self.journal.seed('jsonify', ['a.htm', 'b.htm'])
+        self.assertTrue(self.journal.is_seeded('jsonify'))
+        self.assertEqual(self.journal.claim('jsonify'), ['b.htm'])
+
+    def test_fail_and_retry(self):
+        self.journal.add('jsonify', ['a.htm'])
+        self.journal.claim('jsonify')
+        self.journal.fail('jsonify', 'a.htm', 'ValueError')
+        self.assertEqual(self.journal.claim('jsonify'), [])
+
+        self.assertEqual(self.journal.retry_failed('jsonify'), 1)
+        self.assertEqual(self.journal.claim('jsonify'), ['a.htm'])
+
+    def test_recover_crashed_claims(self):
+        self.journal.add('jsonify', ['a.htm', 'b.htm', 'c.htm'])
+        self._claim_and_crash('jsonify', 2)
+        self.assertEqual(self.journal.get_counts('jsonify')['claimed'], 2)
+
+        self.assertEqual(self.journal.recover('jsonify'), 2)
+        self.assertEqual(self.journal.get_counts('jsonify')['claimed'], 0)
+        self.assertEqual(self.journal.claim('jsonify'), ['a.htm', 'b.htm', 'c.htm'])
+
+    def test_recover_keeps_running_claims(self):
+        self.journal.add('jsonify', ['a.htm', 'b.htm'])
+        self.journal.claim('jsonify', 1)
+        self._claim_and_crash('jsonify', 1)
+
+        self.assertEqual(self.journal.recover('jsonify'), 1)
+        self.assertEqual(self.journal.claim('jsonify'), ['b.htm'])
+
+    def test_recover_keeps_other_hosts_claims(self):
+        self.journal.add('jsonify', ['a.htm'])
+        self.journal.claim('jsonify')
+        conn = self.journal._get_conn()
+        conn.execute("UPDATE items SET worker = 'elsewhere.example:1'")
+
+        self.assertEqual(self.journal.recover('jsonify'), 0)
+        self.assertEqual(self.journal.get_counts('jsonify')['claimed'], 1)
+
+    def test_release(self):
+        self.journal.add('import', ['a.json', 'b.json'])
+        self.journal.claim('import')
+        self.assertEqual(self.journal.release('import'), 2)
+        self.assertEqual(self.journal.get_counts('import')['ready'], 2)
+
+if(__name__ == '__main__'):
+    unittest.main()
@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+
+"""Tests for langdetect_kcna's offline detector and its verdict cache."""
+
+import os
+import re
+import shutil
+import sys
+import tempfile
+import unittest
+
+SCRIPT_ROOT = os.path.dirname(os.path.realpath(__file__))
+PROJECT_ROOT_REGEX = re.search("^(.*)/src/.*$", SCRIPT_ROOT)
+PROJECT_ROOT = PROJECT_ROOT_REGEX.group(1)
+
+sys.path.append(os.path.join(PROJECT_ROOT, 'src'))
+sys.path.append(os.path.join(PROJECT_ROOT, 'src/collectors/collector_kcna'))
+import langdetect_kcna
+
+# _get_samples returns enough training samples to trust verdicts from, made
+#  from the seed samples
+def _get_samples(count=langdetect_kcna.NgramDetector.MIN_TRAINING_SAMPLES):
+    return dict((language, [texts[i % len(texts)] for i in range(count)])
+                for language, texts in langdetect_kcna.SEED_SAMPLES.items())
+
+# _FixedDetector always gives the same verdict, under the cache key given
+class _FixedDetector(langdetect_kcna.Detector):
+    name = 'fixed'
+
+    def __init__(self, language, cache_key):
+        self.language = language
+        self.cache_key = cache_key
+        self.calls = 0
+
+    def detect(self, text):
+        self.calls += 1
+        return self.language
+
+class NgramDetectorTest(unittest.TestCase):
+
+    def test_seed_samples_alone_detect_nothing(self):
+        detector = langdetect_kcna.NgramDetector.train(langdetect_kcna.SEED_SAMPLES)
+        self.assertFalse(detector.is_trained())
+        self.assertEqual(detector.detect("Saludo al Presidente de un pais amigo"), '')
+        self.assertEqual(detector.detect("Kim Jong Un Inspects Construction Site"), '')
+
+    def test_confident_verdicts(self):
+        detector = langdetect_kcna.NgramDetector.train(_get_samples())
+        self.assertEqual(detector.detect("Declaracion del portavoz de la delegacion del pais"), 'es')
+        self.assertEqual(detector.detect("Statement of the delegation of the country on the situation"), 'en')
+
+    def test_short_titles_are_undetermined(self):
+        detector = langdetect_kcna.NgramDetector.train(_get_samples())
+        self.assertEqual(detector.detect("Japan"), '')
+        self.assertEqual(detector.detect("U.S. Imperialists Accused"), '')
+
+    def test_function_words_veto_verdicts(self):
+        detector = langdetect_kcna.NgramDetector.train(_get_samples())
+        # spanish looking words, but english function words
+        self.assertNotEqual(detector.detect("the delegacion of the pueblo and the partido"), 'es')
+
+    def test_save_and_load(self):
+        detector = langdetect_kcna.NgramDetector.train(_get_samples())
+        root = tempfile.mkdtemp()
+        try:
+            model_path = os.path.join(root, 'model.json')
+            detector.save(model_path)
+            loaded = langdetect_kcna.NgramDetector.load(model_path)
+            self.assertEqual(loaded.cache_key, detector.cache_key)
+
+            # models saved by an older version need retraining
+            with open(model_path, 'w') as f:
+                f.write('{"en": {"": -1.0}, "es": {"": -1.0}}')
+            self.assertIsNone(langdetect_kcna.NgramDetector.load(model_path))
+        finally:
+            shutil.rmtree(root)
+
+    def test_retraining_changes_cache_key(self):
+        first = langdetect_kcna.NgramDetector.train(_get_samples())
+        second = langdetect_kcna.NgramDetector.train(_get_samples(150))
+        self.assertNotEqual(first.cache_key, second.cache_key)
+
+class IsCleanSampleTest(unittest.TestCase):
+
+    def test_is_clean_sample(self):
+        self.assertTrue(langdetect_kcna.is_clean_sample('es', "Saludo al Presidente de un pais amigo"))
+        self.assertFalse(langdetect_kcna.is_clean_sample('es', "Greetings to the President of a Friendly Country"))
+        self.assertTrue(langdetect_kcna.is_clean_sample('en', "Greetings to the President of a Friendly Country"))
+        # too short to tell, so learnt from by neither language
+        self.assertFalse(langdetect_kcna.is_clean_sample('es', "U.S. Imperialists Accused"))
+        self.assertFalse(langdetect_kcna.is_clean_sample('en', "U.S. Imperialists Accused"))
+
+class CachedDetectorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.cache_path = os.path.join(self.root, 'cache.sqlite')
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_verdicts_are_cached_per_model(self):
+        wrong = _FixedDetector('es', 'fixed:1')
+        cached = langdetect_kcna.CachedDetector(wrong, self.cache_path)
+        self.assertEqual(cached.detect(u"Japan"), 'es')
+        self.assertEqual(cached.detect(u"Japan"), 'es')
+        self.assertEqual(wrong.calls, 1)
+
+        # a retrained model doesn't see the old model's verdicts
+        right = _FixedDetector('en', 'fixed:2')
+        self.assertEqual(langdetect_kcna.CachedDetector(right, self.cache_path).detect(u"Japan"), 'en')
+
+    def test_undetermined_verdicts_are_not_cached(self):
+        undetermined = _FixedDetector('', 'fixed:1')
+        cached = langdetect_kcna.CachedDetector(undetermined, self.cache_path)
+        cached.detect(u"Japan")
+        cached.detect(u"Japan")
+        self.assertEqual(undetermined.calls, 2)
+
+if(__name__ == '__main__'):
+    unittest.main()
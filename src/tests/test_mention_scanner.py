@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+
+"""Tests for mention_scanner's matching of country aliases against token streams."""
+
+import os
+import re
+import sys
+import unittest
+
+SCRIPT_ROOT = os.path.dirname(os.path.realpath(__file__))
+PROJECT_ROOT_REGEX = re.search("^(.*)/src/.*$", SCRIPT_ROOT)
+PROJECT_ROOT = PROJECT_ROOT_REGEX.group(1)
+
+sys.path.append(os.path.join(PROJECT_ROOT, 'src'))
+sys.path.append(os.path.join(PROJECT_ROOT, 'src/reporters/reporter_kcna'))
+from mention_scanner import MentionScanner
+from nkir import tokens as nkir_tokens
+
+# as map_countries_kcna._get_countries reads them from
+#  admin3-country-aliases.txt
+COUNTRIES = {
+    'USA': ['United States', 'U.S.A.', 'U.S.', 'USA', 'US'],
+    'GBR': ['United Kingdom', 'UK'],
+    'KOR': ['Korea, Republic Of', 'South Korea'],
+    'PRK': ['North Korea', 'DPRK', 'Korea!North Korea!South Korea'],
+    'GNB': ['Guinea-Bissau'],
+    'GIN': ['Guinea!Guinea-Bissau!Papua New Guinea'],
+}
+
+class MentionScannerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.scanner = MentionScanner(COUNTRIES)
+
+    # _scan returns the sorted country codes scanner finds in fields, a list
+    #  of strings
+    def _scan(self, *fields):
+        return sorted(self.scanner.scan(nkir_tokens.get_stream(list(fields))))
+
+    def test_alias_any_case(self):
+        self.assertEqual(self._scan(u"talks with the united states"), ['USA'])
+        self.assertEqual(self._scan(u"UNITED KINGDOM delegation"), ['GBR'])
+
+    def test_capitals_alias_exact(self):
+        self.assertEqual(self._scan(u"the US imperialists"), ['USA'])
+        self.assertEqual(self._scan(u"U.S. warmongers"), ['USA'])
+        self.assertEqual(self._scan(u"they told us of the uk"), [])
+        self.assertEqual(self._scan(u"Us and Uk"), [])
+
+    def test_negative_context(self):
+        self.assertEqual(self._scan(u"the reunification of Korea"), ['PRK'])
+        self.assertEqual(self._scan(u"puppets of South Korea"), ['KOR'])
+        self.assertEqual(self._scan(u"south korea and north korea"), ['KOR', 'PRK'])
+        self.assertEqual(self._scan(u"South Korea, and Korea"), ['KOR', 'PRK'])
+
+    def test_negative_context_longer_each_side(self):
+        self.assertEqual(self._scan(u"envoy of Guinea-Bissau"), ['GNB'])
+        self.assertEqual(self._scan(u"Papua New Guinea"), [])
+        self.assertEqual(self._scan(u"Guinea and Papua New Guinea"), ['GIN'])
+
+    def test_phrase_not_across_fields(self):
+        self.assertEqual(self._scan(u"talks with the United", u"States"), [])
+
+    def test_empty(self):
+        self.assertEqual(self._scan(), [])
+        self.assertEqual(self.scanner.scan(u""), set())
+
+if(__name__ == '__main__'):
+    unittest.main()
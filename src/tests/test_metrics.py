@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+
+"""Tests for nkir.metrics' snapshots and merges across worker processes and threads."""
+
+import multiprocessing
+import os
+import re
+import sys
+import threading
+import unittest
+
+SCRIPT_ROOT = os.path.dirname(os.path.realpath(__file__))
+PROJECT_ROOT_REGEX = re.search("^(.*)/src/.*$", SCRIPT_ROOT)
+PROJECT_ROOT = PROJECT_ROOT_REGEX.group(1)
+
+sys.path.append(os.path.join(PROJECT_ROOT, 'src'))
+from nkir import metrics
+
+# _work counts and times one job, handing back its metrics, as a pool
+#  worker does
+def _work(job):
+    metrics.count('test.jobs')
+    with metrics.timer('test.job'):
+        pass
+    return metrics.snapshot()
+
+class MetricsTest(unittest.TestCase):
+
+    def setUp(self):
+        metrics.reset()
+
+    def tearDown(self):
+        metrics.reset()
+
+    def test_snapshot_resets(self):
+        metrics.count('test.jobs', 2)
+        self.assertEqual(metrics.snapshot()['counters'], {'test.jobs': 2})
+        self.assertEqual(metrics.snapshot(), {'timers': {}, 'counters': {}})
+
+    def test_pool_workers_hand_back_only_their_own(self):
+        metrics.count('test.parent')
+        with metrics.timer('test.parent'):
+            pass
+
+        pool = multiprocessing.Pool(2, initializer=metrics.reset)
+        try:
+            for worker_metrics in pool.map(_work, range(4)):
+                metrics.merge(worker_metrics)
+        finally:
+            pool.close()
+            pool.join()
+
+        summary = metrics.get_summary()
+        self.assertEqual(summary['counters'], {'test.parent': 1, 'test.jobs': 4})
+        self.assertEqual(summary['timers']['test.parent']['calls'], 1)
+        self.assertEqual(summary['timers']['test.job']['calls'], 4)
+
+    # as service_kcna's stages do, some threads counting while another
+    #  snapshots and merges back what it's counted
+    def test_threads(self):
+        def count():
+            for i in range(5000):
+                metrics.count('test.counted')
+                with metrics.timer('test.timed'):
+                    pass
+
+        def snapshot_and_merge():
+            for i in range(2000):
+                metrics.merge(_work(i))
+
+        threads = [threading.Thread(target=count) for i in range(3)]
+        threads.append(threading.Thread(target=snapshot_and_merge))
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        summary = metrics.get_summary()
+        self.assertEqual(summary['counters'], {'test.counted': 15000, 'test.jobs': 2000})
+        self.assertEqual(summary['timers']['test.timed']['calls'], 15000)
+        self.assertEqual(summary['timers']['test.job']['calls'], 2000)
+
+if(__name__ == '__main__'):
+    unittest.main()
@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+
+"""Tests for queuer_kcna's queueing of articles changed between mirror commits."""
+
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+SCRIPT_ROOT = os.path.dirname(os.path.realpath(__file__))
+PROJECT_ROOT_REGEX = re.search("^(.*)/src/.*$", SCRIPT_ROOT)
+PROJECT_ROOT = PROJECT_ROOT_REGEX.group(1)
+
+sys.path.append(os.path.join(PROJECT_ROOT, 'src'))
+sys.path.append(os.path.join(PROJECT_ROOT, 'src/collectors/collector_kcna'))
+import queuer_kcna
+
+GIT_ENV = dict(os.environ, GIT_AUTHOR_NAME='test', GIT_AUTHOR_EMAIL='test@localhost',
+               GIT_COMMITTER_NAME='test', GIT_COMMITTER_EMAIL='test@localhost')
+
+class QueueChangedArticlesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.saved = dict((name, getattr(queuer_kcna, name)) for name in
+                          ['MIRROR_ROOT', 'JSON_INBOX_ROOT', 'LAST_COMMIT_PATH', 'JOURNAL_PATH', 'LINK_ARTICLES'])
+        queuer_kcna.MIRROR_ROOT = os.path.join(self.root, 'mirror')
+        queuer_kcna.JSON_INBOX_ROOT = os.path.join(self.root, 'inbox_json')
+        queuer_kcna.LAST_COMMIT_PATH = os.path.join(self.root, 'queuer_kcna.last_commit')
+        queuer_kcna.JOURNAL_PATH = os.path.join(self.root, 'journal_kcna.sqlite')
+
+        os.makedirs(queuer_kcna.MIRROR_ROOT)
+        self._git('init', '-q')
+        self.first_commit = self._commit({'item/2008/200810/news01/20081001-01ee.html': "first",
+                                          'item/1997/9701/news1/01.htm': "old style"})
+        self.second_commit = self._commit({'item/2008/200810/news02/20081002-01ee.html': "second"})
+
+    def tearDown(self):
+        for name, value in self.saved.items():
+            setattr(queuer_kcna, name, value)
+        shutil.rmtree(self.root)
+
+    def _git(self, *args):
+        subprocess.check_call(['git'] + list(args), cwd=queuer_kcna.MIRROR_ROOT, env=GIT_ENV)
+
+    # _commit writes files, looking like {path: content}, to our mirror and
+    #  commits them, returning the commit
+    def _commit(self, files):
+        for path, content in files.items():
+            path = os.path.join(queuer_kcna.MIRROR_ROOT, path)
+            if not os.path.exists(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with open(path + '.partial', 'w') as f:
+                f.write(content)
+            os.rename(path + '.partial', path)
+        self._git('add', '-A')
+        self._git('commit', '-q', '-m', 'mirror')
+        return queuer_kcna._git('rev-parse', 'HEAD').strip()
+
+    def test_first_run_queues_everything(self):
+        queued = queuer_kcna.queue_changed_articles()
+        self.assertEqual(sorted(queued), ['19970101-00ee.html', '20081001-01ee.html', '20081002-01ee.html'])
+        self.assertEqual(queuer_kcna._get_last_commit(), self.second_commit)
+        self.assertEqual(queuer_kcna.queue_changed_articles(), [])
+
+    def test_articles_are_linked(self):
+        queuer_kcna.queue_changed_articles()
+        mirrored = os.stat(os.path.join(queuer_kcna.MIRROR_ROOT, 'item/2008/200810/news01/20081001-01ee.html'))
+        queued = os.stat(os.path.join(queuer_kcna.JSON_INBOX_ROOT, '20081001-01ee.html'))
+        self.assertEqual(mirrored.st_ino, queued.st_ino)
+
+    def test_articles_are_copied(self):
+        queuer_kcna.LINK_ARTICLES = False
+        queuer_kcna.queue_changed_articles()
+        mirrored_path = os.path.join(queuer_kcna.MIRROR_ROOT, 'item/2008/200810/news01/20081001-01ee.html')
+        queued_path = os.path.join(queuer_kcna.JSON_INBOX_ROOT, '20081001-01ee.html')
+        self.assertNotEqual(os.stat(mirrored_path).st_ino, os.stat(queued_path).st_ino)
+
+        # as wget rewrites files in place
+        with open(mirrored_path, 'w') as f:
+            f.write("rewritten")
+        with open(queued_path) as f:
+            self.assertEqual(f.read(), "first")
+
+    def test_upgrade_records_head(self):
+        os.makedirs(os.path.join(queuer_kcna.JSON_INBOX_ROOT, 'archive'))
+        open(os.path.join(queuer_kcna.JSON_INBOX_ROOT, 'archive', '20081001-01ee.html'), 'w').close()
+
+        self.assertEqual(queuer_kcna.queue_changed_articles(), [])
+        self.assertEqual(queuer_kcna._get_last_commit(), self.second_commit)
+
+    def test_since(self):
+        queued = queuer_kcna.queue_changed_articles(since=self.first_commit)
+        self.assertEqual(queued, ['20081002-01ee.html'])
+        self.assertEqual(queuer_kcna._get_last_commit(), self.second_commit)
+
+if(__name__ == '__main__'):
+    unittest.main()
@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+
+"""Tests for service_kcna's scans for work and its inotify watcher's waits."""
+
+import logging
+import os
+import re
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+SCRIPT_ROOT = os.path.dirname(os.path.realpath(__file__))
+PROJECT_ROOT_REGEX = re.search("^(.*)/src/.*$", SCRIPT_ROOT)
+PROJECT_ROOT = PROJECT_ROOT_REGEX.group(1)
+
+sys.path.append(os.path.join(PROJECT_ROOT, 'src'))
+sys.path.append(os.path.join(PROJECT_ROOT, 'src/collectors/collector_kcna'))
+import service_kcna
+from nkir import journal
+
+# _FakeNotifier stands in for a pyinotify Notifier, never having events
+#  (unless given some), and recording the timeouts it's checked with
+class _FakeNotifier(object):
+
+    def __init__(self, watch_manager):
+        self.events = 0
+        self.timeouts = []
+
+    def check_events(self, timeout=None):
+        self.timeouts.append(timeout)
+        if self.events:
+            return True
+        time.sleep(timeout / 1000.0)
+        return False
+
+    def read_events(self):
+        self.events -= 1
+
+    def process_events(self):
+        pass
+
+    def stop(self):
+        pass
+
+# _FakeWatchManager stands in for a pyinotify WatchManager, recording the
+#  directories watched
+class _FakeWatchManager(object):
+
+    def __init__(self):
+        self.watched = {}
+        self.next_wd = 1
+
+    def add_watch(self, path, mask):
+        if not os.path.isdir(path):
+            raise OSError("can't watch {}, which doesn't exist".format(path))
+        self.watched[self.next_wd] = path
+        self.next_wd += 1
+        return {path: self.next_wd - 1}
+
+    def rm_watch(self, wd):
+        del self.watched[wd]
+
+# _FakePyinotify stands in for the pyinotify module, which is optional
+class _FakePyinotify(object):
+    IN_CLOSE_WRITE = 1
+    IN_MOVED_TO = 2
+    IN_CREATE = 4
+    WatchManager = _FakeWatchManager
+    Notifier = _FakeNotifier
+
+class _FakePyinotifyTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self._pyinotify = service_kcna.pyinotify
+        service_kcna.pyinotify = _FakePyinotify
+
+    def tearDown(self):
+        service_kcna.pyinotify = self._pyinotify
+        shutil.rmtree(self.root)
+
+class InotifyWatcherTest(_FakePyinotifyTest):
+
+    def _get_watcher(self, min_interval, max_interval):
+        watcher = service_kcna.InotifyWatcher([self.root], min_interval, max_interval)
+        watcher.STOP_INTERVAL = 0.05
+        return watcher
+
+    def test_stops_without_waiting_max_interval(self):
+        watcher = self._get_watcher(0, 60)
+        stop = threading.Event()
+        threading.Timer(0.2, stop.set).start()
+
+        started = time.time()
+        watcher.wait(stop, False)
+        self.assertLess(time.time() - started, 5)
+        self.assertTrue(all(timeout == 50 for timeout in watcher.notifier.timeouts))
+
+    def test_waits_at_most_max_interval(self):
+        watcher = self._get_watcher(0, 0.12)
+        watcher.wait(threading.Event(), False)
+        self.assertEqual(watcher.notifier.timeouts, [50, 50, 20])
+
+    def test_returns_on_event(self):
+        watcher = self._get_watcher(0, 60)
+        watcher.notifier.events = 1
+        watcher.wait(threading.Event(), False)
+        self.assertEqual(watcher.notifier.events, 0)
+        self.assertEqual(len(watcher.notifier.timeouts), 1)
+
+    def test_watches_ancestor_until_path_exists(self):
+        git_root = os.path.join(self.root, 'mirror', 'www.kcna.co.jp', '.git')
+        watcher = service_kcna.InotifyWatcher([git_root], 0, 0.01)
+        self.assertFalse(os.path.exists(os.path.join(self.root, 'mirror')))
+        self.assertEqual(watcher.watch_manager.watched.values(), [self.root])
+
+        os.makedirs(os.path.join(self.root, 'mirror', 'www.kcna.co.jp'))
+        watcher.notifier.events = 1
+        watcher.wait(threading.Event(), False)
+        self.assertEqual(watcher.watch_manager.watched.values(), [os.path.dirname(git_root)])
+
+        os.makedirs(git_root)
+        watcher.wait(threading.Event(), False)
+        self.assertEqual(watcher.watch_manager.watched.values(), [git_root])
+
+class ScanTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self._mirror_root = service_kcna.queuer_kcna.MIRROR_ROOT
+        # no mirror, so nothing's queued from it
+        service_kcna.queuer_kcna.MIRROR_ROOT = os.path.join(self.root, 'mirror')
+        self.journal = journal.Journal(os.path.join(self.root, 'journal.sqlite'))
+        self.service = service_kcna.Service(None, self.journal, None, None, 2, 10, 0)
+
+    def tearDown(self):
+        service_kcna.queuer_kcna.MIRROR_ROOT = self._mirror_root
+        shutil.rmtree(self.root)
+
+    def test_claims_up_to_room(self):
+        self.journal.add('jsonify', ['a.htm', 'b.htm', 'c.htm'])
+        self.assertTrue(self.service._scan())
+        self.assertEqual(self.service.json_queue.qsize(), 2)
+        self.assertEqual(self.journal.get_counts('jsonify')['ready'], 1)
+
+    def test_full_queue_with_ready_files_is_work(self):
+        self.journal.add('jsonify', ['a.htm', 'b.htm', 'c.htm'])
+        self.service._scan()
+        # no room left, but c.htm is still waiting to be claimed
+        self.assertTrue(self.service._scan())
+        self.assertEqual(self.journal.get_counts('jsonify')['ready'], 1)
+
+    def test_no_work(self):
+        self.assertFalse(self.service._scan())
+
+    def test_mirror_without_commits(self):
+        mirror_root = service_kcna.queuer_kcna.MIRROR_ROOT
+        os.makedirs(mirror_root)
+        service_kcna.queuer_kcna._git('init', '-q')
+        self.assertFalse(self.service._scan())
+        self.assertEqual(self.service.head_commit, None)
+
+# _ErrorHandler records the messages of records logged at ERROR and above
+class _ErrorHandler(logging.Handler):
+
+    def __init__(self):
+        logging.Handler.__init__(self, logging.ERROR)
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+class ServiceWithoutMirrorTest(_FakePyinotifyTest):
+
+    def setUp(self):
+        _FakePyinotifyTest.setUp(self)
+        self._mirror_root = service_kcna.queuer_kcna.MIRROR_ROOT
+        service_kcna.queuer_kcna.MIRROR_ROOT = os.path.join(self.root, 'mirror', 'www.kcna.co.jp')
+        self.errors = _ErrorHandler()
+        logging.getLogger('').addHandler(self.errors)
+
+    def tearDown(self):
+        logging.getLogger('').removeHandler(self.errors)
+        service_kcna.queuer_kcna.MIRROR_ROOT = self._mirror_root
+        _FakePyinotifyTest.tearDown(self)
+
+    def test_runs_without_creating_mirror(self):
+        git_root = os.path.join(service_kcna.queuer_kcna.MIRROR_ROOT, '.git')
+        watcher = service_kcna.InotifyWatcher([git_root], 0, 0.05)
+        pipeline_journal = journal.Journal(os.path.join(self.root, 'journal.sqlite'))
+        service = service_kcna.Service(watcher, pipeline_journal, None, None, 10, 10, 0)
+
+        threading.Timer(0.3, service.stop.set).start()
+        service.run()
+
+        self.assertFalse(os.path.exists(os.path.join(self.root, 'mirror')))
+        self.assertEqual(self.errors.messages, [])
+
+if(__name__ == '__main__'):
+    unittest.main()
@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+
+"""Tests for nkir.shapes' reading of polygon shapefiles and their dBase attributes from a zip."""
+
+import os
+import re
+import shutil
+import struct
+import sys
+import tempfile
+import unittest
+import zipfile
+
+SCRIPT_ROOT = os.path.dirname(os.path.realpath(__file__))
+PROJECT_ROOT_REGEX = re.search("^(.*)/src/.*$", SCRIPT_ROOT)
+PROJECT_ROOT = PROJECT_ROOT_REGEX.group(1)
+
+sys.path.append(os.path.join(PROJECT_ROOT, 'src'))
+from nkir import shapes
+
+# a square with a square hole, nothing, and a triangle
+SHAPES = [
+    [[(0.0, 0.0), (0.0, 4.0), (4.0, 4.0), (4.0, 0.0), (0.0, 0.0)],
+     [(1.0, 1.0), (3.0, 1.0), (3.0, 3.0), (1.0, 3.0), (1.0, 1.0)]],
+    [],
+    [[(5.0, 0.0), (5.0, 1.5), (6.5, 0.0), (5.0, 0.0)]],
+]
+# (name, type, length, decimals) of each field, and each shape's values
+FIELDS = [('ADM0_A3', 'C', 3, 0), ('NAME', 'C', 12, 0), ('POP_EST', 'N', 10, 0), ('AREA', 'N', 8, 2)]
+RECORDS = [['SQR', 'Squ\xe2re', '1200', '16.00'], ['NUL', 'Nothing', '', '*******'], ['TRI', 'Triangle', '35', '1.13']]
+
+# _get_shp returns the .shp file bytes of shapes
+def _get_shp(shapes_list):
+    records = []
+    for number, rings in enumerate(shapes_list, 1):
+        if not rings:
+            content = struct.pack("<i", shapes.SHAPE_NULL)
+        else:
+            points = [point for ring in rings for point in ring]
+            parts = [sum(len(ring) for ring in rings[:i]) for i in range(len(rings))]
+            content = struct.pack("<i4d2i", shapes.SHAPE_POLYGON, 0, 0, 0, 0, len(parts), len(points))
+            content += struct.pack("<{}i".format(len(parts)), *parts)
+            content += struct.pack("<{}d".format(2 * len(points)), *[value for point in points for value in point])
+        records.append(struct.pack(">ii", number, len(content) // 2) + content)
+    body = ''.join(records)
+    header = struct.pack(">i20xi", 9994, (100 + len(body)) // 2) + struct.pack("<ii", 1000, shapes.SHAPE_POLYGON) + '\x00' * 64
+    return header + body
+
+# _get_dbf returns the .dbf file bytes of records with fields
+def _get_dbf(fields, records):
+    record_length = 1 + sum(length for _, _, length, _ in fields)
+    header_length = 32 + 32 * len(fields) + 1
+    dbf = struct.pack("<B3xIHH20x", 3, len(records), header_length, record_length)
+    for name, field_type, length, decimals in fields:
+        dbf += name.ljust(11, '\x00') + field_type + '\x00' * 4 + chr(length) + chr(decimals) + '\x00' * 14
+    dbf += '\x0d'
+    for record in records:
+        dbf += ' ' + ''.join(value.rjust(length) if field_type == 'N' else value.ljust(length)
+                             for value, (_, field_type, length, _) in zip(record, fields))
+    return dbf + '\x1a'
+
+class ReadZipTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.zip_path = os.path.join(self.root, 'countries.zip')
+        with zipfile.ZipFile(self.zip_path, 'w') as archive:
+            archive.writestr('countries.shp', _get_shp(SHAPES))
+            archive.writestr('countries.dbf', _get_dbf(FIELDS, RECORDS))
+            archive.writestr('countries.prj', 'GEOGCS["WGS 84"]')
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_shapes(self):
+        features = shapes.read_zip(self.zip_path)
+        self.assertEqual([shape for shape, _ in features], SHAPES)
+
+    def test_records(self):
+        features = shapes.read_zip(self.zip_path, name='countries')
+        self.assertEqual([attributes for _, attributes in features], [
+            {'ADM0_A3': u'SQR', 'NAME': u'Squ\xe2re', 'POP_EST': 1200, 'AREA': 16.0},
+            {'ADM0_A3': u'NUL', 'NAME': u'Nothing', 'POP_EST': None, 'AREA': None},
+            {'ADM0_A3': u'TRI', 'NAME': u'Triangle', 'POP_EST': 35, 'AREA': 1.13},
+        ])
+
+    def test_fields(self):
+        features = shapes.read_zip(self.zip_path, fields=['ADM0_A3'])
+        self.assertEqual([attributes for _, attributes in features], [{'ADM0_A3': u'SQR'}, {'ADM0_A3': u'NUL'}, {'ADM0_A3': u'TRI'}])
+
+    def test_mismatched_records(self):
+        with zipfile.ZipFile(self.zip_path, 'a') as archive:
+            archive.writestr('short.shp', _get_shp(SHAPES))
+            archive.writestr('short.dbf', _get_dbf(FIELDS, RECORDS[:2]))
+        self.assertRaises(ValueError, shapes.read_zip, self.zip_path, 'short')
+        # and with two shapefiles, one must be named
+        self.assertRaises(ValueError, shapes.read_zip, self.zip_path)
+
+if(__name__ == '__main__'):
+    unittest.main()
@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+
+"""Tests for nkir.topology's shared arcs, ring dedup, simplification, and restoring of collapsed rings."""
+
+import os
+import re
+import sys
+import unittest
+
+SCRIPT_ROOT = os.path.dirname(os.path.realpath(__file__))
+PROJECT_ROOT_REGEX = re.search("^(.*)/src/.*$", SCRIPT_ROOT)
+PROJECT_ROOT = PROJECT_ROOT_REGEX.group(1)
+
+sys.path.append(os.path.join(PROJECT_ROOT, 'src'))
+from nkir import shapes
+from nkir import topology
+
+SHAPEFILE_ZIP_PATH = os.path.join(PROJECT_ROOT, 'var/datasets/ne_110m_admin_0_countries.zip')
+
+# features as nkir.shapes reads them: outer rings clockwise, holes
+#  anticlockwise, first point repeated last
+WEST = ([[(0, 0), (0, 4), (4, 4), (4, 0), (0, 0)]], {'adm0_a3': 'WST'})
+EAST = ([[(4, 0), (4, 4), (8, 4), (8, 0), (4, 0)]], {'adm0_a3': 'EST'})
+# a country with a hole, and the country filling its hole (as Lesotho does
+#  South Africa's)
+OUTER = ([[(10, 0), (10, 8), (18, 8), (18, 0), (10, 0)],
+          [(12, 2), (16, 2), (16, 6), (12, 6), (12, 2)]], {'adm0_a3': 'OUT'})
+INNER = ([[(12, 6), (16, 6), (16, 2), (12, 2), (12, 6)]], {'adm0_a3': 'INN'})
+# a small, wiggly island, which simplifying at any useful tolerance would
+#  collapse
+ISLAND = ([[(20, 0), (20, 1), (20.5, 1.1), (21, 1), (21, 0), (20, 0)]], {'adm0_a3': 'ISL'})
+
+FEATURES = [WEST, EAST, OUTER, INNER, ISLAND]
+
+# _get_area returns twice the signed area of ring, negative if clockwise
+def _get_area(ring):
+    return sum(x0 * y1 - x1 * y0 for (x0, y0), (x1, y1) in zip(ring, ring[1:]))
+
+# _decode_arcs returns the arcs of topology decoded back to points in the
+#  features' own units
+def _decode_arcs(topology_dict):
+    (sx, sy), (tx, ty) = topology_dict["transform"]["scale"], topology_dict["transform"]["translate"]
+    arcs = []
+    for encoded in topology_dict["arcs"]:
+        x = y = 0
+        arc = []
+        for dx, dy in encoded:
+            x, y = x + dx, y + dy
+            arc.append((x * sx + tx, y * sy + ty))
+        arcs.append(arc)
+    return arcs
+
+# _decode_ring returns the ring made of arcs at indexes, as a TopoJSON reader
+#  draws it
+def _decode_ring(arcs, indexes):
+    ring = []
+    for index in indexes:
+        arc = arcs[index] if index >= 0 else arcs[~index][::-1]
+        ring.extend(arc[1:] if ring else arc)
+    return ring
+
+# _get_polygons returns {country code: [[ring arc indexes, ...], ...]}
+def _get_polygons(topology_dict):
+    polygons = {}
+    for geometry in topology_dict["objects"]["countries"]["geometries"]:
+        arcs = geometry["arcs"] if geometry["type"] == "MultiPolygon" else [geometry["arcs"]]
+        polygons[geometry["properties"]["adm0_a3"]] = arcs
+    return polygons
+
+class TopologyTest(unittest.TestCase):
+
+    def _get_topology(self, features, tolerance=0, quantization=1001):
+        return topology.get_topology(features, 'countries', quantization=quantization, tolerance=tolerance)
+
+    # _assert_rings_valid asserts every ring of topology closes, and keeps
+    #  its orientation: outer rings clockwise, holes anticlockwise
+    def _assert_rings_valid(self, topology_dict, tolerance):
+        arcs = _decode_arcs(topology_dict)
+        for code, polygons in _get_polygons(topology_dict).items():
+            for polygon in polygons:
+                for i, indexes in enumerate(polygon):
+                    ring = _decode_ring(arcs, indexes)
+                    self.assertEqual(ring[0], ring[-1], (tolerance, code))
+                    self.assertGreaterEqual(len(ring), 4, (tolerance, code))
+                    if i == 0:
+                        self.assertLess(_get_area(ring), 0, (tolerance, code))
+                    else:
+                        self.assertGreater(_get_area(ring), 0, (tolerance, code))
+
+    def test_shared_border_stored_once(self):
+        topology_dict = self._get_topology([WEST, EAST])
+        polygons = _get_polygons(topology_dict)
+        west_arcs, east_arcs = polygons['WST'][0][0], polygons['EST'][0][0]
+
+        # each square is cut at the border's ends in to the border and the rest
+        self.assertEqual(len(topology_dict["arcs"]), 3)
+        shared = [index for index in west_arcs if ~index in east_arcs]
+        self.assertEqual(len(shared), 1)
+
+        arcs = _decode_arcs(topology_dict)
+        border = arcs[shared[0]] if shared[0] >= 0 else arcs[~shared[0]]
+        self.assertEqual(sorted(border), [(4.0, 0.0), (4.0, 4.0)])
+
+    def test_ring_filling_hole_stored_once(self):
+        topology_dict = self._get_topology([OUTER, INNER])
+        polygons = _get_polygons(topology_dict)
+
+        self.assertEqual(len(polygons['OUT'][0]), 2)
+        hole = polygons['OUT'][0][1]
+        self.assertEqual(len(hole), 1)
+        self.assertEqual(polygons['INN'][0], [[~hole[0]]])
+        self.assertEqual(len(topology_dict["arcs"]), 2)
+
+    def test_rings_close_and_keep_orientation(self):
+        for tolerance in [0, 0.1, 1.0, 100.0]:
+            self._assert_rings_valid(self._get_topology(FEATURES, tolerance), tolerance)
+
+    @unittest.skipUnless(os.path.exists(SHAPEFILE_ZIP_PATH), "needs var/datasets/ne_110m_admin_0_countries.zip")
+    def test_natural_earth_rings_valid(self):
+        features = shapes.read_zip(SHAPEFILE_ZIP_PATH, fields=['adm0_a3'])
+        for tolerance in [0, 0.1, 1.0]:
+            topology_dict = self._get_topology(features, tolerance, quantization=3000)
+            self.assertEqual(len(topology_dict["objects"]["countries"]["geometries"]), len(features))
+            self._assert_rings_valid(topology_dict, tolerance)
+
+    def test_collapsed_ring_restored(self):
+        topology_dict = self._get_topology([ISLAND], tolerance=100.0)
+        arcs = _decode_arcs(topology_dict)
+        ring = _decode_ring(arcs, _get_polygons(topology_dict)['ISL'][0][0])
+        self.assertEqual(len(ring), len(ISLAND[0][0]))
+
+    def test_simplify_keeps_shared_border_shared(self):
+        # a wiggly border, simplified away, but the same for both countries
+        west = ([[(0, 0), (0, 4), (4, 4), (4.01, 2), (4, 0), (0, 0)]], {'adm0_a3': 'WST'})
+        east = ([[(4, 0), (4.01, 2), (4, 4), (8, 4), (8, 0), (4, 0)]], {'adm0_a3': 'EST'})
+        topology_dict = self._get_topology([west, east], tolerance=0.1)
+        polygons = _get_polygons(topology_dict)
+        self.assertEqual(len([index for index in polygons['WST'][0][0] if ~index in polygons['EST'][0][0]]), 1)
+
+        arcs = _decode_arcs(topology_dict)
+        self.assertEqual(sorted(len(arc) for arc in arcs), [2, 4, 4])
+
+    def test_simplify_line(self):
+        line = [(0, 0), (1, 0.05), (2, 0), (3, 2), (4, 0)]
+        self.assertEqual(topology._simplify_line(line, 0.5, (1, 1)), [(0, 0), (2, 0), (3, 2), (4, 0)])
+        self.assertEqual(topology._simplify_line(line, 5, (1, 1)), [(0, 0), (4, 0)])
+        self.assertEqual(topology._simplify_line(line, 0.01, (1, 1)), line)
+
+    def test_hole_without_outer_ring(self):
+        hole = ([[(0, 0), (4, 0), (4, 4), (0, 4), (0, 0)]], {'adm0_a3': 'HOL'})
+        topology_dict = self._get_topology([hole])
+        arcs = _decode_arcs(topology_dict)
+        self.assertLess(_get_area(_decode_ring(arcs, _get_polygons(topology_dict)['HOL'][0][0])), 0)
+
+    def test_null_shape(self):
+        topology_dict = self._get_topology([WEST, ([], {'adm0_a3': 'NUL'})])
+        geometries = topology_dict["objects"]["countries"]["geometries"]
+        self.assertEqual(geometries[1], {"type": None, "properties": {'adm0_a3': 'NUL'}})
+
+if(__name__ == '__main__'):
+    unittest.main()